@@ -52,11 +52,18 @@ function App() {
     const loadSession = async () => {
       setIsLoading(true)
       try {
-        const res = await fetch(`${API_URL}/history/${threadId}`)
-        if (res.ok) {
+        // History is keyset-paginated, follow next_cursor until the last page
+        let history = []
+        let cursor = null
+        do {
+          const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : ''
+          const res = await fetch(`${API_URL}/history/${threadId}${query}`)
+          if (!res.ok) break
           const data = await res.json()
-          setMessages(data)
-        }
+          history = history.concat(data.items)
+          cursor = data.next_cursor
+        } while (cursor)
+        setMessages(history)
       } catch (e) {
         console.error("Failed to load session", e)
         setMessages([])
@@ -1,13 +1,97 @@
-from fastapi import FastAPI
-from langchain_core.messages import HumanMessage
-from langgraph_sdk.auth.exceptions import HTTPException
+import time
+
+_import_started = time.perf_counter()
+
+import asyncio
+import importlib
+import json
+import sys
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, BackgroundTasks, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
+from typing import List, Optional
 
-from src.db_history import ensure_session, save_message, get_all_sessions, get_session_history
-from src.graph import app
+from src import result_cache, sql_cache
+from src.db_config import invalidate_schema_cache, close_db_pool, get_pool_stats, get_analytics_pool_stats
+from src.db_history import aensure_session, asave_message, aget_sessions, aget_session_history, stop_history_writer, get_writer_stats
+from src.metrics import start_request, get_request_timings, observe, render_prometheus
 from fastapi.middleware.cors import CORSMiddleware
 
-server = FastAPI(title="Text-to-Action Analyst API")
+# --- Deferred LLM stack ---
+# LangChain, LangGraph, OpenAI and SQLAlchemy take seconds to import, so this module does not import
+# them. The lifespan starts warm_up() in the background: it imports them off the event loop, compiles
+# the graph and opens the checkpointer. Meanwhile the worker already serves /history, /metrics and
+# /ready. Endpoints that run the graph wait for the warm-up (require_stack) and then import what they
+# need locally; those imports are free by then.
+
+STACK_MODULES = ["src.graph", "src.batch", "src.approvals", "src.rollups"]
+
+_warmup = None
+_startup = {"ready" : False, "error" : None, "seconds" : {}}
+
+
+async def warm_up():
+    """
+    Imports the LLM stack, compiles the graph (opening the checkpointer) and starts the rollup refresher.
+    Each phase's duration is reported by /ready.
+    """
+    seconds = _startup["seconds"]
+    try:
+        started = time.perf_counter()
+        for module in STACK_MODULES:
+            await asyncio.to_thread(importlib.import_module, module)
+        seconds["import_stack"] = round(time.perf_counter() - started, 3)
+
+        from src.graph import get_app
+        from src import rollups
+
+        started = time.perf_counter()
+        await get_app()
+        seconds["open_graph"] = round(time.perf_counter() - started, 3)
+
+        rollups.start_rollup_refresher()
+    except Exception as ex:
+        print(f"❌ Warm-up failed: {ex}")
+        _startup["error"] = str(ex)
+        raise
+
+    _startup.update(ready=True, error=None)
+    print(f"✅ LLM stack ready: {seconds}")
+
+
+async def require_stack():
+    """
+    Waits until the warm-up has finished, starting it again if it failed (or never ran, e.g. without a lifespan).
+    """
+    global _warmup
+
+    if _warmup is None or (_warmup.done() and (_warmup.cancelled() or _warmup.exception())):
+        _warmup = asyncio.create_task(warm_up())
+
+    try:
+        await asyncio.shield(_warmup)
+    except Exception as ex:
+        raise HTTPException(status_code=503, detail=f"Service is not ready: {ex}")
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    global _warmup
+
+    _warmup = asyncio.create_task(warm_up())
+    yield
+    # Release pooled checkpoint / history-store / analytics connections on shutdown
+    _warmup.cancel()
+    if "src.rollups" in sys.modules:
+        sys.modules["src.rollups"].stop_rollup_refresher()
+    if "src.graph" in sys.modules:
+        await sys.modules["src.graph"].close_app()
+    stop_history_writer()
+    close_db_pool()
+
+server = FastAPI(title="Text-to-Action Analyst API", lifespan=lifespan)
 
 server.add_middleware(
     CORSMiddleware,
@@ -17,46 +101,128 @@ server.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
+@server.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+
+    # Label by route template (/history/{thread_id}), not the raw path, to keep cardinality bounded
+    route = request.scope.get("route")
+    observe(
+        "analyst_request_duration_seconds",
+        time.perf_counter() - started,
+        endpoint=route.path if route else "unmatched",
+        method=request.method,
+        status=response.status_code
+    )
+    return response
+
 class ChatRequest(BaseModel):
     message: str
     thread_id : str
 
+class BatchItem(BaseModel):
+    message: str
+    thread_id : Optional[str] = None
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    concurrency : Optional[int] = None
+
 class ApprovalRequest(BaseModel):
     thread_id: str
     approved: bool
+    idempotency_key : Optional[str] = None
+
+class BulkApprovalRequest(BaseModel):
+    action_ids: List[str]
+    approved: bool
+    idempotency_key : Optional[str] = None
+
+class ExpireRequest(BaseModel):
+    action_ids : Optional[List[str]] = None
+    older_than_seconds : Optional[int] = None
+
+def build_chat_response(snapshot):
+    """
+    Extracts the client-facing fields from a graph state snapshot.
+    """
+    query_result = snapshot.values.get("query_result") or {}
+
+    return {
+        "sql_query" : snapshot.values.get("sql_query"),
+        "columns" : query_result.get("columns"),
+        "row_count" : query_result.get("row_count"),
+        "total_rows" : query_result.get("total_rows"),
+        "truncated" : query_result.get("truncated", False),
+        "visualization_spec" : snapshot.values.get("visualization_spec"),
+        "email_draft" : snapshot.values.get("email_draft"),
+        "needs_approval" : snapshot.values.get("needs_approval",False),
+        "next_step" : snapshot.next if snapshot.next else None,
+        "cache_hit" : snapshot.values.get("cache_hit", False)
+    }
+
+async def track_approval(thread_id : str, snapshot):
+    """
+    Records a paused run's email in the approval queue (returns its action_id), or retires the
+    thread's earlier pending action. Best effort: /approve also finds paused threads that were not recorded.
+    """
+    from src.approvals import atrack_pending_action
+
+    try:
+        return await atrack_pending_action(thread_id, snapshot)
+    except Exception as ex:
+        print(f"⚠️ Approval tracking failed for {thread_id}: {ex}")
+        return None
+
+def sse_event(event : str, data) -> str:
+    """
+    Formats a single Server-Sent Event frame.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
 
 @server.post("/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
     """
     Run the graph until completion or interruption.
     """
+    start_request()
+    await require_stack()
+    from langchain_core.messages import HumanMessage
+    from src.checkpoint import prune_thread
+    from src.graph import get_app
 
     config = {"configurable" : {"thread_id" : request.thread_id}}
-    ensure_session(request.thread_id, title=f"Analysis: {request.message[:20]}...")
-    save_message(request.thread_id, "user", request.message)
+    await aensure_session(request.thread_id, title=f"Analysis: {request.message[:20]}...")
+    await asave_message(request.thread_id, "user", request.message)
 
     inputs = {"messages" : [HumanMessage(content=request.message)]}
+    app = await get_app()
 
     try:
-        for _ in app.stream(inputs, config=config):
+        async for _ in app.astream(inputs, config=config):
             pass
 
-        snapshot = app.get_state(config)
+        snapshot = await app.aget_state(config)
+        response = build_chat_response(snapshot)
 
-        response = {
-            "sql_query" : snapshot.values.get("sql_query"),
-            "visualization_spec" : snapshot.values.get("visualization_spec"),
-            "email_draft" : snapshot.values.get("email_draft"),
-            "needs_approval" : snapshot.values.get("needs_approval",False),
-            "next_step" : snapshot.next if snapshot.next else None
-        }
+        # A paused run is queued for approval before answering; otherwise the thread's
+        # earlier pending action (if any) is retired after the response
+        action_id = None
+        if snapshot.next:
+            action_id = await track_approval(request.thread_id, snapshot)
+        else:
+            background_tasks.add_task(track_approval, request.thread_id, snapshot)
 
         ai_content = "I've analyzed the data for you." if response["sql_query"] else "I processed your request."
-        save_message(request.thread_id, "assistant", ai_content, response)
+        await asave_message(request.thread_id, "assistant", ai_content, response)
+        background_tasks.add_task(prune_thread, request.thread_id)
 
         final_response = {
             "status" : "paused" if snapshot.next else "completed",
-            **response
+            **response,
+            "action_id" : action_id,
+            "timings" : get_request_timings()
         }
 
         return final_response
@@ -64,48 +230,356 @@ async def chat(request: ChatRequest):
     except Exception as ex:
         raise HTTPException(status_code=500,detail=str(ex))
 
+@server.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Same as /chat, but streams progress as Server-Sent Events:
+    - `token` : LLM text chunks as they are generated ({"node", "content"})
+    - `node`  : a node's state update as soon as it finishes ({"node", "update"})
+    - `done`  : the final /chat response payload
+    - `error` : {"detail"} if the run failed
+    """
+    await require_stack()
+    from langchain_core.messages import AIMessageChunk, HumanMessage
+    from src.checkpoint import prune_thread
+    from src.graph import get_app
+
+    config = {"configurable" : {"thread_id" : request.thread_id}}
+    await aensure_session(request.thread_id, title=f"Analysis: {request.message[:20]}...")
+    await asave_message(request.thread_id, "user", request.message)
+
+    inputs = {"messages" : [HumanMessage(content=request.message)]}
+    app = await get_app()
+
+    async def event_generator():
+        start_request()
+        try:
+            async for mode, payload in app.astream(inputs, config=config, stream_mode=["messages", "updates"]):
+                if mode == "messages":
+                    chunk, metadata = payload
+                    # Only streamed LLM output; messages a node writes to the state arrive whole
+                    if isinstance(chunk, AIMessageChunk) and chunk.content:
+                        yield sse_event("token", {"node" : metadata.get("langgraph_node"), "content" : chunk.content})
+                else:
+                    for node, update in payload.items():
+                        # Interrupts are reported as a pseudo-node, the final snapshot covers them
+                        if node.startswith("__"):
+                            continue
+                        yield sse_event("node", {"node" : node, "update" : update})
+
+            snapshot = await app.aget_state(config)
+            response = build_chat_response(snapshot)
+            action_id = await track_approval(request.thread_id, snapshot) if snapshot.next else None
+
+            ai_content = "I've analyzed the data for you." if response["sql_query"] else "I processed your request."
+            await asave_message(request.thread_id, "assistant", ai_content, response)
+
+            yield sse_event("done", {
+                "status" : "paused" if snapshot.next else "completed",
+                **response,
+                "action_id" : action_id,
+                "timings" : get_request_timings()
+            })
+
+            if not snapshot.next:
+                await track_approval(request.thread_id, snapshot)
+
+        except Exception as ex:
+            yield sse_event("error", {"detail" : str(ex)})
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control" : "no-cache", "X-Accel-Buffering" : "no"},
+        background=BackgroundTask(prune_thread, request.thread_id)
+    )
+
+@server.post("/chat/batch")
+async def chat_batch(request: BatchRequest):
+    """
+    Runs many questions concurrently and streams each result as Server-Sent Events as soon as it is ready:
+    - `result` : {"index", "message", "thread_id", "status", ...same fields as /chat..., "duplicate_of"}
+    - `done` : {"items", "completed", "paused", "failed"} once every item has been reported
+
+    Identical questions (without a thread_id) are answered once, identical SQL is executed once,
+    and at most `concurrency` items (default BATCH_CONCURRENCY) run at the same time.
+    """
+    await require_stack()
+    from src.batch import BATCH_MAX_ITEMS, run_batch
+    from src.checkpoint import prune_thread
+
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No items")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+
+    items = [{"question" : item.message, "thread_id" : item.thread_id} for item in request.items]
+    threads = []
+    actions = {}  # thread_id -> action_id of its pending approval
+
+    async def event_generator():
+        counts = {"completed" : 0, "paused" : 0, "failed" : 0}
+
+        async for outcome in run_batch(items, request.concurrency):
+            snapshot = outcome["snapshot"]
+            if snapshot is None:
+                status, response = "failed", {"detail" : outcome["error"]}
+            else:
+                status, response = ("paused" if snapshot.next else "completed"), build_chat_response(snapshot)
+
+            # Copies of a deduplicated question share the first one's thread, it is stored once
+            if outcome["duplicate_of"] is None:
+                threads.append(outcome["thread_id"])
+                # New batch threads have nothing to retire, only paused runs and client threads are tracked
+                if snapshot is not None and (snapshot.next or items[outcome["index"]]["thread_id"]):
+                    actions[outcome["thread_id"]] = await track_approval(outcome["thread_id"], snapshot)
+                await aensure_session(outcome["thread_id"], title=f"Batch: {outcome['question'][:20]}...")
+                await asave_message(outcome["thread_id"], "user", outcome["question"])
+                if snapshot is not None:
+                    ai_content = "I've analyzed the data for you." if response["sql_query"] else "I processed your request."
+                    await asave_message(outcome["thread_id"], "assistant", ai_content, response)
+
+            counts[status] += 1
+            yield sse_event("result", {
+                "index" : outcome["index"],
+                "message" : outcome["question"],
+                "thread_id" : outcome["thread_id"],
+                "status" : status,
+                **response,
+                "action_id" : actions.get(outcome["thread_id"]),
+                "duplicate_of" : outcome["duplicate_of"],
+                "timings" : outcome["timings"]
+            })
+
+        yield sse_event("done", {"items" : len(items), **counts})
+
+    async def prune_threads():
+        for thread_id in threads:
+            await prune_thread(thread_id)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control" : "no-cache", "X-Accel-Buffering" : "no"},
+        background=BackgroundTask(prune_threads)
+    )
+
 @server.post("/approve")
 async def approve(request: ApprovalRequest):
     """
-    Resumes the graph execution after human review.
+    Approves or rejects the pending action of a thread (e.g. sending an email) and, if approved,
+    resumes the graph from the checkpoint it paused at. Works from any worker; retrying with the
+    same idempotency_key returns the original outcome instead of a conflict.
     """
-    config = {"configurable" : {"thread_id" : request.thread_id}}
+    await require_stack()
+    from src.approvals import afind_thread_action, decide_actions
 
-    if not request.approved:
-        return {"status" : "cancelled","message" : "Action rejected by user"}
+    try:
+        action_id = await afind_thread_action(request.thread_id)
+        if action_id is None:
+            raise HTTPException(status_code=404, detail="No pending action for this thread")
+
+        result, = await decide_actions([action_id], request.approved, request.idempotency_key)
+    except HTTPException:
+        raise
+    except Exception as ex:
+        raise HTTPException(status_code=500,detail=str(ex))
+
+    if result["outcome"] in ("claimed", "replayed"):
+        if result["status"] == "sent":
+            return {"status" : "completed", "message" : "Email sent successfully", "action_id" : action_id}
+        if result["status"] == "rejected":
+            return {"status" : "cancelled", "message" : "Action rejected by user", "action_id" : action_id}
+        if result["status"] == "failed":
+            raise HTTPException(status_code=500, detail=result["error"])
+    if result["outcome"] == "expired":
+        raise HTTPException(status_code=410, detail="The pending action has expired")
+
+    raise HTTPException(status_code=409, detail=f"The action is {result['status']}" + (f": {result['error']}" if result["error"] else ""))
+
+@server.get("/approvals")
+async def list_approvals(status: str = "pending", limit: int = Query(50, ge=1, le=500), cursor: str = None):
+    """
+    Fetches a page of actions with the given status (default: pending), oldest first: {"items", "next_cursor"}.
+    """
+    await require_stack()
+    from src.approvals import alist_actions
 
     try:
-        for _ in app.stream(None, config=config):
-            pass
+        return await alist_actions(status, limit, cursor)
+    except ValueError as ex:
+        raise HTTPException(status_code=400,detail=str(ex))
+    except Exception as ex:
+        raise HTTPException(status_code=500,detail=str(ex))
 
-        return{
-            "status" : "completed",
-            "message" : "Email sent successfully"
-        }
+@server.post("/approvals/decide")
+async def decide_approvals(request: BulkApprovalRequest):
+    """
+    Approves or rejects many pending actions in one call. Approved threads are resumed concurrently
+    (at most APPROVAL_CONCURRENCY at a time). Returns one result per action plus counts by status.
+    """
+    await require_stack()
+    from src.approvals import APPROVAL_MAX_BATCH, decide_actions
+
+    if not request.action_ids:
+        raise HTTPException(status_code=400, detail="No action_ids")
+    if len(request.action_ids) > APPROVAL_MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {APPROVAL_MAX_BATCH} actions per call")
+
+    try:
+        results = await decide_actions(request.action_ids, request.approved, request.idempotency_key)
+    except Exception as ex:
+        raise HTTPException(status_code=500,detail=str(ex))
+
+    counts = {}
+    for result in results:
+        key = result["status"] or result["outcome"]
+        counts[key] = counts.get(key, 0) + 1
+
+    return {"results" : results, "counts" : counts}
+
+@server.post("/approvals/expire")
+async def expire_approvals(request: ExpireRequest):
+    """
+    Expires undecided actions: the listed ones, the ones older than older_than_seconds,
+    or (neither given) the ones past their APPROVAL_TTL.
+    """
+    await require_stack()
+    from src.approvals import aexpire_actions
 
+    try:
+        return {"expired" : await aexpire_actions(request.action_ids, request.older_than_seconds)}
     except Exception as ex:
         raise HTTPException(status_code=500,detail=str(ex))
 
 @server.get("/history")
-async def get_history_endpoint():
+async def get_history_endpoint(limit: int = Query(50, ge=1, le=200), cursor: str = None):
     """
-    Fetched list of all chat sessions.
+    Fetches a page of chat sessions (newest first): {"items", "next_cursor"}.
     """
     try:
-        return get_all_sessions()
+        return await aget_sessions(limit, cursor)
+    except ValueError as ex:
+        raise HTTPException(status_code=400,detail=str(ex))
     except Exception as ex:
         raise HTTPException(status_code=500,detail=str(ex))
 
 @server.get("/history/{thread_id}")
-async def get_history_endpoint(thread_id: str):
+async def get_thread_history_endpoint(
+    thread_id: str,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: str = None,
+    include_metadata: bool = True
+):
     """
-    Fetches full message history for a specific thread.
+    Fetches a page of the message history for a specific thread (oldest first): {"items", "next_cursor"}.
+    Set include_metadata=false to skip the SQL / chart / email payloads.
     """
     try:
-        return get_session_history(thread_id)
+        return await aget_session_history(thread_id, limit, cursor, include_metadata)
+    except ValueError as ex:
+        raise HTTPException(status_code=400,detail=str(ex))
     except Exception as ex:
         raise HTTPException(status_code=500,detail=str(ex))
 
+@server.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus scrape endpoint: per-node / LLM / SQL latency histograms, token counters,
+    plus point-in-time pool and cache gauges.
+    """
+    pool = get_pool_stats()
+    analytics = get_analytics_pool_stats() or {}
+    writer = get_writer_stats()
+    sql_stats = sql_cache.get_cache_stats()
+    result_stats = result_cache.get_cache_stats()
+
+    gauges = {
+        "analyst_history_pool_in_use" : pool["in_use"],
+        "analyst_history_pool_wait_seconds_total" : pool["wait_seconds_total"],
+        "analyst_history_pool_timeouts_total" : pool["timeouts"],
+        "analyst_history_queue_rows" : writer["queued"],
+        "analyst_analytics_pool_checked_out" : analytics.get("checkedout", 0),
+        "analyst_analytics_pool_overflow" : analytics.get("overflow", 0),
+        "analyst_sql_cache_entries" : sql_stats["entries"],
+        "analyst_sql_cache_hit_rate" : sql_stats["hit_rate"],
+        "analyst_result_cache_entries" : result_stats["entries"],
+        "analyst_result_cache_bytes" : result_stats["bytes"],
+        "analyst_result_cache_hits_total" : result_stats["hits"],
+        "analyst_result_cache_misses_total" : result_stats["misses"],
+    }
+    return render_prometheus(gauges)
+
+@server.post("/admin/schema/refresh")
+async def refresh_schema(reset_engine: bool = False):
+    """
+    Drops the cached schema snapshot so the next request re-reflects the Olist tables.
+    """
+    invalidate_schema_cache(reset_engine=reset_engine)
+    return {"status" : "ok", "message" : "Schema cache invalidated"}
+
+@server.get("/admin/db/pool")
+async def pool_stats():
+    """
+    Returns chat-history connection pool counters (checkouts, wait times, timeouts),
+    write-behind queue counters and the analytics engine's pool status.
+    """
+    return {**get_pool_stats(), "history_writer" : get_writer_stats(), "analytics" : get_analytics_pool_stats()}
+
+@server.get("/admin/sql-cache")
+async def sql_cache_stats():
+    """
+    Returns hit/miss counters of the NL-to-SQL cache.
+    """
+    return sql_cache.get_cache_stats()
+
+@server.get("/admin/result-cache")
+async def result_cache_stats():
+    """
+    Returns counters and memory usage of the query result cache.
+    """
+    return result_cache.get_cache_stats()
+
+@server.post("/admin/result-cache/invalidate")
+async def invalidate_result_cache():
+    """
+    Drops all cached query results. Call this after (re)loading data into the Olist tables.
+    """
+    result_cache.invalidate_result_cache()
+    return {"status" : "ok", "message" : "Result cache invalidated"}
+
+@server.get("/admin/rollups")
+async def rollup_stats():
+    """
+    Returns the state of each rollup (available, last refresh, refresh time, last error).
+    """
+    from src import rollups
+
+    return rollups.get_rollup_stats()
+
+@server.post("/admin/rollups/refresh")
+async def refresh_rollups():
+    """
+    Refreshes the rollups now, e.g. right after loading new data into the Olist tables.
+    """
+    from src import rollups
+
+    # Also drops the cached query results read from the old rollup contents
+    await asyncio.to_thread(rollups.refresh_rollups, force=True)
+    return rollups.get_rollup_stats()
+
+@server.get("/ready")
+async def ready():
+    """
+    Readiness probe: 200 once the LLM stack is imported and the graph compiled, 503 while the worker
+    is still warming up (or if the warm-up failed, see "error"). /history works either way.
+    Also reports how long each startup phase took, in seconds.
+    """
+    status = "ready" if _startup["ready"] else ("failed" if _startup["error"] else "starting")
+    return JSONResponse(status_code=200 if _startup["ready"] else 503, content={"status" : status, **_startup})
+
+_startup["seconds"]["import_main"] = round(time.perf_counter() - _import_started, 3)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(server, host="0.0.0.0", port=8000)
\ No newline at end of file
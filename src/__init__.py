@@ -0,0 +1,4 @@
+from dotenv import load_dotenv
+
+# Settings are read from the environment when each module is imported: load .env once, before any of them
+load_dotenv()
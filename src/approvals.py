@@ -0,0 +1,353 @@
+import asyncio
+import json
+import os
+import uuid
+
+from src.chat_context import latest_question
+from src.checkpoint import prune_thread
+from src.db_config import get_db_connection, release_db_connection
+from src.db_history import _decode_cursor, _encode_cursor
+from src.graph import get_app
+
+# --- Pending-action queue ---
+# A run paused before send_email is recorded in app_pending_actions with the checkpoint it paused
+# at. Deciding an action claims its row under a row lock, so whichever worker gets the claim is the
+# only one that resumes the thread (the checkpointer is shared, any worker can resume any thread).
+# Status: pending -> approving -> sent / failed, or pending -> rejected / expired / superseded.
+
+# Seconds a drafted action can wait for a decision
+APPROVAL_TTL = int(os.getenv("APPROVAL_TTL", "86400"))
+# Seconds after which an "approving" claim whose worker never reported back can be claimed again
+APPROVAL_CLAIM_TIMEOUT = int(os.getenv("APPROVAL_CLAIM_TIMEOUT", "300"))
+# Threads resumed at the same time by a bulk decision
+APPROVAL_CONCURRENCY = int(os.getenv("APPROVAL_CONCURRENCY", "8"))
+APPROVAL_MAX_BATCH = int(os.getenv("APPROVAL_MAX_BATCH", "500"))
+
+_COLUMNS = "action_id, thread_id, action, status, payload, error, created_at, expires_at, decided_at, completed_at"
+
+
+def _to_item(row):
+    action_id, thread_id, action, status, payload, error, created_at, expires_at, decided_at, completed_at = row
+    return {
+        "action_id" : action_id,
+        "thread_id" : thread_id,
+        "action" : action,
+        "status" : status,
+        **(payload if isinstance(payload, dict) else json.loads(payload or "{}")),
+        "error" : error,
+        "created_at" : created_at,
+        "expires_at" : expires_at,
+        "decided_at" : decided_at,
+        "completed_at" : completed_at
+    }
+
+
+def track_pending_action(thread_id : str, checkpoint_id : str = None, payload : dict = None):
+    """
+    Records the action a run paused on (checkpoint_id given) and retires the thread's older
+    pending actions, which can no longer be resumed. Returns the action_id of the pending action.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "UPDATE app_pending_actions SET status = 'superseded', completed_at = CURRENT_TIMESTAMP "
+            "WHERE thread_id = %s AND status IN ('pending', 'failed') AND checkpoint_id IS DISTINCT FROM %s",
+            (thread_id, checkpoint_id)
+        )
+
+        action_id = None
+        if checkpoint_id:
+            cursor.execute(
+                "INSERT INTO app_pending_actions (action_id, thread_id, action, checkpoint_id, payload, expires_at) "
+                "VALUES (%s, %s, 'send_email', %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second') "
+                "ON CONFLICT (thread_id, checkpoint_id) DO NOTHING",
+                (uuid.uuid4().hex, thread_id, checkpoint_id, json.dumps(payload or {}, default=str), APPROVAL_TTL)
+            )
+            cursor.execute(
+                "SELECT action_id FROM app_pending_actions WHERE thread_id = %s AND checkpoint_id = %s",
+                (thread_id, checkpoint_id)
+            )
+            action_id = cursor.fetchone()[0]
+
+        conn.commit()
+        return action_id
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+
+def find_thread_action(thread_id : str):
+    """
+    action_id of the thread's most recent action (whatever its status), or None.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT action_id FROM app_pending_actions WHERE thread_id = %s ORDER BY created_at DESC LIMIT 1",
+            (thread_id,)
+        )
+        row = cursor.fetchone()
+        return row[0] if row else None
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+
+def _transition(status : str, is_expired : bool, is_stale : bool, key : str, approved : bool, idempotency_key : str = None):
+    """
+    (outcome, new status) of a decision on an action in `status` that was decided with `key`, if at all.
+    See claim_actions for the outcomes.
+    """
+    if status in ("pending", "failed") and is_expired:
+        return "expired", "expired"
+    if status in ("pending", "failed") or is_stale:
+        return "claimed", "approving" if approved else "rejected"
+    if idempotency_key and key == idempotency_key:
+        return "replayed", status
+    return "conflict", status
+
+
+def claim_actions(action_ids : list, approved : bool, idempotency_key : str = None):
+    """
+    Decides the given actions in one transaction. Rows are locked (FOR UPDATE), so concurrent
+    decisions from several workers never claim the same action twice.
+
+    Returns {action_id: {"thread_id", "checkpoint_id", "status", "outcome"}} where outcome is:
+    - "claimed"  : decided by this call (status approving, or rejected)
+    - "replayed" : already decided by an earlier call with the same idempotency key
+    - "expired", "conflict" (decided by someone else) or "not_found"
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT action_id, thread_id, checkpoint_id, status, idempotency_key, "
+            "expires_at <= CURRENT_TIMESTAMP, "
+            "status = 'approving' AND decided_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second' "
+            "FROM app_pending_actions WHERE action_id = ANY(%s) ORDER BY action_id FOR UPDATE",
+            (APPROVAL_CLAIM_TIMEOUT, list(action_ids))
+        )
+        rows = {row[0]: row for row in cursor.fetchall()}
+
+        outcomes, claimed, expired = {}, [], []
+        for action_id in action_ids:
+            if action_id not in rows:
+                outcomes[action_id] = {"thread_id": None, "checkpoint_id": None, "status": None, "outcome": "not_found"}
+                continue
+
+            _, thread_id, checkpoint_id, status, key, is_expired, is_stale = rows[action_id]
+            outcome, status = _transition(status, is_expired, is_stale, key, approved, idempotency_key)
+            if outcome == "expired":
+                expired.append(action_id)
+            elif outcome == "claimed":
+                claimed.append(action_id)
+
+            outcomes[action_id] = {"thread_id": thread_id, "checkpoint_id": checkpoint_id, "status": status, "outcome": outcome}
+
+        if claimed:
+            cursor.execute(
+                "UPDATE app_pending_actions SET status = %s, idempotency_key = %s, error = NULL, "
+                "decided_at = CURRENT_TIMESTAMP, completed_at = CASE WHEN %s THEN NULL ELSE CURRENT_TIMESTAMP END "
+                "WHERE action_id = ANY(%s)",
+                ("approving" if approved else "rejected", idempotency_key, approved, claimed)
+            )
+        if expired:
+            cursor.execute(
+                "UPDATE app_pending_actions SET status = 'expired', completed_at = CURRENT_TIMESTAMP WHERE action_id = ANY(%s)",
+                (expired,)
+            )
+
+        conn.commit()
+        return outcomes
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+
+def finish_action(action_id : str, status : str, error : str = None):
+    """
+    Records how a claimed approval ended: sent, failed (can be approved again) or superseded.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "UPDATE app_pending_actions SET status = %s, error = %s, completed_at = CURRENT_TIMESTAMP "
+            "WHERE action_id = %s AND status = 'approving'",
+            (status, error, action_id)
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+
+def list_actions(status : str = "pending", limit : int = 50, page_cursor : str = None):
+    """
+    Returns one page of actions with the given status, oldest first (the review order).
+    Pending actions past their expiry are left out.
+    """
+    conditions, params = ["status = %s"], [status]
+    if status == "pending":
+        conditions.append("expires_at > CURRENT_TIMESTAMP")
+    if page_cursor:
+        created_at, action_id = _decode_cursor(page_cursor)
+        conditions.append("(created_at, action_id) > (%s::timestamptz, %s)")
+        params += [created_at, action_id]
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"SELECT {_COLUMNS} FROM app_pending_actions WHERE {' AND '.join(conditions)} "
+            "ORDER BY created_at ASC, action_id ASC LIMIT %s",
+            (*params, limit + 1)
+        )
+
+        rows = cursor.fetchall()
+        page = rows[:limit]
+        next_cursor = _encode_cursor(page[-1][6], page[-1][0]) if len(rows) > limit else None
+
+        return {
+            "items" : [_to_item(row) for row in page],
+            "next_cursor" : next_cursor
+        }
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+
+def expire_actions(action_ids : list = None, older_than : int = None):
+    """
+    Expires undecided actions: the given ones, the ones older than `older_than` seconds,
+    or (neither given) the ones past their APPROVAL_TTL. Returns how many were expired.
+    """
+    if action_ids:
+        condition, params = "action_id = ANY(%s)", (list(action_ids),)
+    elif older_than is not None:
+        condition, params = "created_at <= CURRENT_TIMESTAMP - %s * INTERVAL '1 second'", (older_than,)
+    else:
+        condition, params = "expires_at <= CURRENT_TIMESTAMP", ()
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "UPDATE app_pending_actions SET status = 'expired', completed_at = CURRENT_TIMESTAMP "
+            f"WHERE status IN ('pending', 'failed') AND {condition}",
+            params
+        )
+        expired = cursor.rowcount
+        conn.commit()
+        return expired
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+
+# --- Async API ---
+
+def _paused_on_action(snapshot) -> bool:
+    return "send_email" in (snapshot.next or ())
+
+
+async def atrack_pending_action(thread_id : str, snapshot):
+    """
+    Records the pending action of a run that paused for approval (returns its action_id),
+    or retires the thread's earlier pending action when the run did not pause.
+    """
+    if not _paused_on_action(snapshot):
+        return await asyncio.to_thread(track_pending_action, thread_id)
+
+    values = snapshot.values
+    payload = {
+        "question" : latest_question(values.get("messages") or []),
+        "sql_query" : values.get("sql_query"),
+        "email_draft" : values.get("email_draft")
+    }
+    checkpoint_id = snapshot.config["configurable"]["checkpoint_id"]
+    return await asyncio.to_thread(track_pending_action, thread_id, checkpoint_id, payload)
+
+
+async def alist_actions(status : str = "pending", limit : int = 50, page_cursor : str = None):
+    return await asyncio.to_thread(list_actions, status, limit, page_cursor)
+
+
+async def aexpire_actions(action_ids : list = None, older_than : int = None):
+    return await asyncio.to_thread(expire_actions, action_ids, older_than)
+
+
+async def afind_thread_action(thread_id : str):
+    """
+    action_id of the thread's latest action. A paused thread whose action was never recorded
+    (e.g. the tracking write failed) is recorded now, so it can still be approved.
+    """
+    action_id = await asyncio.to_thread(find_thread_action, thread_id)
+    if action_id is None:
+        app = await get_app()
+        snapshot = await app.aget_state({"configurable" : {"thread_id" : thread_id}})
+        if _paused_on_action(snapshot):
+            action_id = await atrack_pending_action(thread_id, snapshot)
+    return action_id
+
+
+async def _resume(app, action_id : str, claim : dict):
+    """
+    Resumes the thread of a claimed approval, provided it is still paused at the checkpoint
+    the action was drafted at (a newer question on the thread discards the old draft).
+    """
+    config = {"configurable" : {"thread_id" : claim["thread_id"]}}
+
+    try:
+        snapshot = await app.aget_state(config)
+        if not _paused_on_action(snapshot) or snapshot.config["configurable"].get("checkpoint_id") != claim["checkpoint_id"]:
+            error = "The thread has moved on since this action was drafted"
+            await asyncio.to_thread(finish_action, action_id, "superseded", error)
+            return "superseded", error
+
+        async for _ in app.astream(None, config=config):
+            pass
+    except Exception as ex:
+        await asyncio.to_thread(finish_action, action_id, "failed", str(ex))
+        return "failed", str(ex)
+
+    await asyncio.to_thread(finish_action, action_id, "sent")
+    await prune_thread(claim["thread_id"])
+    return "sent", None
+
+
+async def decide_actions(action_ids : list, approved : bool, idempotency_key : str = None):
+    """
+    Approves or rejects many actions in one call: claims them all in a single transaction,
+    then resumes the approved threads, at most APPROVAL_CONCURRENCY at a time.
+
+    Returns one {"action_id", "thread_id", "status", "outcome", "error"} per action, in input order.
+    Repeating a call with the same idempotency_key reports the earlier decisions instead of
+    failing them as conflicts; nothing is ever sent twice.
+    """
+    action_ids = list(dict.fromkeys(action_ids))
+    claims = await asyncio.to_thread(claim_actions, action_ids, approved, idempotency_key)
+
+    app = await get_app()
+    semaphore = asyncio.Semaphore(max(1, APPROVAL_CONCURRENCY))
+
+    async def decide(action_id):
+        claim = claims[action_id]
+        status, error = claim["status"], None
+
+        if claim["outcome"] == "claimed" and approved:
+            async with semaphore:
+                status, error = await _resume(app, action_id, claim)
+
+        return {"action_id" : action_id, "thread_id" : claim["thread_id"], "status" : status,
+                "outcome" : claim["outcome"], "error" : error}
+
+    return await asyncio.gather(*(decide(action_id) for action_id in action_ids))
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import uuid
+from collections import defaultdict
+
+from langchain_core.messages import HumanMessage
+
+from src import result_cache
+from src.db_config import get_schema_info
+from src.graph import get_app
+from src.metrics import start_request, get_request_timings
+from src.sql_cache import normalize_question
+
+# Items of a batch run through the graph at the same time (a request may ask for fewer, never more)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+
+
+def _dedup_key(item):
+    # Only questions without a thread are interchangeable, a thread's history may change the answer
+    return None if item.get("thread_id") else normalize_question(item["question"])
+
+
+async def run_batch(items, concurrency: int = None):
+    """
+    Runs many questions through the compiled graph, at most `concurrency` at a time,
+    and yields each outcome as soon as it is ready (not in input order):
+    {"index", "question", "thread_id", "snapshot", "error", "timings", "duplicate_of"}.
+
+    - items: [{"question": ..., "thread_id": optional}]; items without a thread get a fresh one
+    - identical questions (without a thread) run once, the copies report the first one's result
+    - identical SQL from different questions is executed once (result_cache.shared_fetch)
+    - the schema is reflected once up front and shared by every item
+    """
+    app = await get_app()
+    await asyncio.to_thread(get_schema_info)
+    result_cache.start_shared_fetches()
+
+    limit = max(1, min(concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    semaphore = asyncio.Semaphore(limit)
+    batch_id = uuid.uuid4().hex[:8]
+
+    leaders = {}  # dedup key -> index of the item that runs
+    duplicates = {}  # leader index -> indexes reporting its result
+    for index, item in enumerate(items):
+        key = _dedup_key(item)
+        if key is not None and key in leaders:
+            duplicates.setdefault(leaders[key], []).append(index)
+        else:
+            if key is not None:
+                leaders[key] = index
+            duplicates.setdefault(index, [])
+
+    # Items continuing the same thread run one after the other, in input order
+    thread_locks = defaultdict(asyncio.Lock)
+
+    async def run(index):
+        item = items[index]
+        thread_id = item.get("thread_id") or f"batch_{batch_id}_{index}"
+        config = {"configurable": {"thread_id": thread_id}}
+
+        async with thread_locks[thread_id], semaphore:
+            # Each task has its own copy of the context, so timings are per item
+            start_request()
+            try:
+                await app.ainvoke({"messages": [HumanMessage(content=item["question"])]}, config=config)
+                snapshot, error = await app.aget_state(config), None
+            except Exception as ex:
+                snapshot, error = None, str(ex)
+
+        return {"index": index, "question": item["question"], "thread_id": thread_id,
+                "snapshot": snapshot, "error": error, "timings": get_request_timings(), "duplicate_of": None}
+
+    tasks = [asyncio.ensure_future(run(index)) for index in duplicates]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            outcome = await finished
+            yield outcome
+
+            for index in duplicates[outcome["index"]]:
+                yield {**outcome, "index": index, "question": items[index]["question"],
+                       "timings": None, "duplicate_of": outcome["index"]}
+    finally:
+        # The consumer went away (client disconnected, ...): stop the remaining items
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,93 @@
+import datetime
+import os
+
+from src.query_result import QueryResult, to_records
+
+# Bar charts with more categories than this are left to the LLM to decide on
+CHART_MAX_CATEGORIES = int(os.getenv("CHART_MAX_CATEGORIES", "50"))
+
+SERIES_COLORS = ["#8884d8", "#82ca9d", "#ffc658", "#ff7300", "#0088fe"]
+
+
+def _is_id_column(name: str) -> bool:
+    name = name.lower()
+    return name == "id" or name.endswith("_id")
+
+
+def _looks_like_dates(values) -> bool:
+    """
+    True if every non-null value is an ISO date/datetime string (e.g. '2018-03-01').
+    """
+    samples = [value for value in values if value is not None]
+    if not samples:
+        return False
+
+    for value in samples:
+        if not isinstance(value, str) or len(value) < 7:
+            return False
+        try:
+            datetime.datetime.fromisoformat(value if len(value) > 7 else f"{value}-01")
+        except ValueError:
+            return False
+
+    return True
+
+
+def _humanize(name: str) -> str:
+    return name.replace("_", " ").title()
+
+
+def build_chart_spec(result: QueryResult):
+    """
+    Rule-based Recharts spec for the common result shapes.
+
+    Returns (handled, spec):
+    - (True, None)  : no chart makes sense (empty result, single row / scalar)
+    - (True, spec)  : a line chart (date + numbers) or bar chart (category + numbers)
+    - (False, None) : ambiguous shape, let the LLM decide
+    """
+    if not result or not result["row_count"]:
+        return True, None
+
+    # Single scalar or single row: a number, not a chart
+    if result["row_count"] == 1:
+        return True, None
+
+    dates, categories, numbers = [], [], []
+    for name, kind, values in zip(result["columns"], result["types"], result["data"]):
+        if kind == "datetime" or (kind == "string" and _looks_like_dates(values)):
+            dates.append(name)
+        elif kind == "number" and not _is_id_column(name):
+            numbers.append(name)
+        else:
+            categories.append(name)
+
+    if not numbers:
+        return False, None
+
+    if len(dates) == 1 and not categories:
+        chart_type, x_key = "line", dates[0]
+    elif len(categories) == 1 and not dates and result["row_count"] <= CHART_MAX_CATEGORIES:
+        chart_type, x_key = "bar", categories[0]
+    else:
+        return False, None
+
+    series = [
+        {"dataKey": name, "color": SERIES_COLORS[idx % len(SERIES_COLORS)]}
+        for idx, name in enumerate(numbers)
+    ]
+
+    records = to_records(result)
+    if chart_type == "line":
+        # Time series must be plotted in time order, whatever the SQL sorted by
+        records.sort(key=lambda record: (record[x_key] is not None, record[x_key] or ""))
+
+    spec = {
+        "type": chart_type,
+        "data": records,
+        "xKey": x_key,
+        "series": series,
+        "title": f"{', '.join(_humanize(name) for name in numbers)} by {_humanize(x_key)}",
+    }
+
+    return True, spec
@@ -0,0 +1,72 @@
+import os
+from typing import List, Optional
+
+from langchain_core.messages import BaseMessage, HumanMessage
+
+# Prior turns (question + answer) kept verbatim in the SQL prompt; older ones are folded into the summary
+HISTORY_WINDOW_TURNS = int(os.getenv("HISTORY_WINDOW_TURNS", "3"))
+# Token budget of the verbatim window, the oldest turns are folded first when it is exceeded
+HISTORY_WINDOW_TOKENS = int(os.getenv("HISTORY_WINDOW_TOKENS", "1500"))
+# Token budget of the rolling summary of everything older than the window
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "300"))
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token, good enough for budgeting
+    return len(text) // 4 + 1
+
+
+def format_message(message: BaseMessage) -> str:
+    return f"{message.type}: {message.content}"
+
+
+def latest_question(messages: List[BaseMessage]) -> str:
+    """
+    Content of the most recent user message (the question of the current turn).
+    """
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            return message.content
+    return messages[-1].content if messages else ""
+
+
+def _turns(messages: List[BaseMessage]) -> List[List[BaseMessage]]:
+    turns = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def split_history(messages: List[BaseMessage], answered: bool = False):
+    """
+    Splits the conversation into (to_fold, window, current):
+    - current: the turn being answered (from the latest user message on)
+    - window: the prior turns kept verbatim, at most HISTORY_WINDOW_TURNS / HISTORY_WINDOW_TOKENS
+    - to_fold: the older prior turns, which belong in the rolling summary
+    With answered=True the latest turn counts as a prior one (the split the next turn will see).
+    """
+    turns = _turns(messages)
+    current = turns.pop() if turns and not answered else []
+
+    window = turns[-HISTORY_WINDOW_TURNS:] if HISTORY_WINDOW_TURNS > 0 else []
+    while window and sum(estimate_tokens(format_message(m)) for turn in window for m in turn) > HISTORY_WINDOW_TOKENS:
+        window = window[1:]
+
+    to_fold = turns[:len(turns) - len(window)]
+    return [m for turn in to_fold for m in turn], [m for turn in window for m in turn], current
+
+
+def build_history_context(messages: List[BaseMessage], summary: Optional[str]) -> str:
+    """
+    Chat-history text for a prompt: the rolling summary of older turns plus the recent turns verbatim.
+    Bounded by the summary and window budgets however long the thread is.
+    """
+    _, window, _ = split_history(messages)
+
+    parts = []
+    if summary:
+        parts.append(f"Summary of the earlier conversation: {summary}")
+    parts.extend(format_message(message) for message in window)
+    return "\n".join(parts)
@@ -0,0 +1,73 @@
+import os
+
+# "postgres" (durable, shared by all workers) or "memory" (single process, e.g. local experiments)
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "postgres").lower()
+CHECKPOINT_POOL_MAX = int(os.getenv("CHECKPOINT_POOL_MAX", "10"))
+# Drop superseded checkpoints of a thread after each run, only the latest one is ever resumed
+CHECKPOINT_PRUNE = os.getenv("CHECKPOINT_PRUNE", "true").lower() == "true"
+
+_pool = None
+_checkpointer = None
+
+
+async def open_checkpointer():
+    """
+    Builds the graph checkpointer. Must be awaited inside the serving event loop.
+
+    The Postgres saver keeps channel values (e.g. query_result) in checkpoint_blobs,
+    versioned and out of line from the checkpoint rows, so unchanged payloads are not
+    rewritten on every step and nothing accumulates in worker memory.
+    Its connection pool is opened and the checkpoint tables are created / migrated here.
+    """
+    global _pool, _checkpointer
+
+    if _checkpointer is not None:
+        return _checkpointer
+
+    if CHECKPOINT_BACKEND == "memory":
+        from langgraph.checkpoint.memory import MemorySaver
+        _checkpointer = MemorySaver()
+        return _checkpointer
+
+    from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+    from psycopg.rows import dict_row
+    from psycopg_pool import AsyncConnectionPool
+
+    db_uri = os.getenv("DATABASE_URL")
+    if not db_uri:
+        raise ValueError("DATABASE_URL not found in environment variables.")
+
+    _pool = AsyncConnectionPool(
+        conninfo=db_uri,
+        max_size=CHECKPOINT_POOL_MAX,
+        open=False,
+        kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+    )
+    await _pool.open()
+
+    _checkpointer = AsyncPostgresSaver(_pool)
+    await _checkpointer.setup()
+    return _checkpointer
+
+
+async def close_checkpointer():
+    global _pool, _checkpointer
+
+    if _pool is not None:
+        await _pool.close()
+
+    _pool = None
+    _checkpointer = None
+
+
+async def prune_thread(thread_id: str):
+    """
+    Keeps only the latest checkpoint of a thread. Best effort: failures are logged, not raised.
+    """
+    if not CHECKPOINT_PRUNE or _checkpointer is None:
+        return
+
+    try:
+        await _checkpointer.aprune([thread_id], strategy="keep_latest")
+    except Exception as ex:
+        print(f"⚠️ Checkpoint pruning failed for {thread_id}: {ex}")
@@ -1,67 +1,302 @@
+import asyncio
+import base64
+import datetime
 import json
-from dotenv import load_dotenv
+import os
+import threading
+import time
+from collections import Counter
 
-from src.db_config import get_db_connection
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import execute_values
 
-load_dotenv()
+from src.db_config import get_db_connection, release_db_connection
+from src.metrics import timed
 
-def ensure_session(thread_id : str, title : str = "New Analysis"):
-    """
-    Ensures a session exists. If not, creates one.
-    """
+# --- Write-behind queue ---
+# Session upserts and message inserts are buffered in memory and written by a background
+# thread in batched multi-row INSERTs (one commit per batch), flushed once HISTORY_FLUSH_BATCH
+# rows are queued or every HISTORY_FLUSH_INTERVAL seconds. Reads of a thread with unflushed
+# writes flush first, so /history/{thread_id} always sees its own writes. The queue is per process:
+# that guarantee only holds for reads served by the worker that took the writes, another worker
+# may not see them for up to HISTORY_FLUSH_INTERVAL seconds.
+
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "true").lower() == "true"
+HISTORY_FLUSH_BATCH = int(os.getenv("HISTORY_FLUSH_BATCH", "100"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "0.5"))
+
+_queue_lock = threading.Condition()
+_flush_lock = threading.Lock()
+_pending_sessions = {}  # thread_id -> title (first title wins, like ON CONFLICT DO NOTHING)
+_pending_messages = []  # (thread_id, role, content, metadata json, created_at)
+_dirty_threads = Counter()  # thread_id -> queued or in-flight writes
+_writer = None
+_stopping = False
+_writer_stats = {"flushes": 0, "rows_written": 0, "rows_dropped": 0, "flush_errors": 0}
+
+
+def _writer_loop():
+    while True:
+        with _queue_lock:
+            if not _stopping and len(_pending_messages) + len(_pending_sessions) < HISTORY_FLUSH_BATCH:
+                _queue_lock.wait(HISTORY_FLUSH_INTERVAL)
+            stopping = _stopping
+
+        try:
+            flush_history()
+        except Exception:
+            # Already logged, the batch stays queued: back off before the next attempt
+            time.sleep(HISTORY_FLUSH_INTERVAL)
+
+        if stopping:
+            return
+
+
+def _enqueue(session=None, message=None):
+    global _writer
+
+    with _queue_lock:
+        if session:
+            thread_id, title = session
+            if thread_id not in _pending_sessions:
+                _pending_sessions[thread_id] = title
+                _dirty_threads[thread_id] += 1
+        if message:
+            _pending_messages.append(message)
+            _dirty_threads[message[0]] += 1
+
+        if HISTORY_WRITE_BEHIND and _writer is None:
+            _writer = threading.Thread(target=_writer_loop, name="history-writer", daemon=True)
+            _writer.start()
+
+        if len(_pending_messages) + len(_pending_sessions) >= HISTORY_FLUSH_BATCH:
+            _queue_lock.notify()
+
+    if not HISTORY_WRITE_BEHIND:
+        flush_history()
+
+
+def _write_batch(sessions, messages):
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute("INSERT INTO app_sessions (thread_id, title) VALUES (%s, %s) ON CONFLICT (thread_id) DO NOTHING", (thread_id, title))
+        # Sessions first: app_messages references app_sessions
+        if sessions:
+            execute_values(
+                cursor,
+                "INSERT INTO app_sessions (thread_id, title) VALUES %s ON CONFLICT (thread_id) DO NOTHING",
+                sessions
+            )
+        if messages:
+            execute_values(
+                cursor,
+                "INSERT INTO app_messages (thread_id, role, content, metadata, created_at) VALUES %s",
+                messages
+            )
         conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
-def save_message(thread_id : str, role : str, content : str, metadata : dict = None):
+
+def flush_history():
     """
-    Saves a chat message to the database.
+    Writes every queued session / message in one transaction.
+    On connection problems the batch is put back at the front of the queue and retried later.
+    On any other error (rows rejected by the database, a payload the driver can't adapt, ...)
+    rows are retried one by one and only the bad ones are dropped.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with _flush_lock:
+        with _queue_lock:
+            sessions = list(_pending_sessions.items())
+            messages = list(_pending_messages)
+            _pending_sessions.clear()
+            _pending_messages.clear()
+
+        if not sessions and not messages:
+            return
+
+        written = len(sessions) + len(messages)
+        try:
+            with timed("analyst_history_flush_seconds"):
+                _write_batch(sessions, messages)
+
+        except (psycopg2.OperationalError, psycopg2.InterfaceError, pg_pool.PoolError) as ex:
+            print(f"❌ History flush failed, will retry: {ex}")
+            with _queue_lock:
+                for thread_id, title in sessions:
+                    if thread_id in _pending_sessions:
+                        _dirty_threads[thread_id] -= 1  # Re-queued twice, counted once
+                    _pending_sessions[thread_id] = title
+                _pending_messages[:0] = messages
+                _writer_stats["flush_errors"] += 1
+            raise
+
+        except Exception as ex:
+            print(f"⚠️ History batch rejected ({ex}), retrying row by row...")
+            rows = [([session], []) for session in sessions] + [([], [message]) for message in messages]
+            for batch in rows:
+                try:
+                    _write_batch(*batch)
+                except Exception as row_ex:
+                    print(f"❌ Dropping history row {batch}: {row_ex}")
+                    written -= 1
+            with _queue_lock:
+                _writer_stats["flush_errors"] += 1
+                _writer_stats["rows_dropped"] += len(rows) - written
+
+        # Written or dropped: either way the reads of these threads have nothing left to wait for
+        with _queue_lock:
+            for thread_id, _ in sessions:
+                _dirty_threads[thread_id] -= 1
+            for message in messages:
+                _dirty_threads[message[0]] -= 1
+            for thread_id in [key for key, count in _dirty_threads.items() if count <= 0]:
+                del _dirty_threads[thread_id]
+            _writer_stats["flushes"] += 1
+            _writer_stats["rows_written"] += written
+
+
+def _flush_if_dirty(thread_id : str = None):
+    """
+    Read-your-writes: flushes before reading if the thread (or, without thread_id, any thread)
+    still has queued or in-flight writes in this process.
+    """
+    with _queue_lock:
+        dirty = _dirty_threads[thread_id] > 0 if thread_id else bool(_dirty_threads)
+
+    if dirty:
+        flush_history()
+
+
+def stop_history_writer():
+    """
+    Flushes the queue and stops the background writer (call on shutdown).
+    """
+    global _writer, _stopping
+
+    with _queue_lock:
+        writer, _stopping = _writer, True
+        _queue_lock.notify()
+
+    if writer is not None:
+        writer.join()
+
     try:
-        meta_json = json.dumps(metadata) if metadata else None
+        flush_history()
+    except Exception:
+        print(f"❌ Shutting down with {get_writer_stats()['queued']} unsaved history rows")
+
+    with _queue_lock:
+        _writer, _stopping = None, False
+
+
+def get_writer_stats():
+    with _queue_lock:
+        return {**_writer_stats, "queued": len(_pending_messages) + len(_pending_sessions)}
 
-        cursor.execute(
-            "INSERT INTO app_messages (thread_id, role, content, metadata) VALUES (%s, %s, %s, %s)",
-            (thread_id, role, content, meta_json)
-        )
-        conn.commit()
-    finally:
-        cursor.close()
-        conn.close()
 
-def get_all_sessions():
+def ensure_session(thread_id : str, title : str = "New Analysis"):
+    """
+    Ensures a session exists. If not, creates one (queued, see write-behind above).
+    """
+    _enqueue(session=(thread_id, title))
+
+def save_message(thread_id : str, role : str, content : str, metadata : dict = None):
     """
-    Returns a list of all cht sessions
+    Saves a chat message to the database (queued, see write-behind above).
     """
+    meta_json = json.dumps(metadata, default=str) if metadata else None
+    _enqueue(message=(thread_id, role, content, meta_json, datetime.datetime.now(datetime.timezone.utc)))
+
+def _encode_cursor(created_at, key) -> str:
+    """
+    Opaque keyset cursor: the (created_at, tie-breaker) of the last row of a page.
+    """
+    raw = json.dumps([created_at.isoformat(), key])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def _decode_cursor(page_cursor : str):
+    try:
+        created_at, key = json.loads(base64.urlsafe_b64decode(page_cursor.encode("ascii")))
+        return created_at, key
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+def get_sessions(limit : int = 50, page_cursor : str = None):
+    """
+    Returns one page of chat sessions, newest first.
+    Pass the returned next_cursor back to fetch the following page (None on the last page).
+    """
+    _flush_if_dirty()
+
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT thread_id, title, created_at FROM app_sessions ORDER BY created_at DESC")
+        if page_cursor:
+            created_at, thread_id = _decode_cursor(page_cursor)
+            cursor.execute(
+                "SELECT thread_id, title, created_at FROM app_sessions "
+                "WHERE (created_at, thread_id) < (%s::timestamptz, %s) "
+                "ORDER BY created_at DESC, thread_id DESC LIMIT %s",
+                (created_at, thread_id, limit + 1)
+            )
+        else:
+            cursor.execute(
+                "SELECT thread_id, title, created_at FROM app_sessions "
+                "ORDER BY created_at DESC, thread_id DESC LIMIT %s",
+                (limit + 1,)
+            )
+
         rows = cursor.fetchall()
-        return [{"thread_id": row[0], "title": row[1], "created_at": row[2]} for row in rows ]
+        page = rows[:limit]
+        next_cursor = _encode_cursor(page[-1][2], page[-1][0]) if len(rows) > limit else None
+
+        return {
+            "items" : [{"thread_id": row[0], "title": row[1], "created_at": row[2]} for row in page],
+            "next_cursor" : next_cursor
+        }
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
 
-def get_session_history(thread_id: str):
+def get_session_history(thread_id: str, limit : int = 100, page_cursor : str = None, include_metadata : bool = True):
     """
-    Returns full message history for a specific thread, including metadata.
+    Returns one page of a thread's message history, oldest first.
+    With include_metadata=False the JSONB payload (SQL, chart, email) is not read at all.
     """
+    _flush_if_dirty(thread_id)
+
+    metadata_column = "metadata" if include_metadata else "NULL"
+
     conn = get_db_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT role,content,metadata FROM app_messages WHERE thread_id = %s ORDER BY created_at ASC", (thread_id,))
+        if page_cursor:
+            created_at, message_id = _decode_cursor(page_cursor)
+            cursor.execute(
+                f"SELECT id, role, content, {metadata_column}, created_at FROM app_messages "
+                "WHERE thread_id = %s AND (created_at, id) > (%s::timestamptz, %s) "
+                "ORDER BY created_at ASC, id ASC LIMIT %s",
+                (thread_id, created_at, message_id, limit + 1)
+            )
+        else:
+            cursor.execute(
+                f"SELECT id, role, content, {metadata_column}, created_at FROM app_messages "
+                "WHERE thread_id = %s ORDER BY created_at ASC, id ASC LIMIT %s",
+                (thread_id, limit + 1)
+            )
+
+        rows = cursor.fetchall()
+        page = rows[:limit]
 
         messages = []
-        for row in cursor.fetchall():
-            role , content, metadata = row
+        for row in page:
+            _, role , content, metadata, _ = row
 
             msg = {
                 "role" : role,
@@ -74,7 +309,32 @@ def get_session_history(thread_id: str):
 
             messages.append(msg)
 
-        return messages
+        next_cursor = _encode_cursor(page[-1][4], page[-1][0]) if len(rows) > limit else None
+
+        return {
+            "items" : messages,
+            "next_cursor" : next_cursor
+        }
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+        release_db_connection(conn)
+
+# --- Async API ---
+# psycopg2 is blocking, so the async reads run the pooled sync calls on a worker thread.
+# Writes only enqueue (unless write-behind is disabled), the event loop is never blocked on them.
+
+async def aensure_session(thread_id : str, title : str = "New Analysis"):
+    if HISTORY_WRITE_BEHIND:
+        return ensure_session(thread_id, title)
+    return await asyncio.to_thread(ensure_session, thread_id, title)
+
+async def asave_message(thread_id : str, role : str, content : str, metadata : dict = None):
+    if HISTORY_WRITE_BEHIND:
+        return save_message(thread_id, role, content, metadata)
+    return await asyncio.to_thread(save_message, thread_id, role, content, metadata)
+
+async def aget_sessions(limit : int = 50, page_cursor : str = None):
+    return await asyncio.to_thread(get_sessions, limit, page_cursor)
+
+async def aget_session_history(thread_id: str, limit : int = 100, page_cursor : str = None, include_metadata : bool = True):
+    return await asyncio.to_thread(get_session_history, thread_id, limit, page_cursor, include_metadata)
@@ -1,46 +1,66 @@
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph, END
+import asyncio
+
+from src.checkpoint import open_checkpointer, close_checkpointer
+from src.metrics import instrument_node, inc, add_to_request
 from src.state import AgentState
-from src.nodes import sql_analyst_node, chart_generator_node, marketing_agent_node, send_mail_node
-from dotenv import load_dotenv
-load_dotenv()
+from src.nodes import intent_router_node, sql_analyst_node, chart_generator_node, marketing_agent_node, send_mail_node, summarize_history_node
 
 # Constants
 MAX_RETRIES = 3
 
 workflow = StateGraph(AgentState)
 
-workflow.add_node("sql_analyst", sql_analyst_node)
-workflow.add_node("chart_generator",chart_generator_node)
-workflow.add_node("marketing_agent",marketing_agent_node)
-workflow.add_node("send_email",send_mail_node)
+workflow.add_node("intent_router", instrument_node("intent_router", intent_router_node))
+workflow.add_node("sql_analyst", instrument_node("sql_analyst", sql_analyst_node))
+workflow.add_node("chart_generator", instrument_node("chart_generator", chart_generator_node))
+workflow.add_node("marketing_agent", instrument_node("marketing_agent", marketing_agent_node))
+workflow.add_node("send_email", instrument_node("send_email", send_mail_node))
+workflow.add_node("summarize_history", instrument_node("summarize_history", summarize_history_node))
 
-workflow.set_entry_point("sql_analyst")
-workflow.add_edge("sql_analyst", "chart_generator")
+workflow.set_entry_point("intent_router")
+workflow.add_edge("intent_router", "sql_analyst")
 
 # --- Conditional Logic for SQL Self Healing ---
 def should_continue_or_retry(state : AgentState):
     """
-    Decides whether to retry SQL generation or move to charting.
+    Decides whether to retry SQL generation or move on to charting and email drafting.
+    Chart and email only read the query result and write disjoint state keys,
+    so on success both branches are returned and run concurrently
+    (together with the history summary, which the next turn needs, not this one).
+    Branches the intent router ruled out are not scheduled at all.
     """
     if state.get("error"):
-        if state.get("retry_count",0) < MAX_RETRIES:
-            return "retry"
-        else:
-            return "give_up"
-    return "continue"
+        decision = "retry" if state.get("retry_count",0) < MAX_RETRIES else "give_up"
+        inc("analyst_sql_retries_total", outcome=decision)
+        if decision == "retry":
+            add_to_request("sql_retries", 1)
+        return decision
+
+    intent = state.get("intent") or {"chart": True, "email": True}
+    branches = ["summarize_history"]
+    if intent["chart"]:
+        branches.append("chart_generator")
+    if intent["email"]:
+        branches.append("marketing_agent")
+    return branches
 
 workflow.add_conditional_edges(
     "sql_analyst",
     should_continue_or_retry,
     {
         "retry": "sql_analyst",
-        "continue" : "chart_generator",
+        "chart_generator" : "chart_generator",
+        "marketing_agent" : "marketing_agent",
+        "summarize_history" : "summarize_history",
         "give_up" : END
     }
 )
 
-workflow.add_edge("chart_generator", "marketing_agent")
+# The chart and summary branches simply end. All branches run in the same superstep, so
+# send_email (and the interrupt before it) is only reached once they have finished.
+workflow.add_edge("chart_generator", END)
+workflow.add_edge("summarize_history", END)
 
 # --- Conditional Logic for Approval ---
 def should_email(state: AgentState):
@@ -58,38 +78,109 @@ workflow.add_conditional_edges(
 )
 
 workflow.add_edge("send_email",END)
-memory = MemorySaver()
+# The graph is compiled lazily: the Postgres checkpointer has to be created inside the
+# event loop that serves it (see get_app / the FastAPI lifespan in main.py)
+app = None
+_app_lock = asyncio.Lock()
 
-app = workflow.compile(
-    checkpointer=memory,
-    interrupt_before=["send_email"]
-)
+async def get_app():
+    """
+    Returns the compiled graph, opening the checkpointer and compiling on first use.
+    """
+    global app
 
-if __name__ == "__main__":
-    # Simple test to verify the SQL node works
-    from langchain_core.messages import HumanMessage
+    if app is None:
+        async with _app_lock:
+            if app is None:
+                checkpointer = await open_checkpointer()
+                app = workflow.compile(
+                    checkpointer=checkpointer,
+                    interrupt_before=["send_email"]
+                )
 
-    config = {"configurable" : {"thread_id" : "demo_thread_1"}}
-    user_query = "Find the top 5 customers by spend, generate a chart for this and draft a thank you email for them."
+    return app
 
-    print("🚀 Starting Graph...")
+async def close_app():
+    global app
 
-    inputs = {"messages" : [HumanMessage(content=user_query)]}
+    app = None
+    await close_checkpointer()
 
-    for event in app.stream(inputs,config=config):
-        pass
+if __name__ == "__main__":
+    # Simple test to verify the SQL node works:  python -m src.graph
+    # Batch of questions (one per line, or JSON lines {"question", "thread_id"}), results as JSON lines:
+    #   python -m src.graph --batch questions.txt --concurrency 4
+    import argparse
+    import json
+    from langchain_core.messages import HumanMessage
 
-    snapshot = app.get_state(config)
-    print("\n⏸️  GRAPH PAUSED FOR HUMAN REVIEW ⏸️")
-    print(f"Next Node: {snapshot.next}")
-    print(f"Draft Email: {snapshot.values['email_draft'][:100]}...")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", help="File with the questions to run")
+    parser.add_argument("--concurrency", type=int, default=None)
+    args = parser.parse_args()
+
+    async def run_batch_file(path, concurrency):
+        from src.batch import run_batch
+
+        items = []
+        with open(path) as file:
+            for line in file:
+                line = line.strip()
+                if line.startswith("{"):
+                    items.append(json.loads(line))
+                elif line:
+                    items.append({"question" : line})
+
+        async for outcome in run_batch(items, concurrency):
+            values = outcome["snapshot"].values if outcome["snapshot"] else {}
+            result = values.get("query_result") or {}
+            print(json.dumps({
+                "index" : outcome["index"],
+                "question" : outcome["question"],
+                "thread_id" : outcome["thread_id"],
+                "status" : "failed" if outcome["error"] else ("paused" if outcome["snapshot"].next else "completed"),
+                "sql_query" : values.get("sql_query"),
+                "columns" : result.get("columns"),
+                "row_count" : result.get("row_count"),
+                "email_draft" : values.get("email_draft"),
+                "error" : outcome["error"] or values.get("error"),
+                "duplicate_of" : outcome["duplicate_of"],
+            }, default=str), flush=True)
+
+        # run_batch compiled the graph through the src.graph module, not this __main__ copy
+        from src.graph import close_app as close_batch_app
+        await close_batch_app()
+
+    async def run_demo():
+        app = await get_app()
+        config = {"configurable" : {"thread_id" : "demo_thread_1"}}
+        user_query = "Find the top 5 customers by spend, generate a chart for this and draft a thank you email for them."
+
+        print("🚀 Starting Graph...")
+
+        inputs = {"messages" : [HumanMessage(content=user_query)]}
+
+        async for event in app.astream(inputs,config=config):
+            pass
+
+        snapshot = await app.aget_state(config)
+        print("\n⏸️  GRAPH PAUSED FOR HUMAN REVIEW ⏸️")
+        print(f"Next Node: {snapshot.next}")
+        print(f"Draft Email: {snapshot.values['email_draft'][:100]}...")
+
+        response = input("\nDo you want to send this email? (yes/no):")
+
+        if response.lower() == "yes":
+            async for event in app.astream(None,config=config):
+                for key,value in event.items():
+                    print(f"Finished Node: {key}")
+            print("🏁 Graph Finished.")
+        else:
+            print("❌ Operation Cancelled")
 
-    response = input("\nDo you want to send this email? (yes/no):")
+        await close_app()
 
-    if response.lower() == "yes":
-        for event in app.stream(None,config=config):
-            for key,value in event.items():
-                print(f"Finished Node: {key}")
-        print("🏁 Graph Finished.")
+    if args.batch:
+        asyncio.run(run_batch_file(args.batch, args.concurrency))
     else:
-        print("❌ Operation Cancelled")
\ No newline at end of file
+        asyncio.run(run_demo())
@@ -0,0 +1,49 @@
+import os
+import re
+from typing import Dict
+
+# Decide up front which of the chart / email nodes a question needs; `false` runs both every time
+INTENT_ROUTING = os.getenv("INTENT_ROUTING", "true").lower() == "true"
+
+# An explicit action on a message: "draft an email", "send them a coupon", "email the top 5 customers"...
+_MESSAGE = r"(e-?mails?|mails?|messages?|notes?|letters?|newsletters?|coupons?|offers?|discounts?|promotions?|campaigns?|thank[- ]you)"
+_EMAIL_PATTERNS = [
+    re.compile(rf"\b(draft|write|compose|prepare)\b.*\b{_MESSAGE}"),
+    re.compile(rf"\bsend\b.*\b{_MESSAGE}"),
+    re.compile(r"^(please\s+)?(e-?mail|contact|message|reach out to|write to)\b"),
+    # "... and email them", "... then reach out to them"; not "customers to contact", which only asks for a list
+    re.compile(r"\b(and|then)\s+(e-?mail|contact|message|reach out to|write to|notify|thank)\b"),
+]
+
+# Explicitly visual questions, or results with a dimension worth plotting
+_CHART_PATTERNS = [
+    re.compile(r"\b(chart|plot|graph|visuali[sz]e|visuali[sz]ation|trend|trends|histogram|distribution|breakdown|over time|compare|comparison)\b"),
+    re.compile(r"\b(by|per|each|across)\s+\w+"),
+    re.compile(r"\b(top|bottom|best|worst)\s+\d+\b"),
+    re.compile(r"\b(daily|weekly|monthly|quarterly|yearly|annual)\b"),
+]
+
+# Single-number questions: "how many orders...", "what is the average review score"
+_SCALAR_PATTERNS = [
+    re.compile(r"^(how many|how much|what is the|what's the|what was the|is there|are there|does|do|did)\b"),
+    re.compile(r"^(count|total|average|sum)\b"),
+]
+
+
+def classify_intent(question: str) -> Dict[str, bool]:
+    """
+    Local (regex, no network) decision on which follow-up nodes a question needs:
+    {"chart": bool, "email": bool}.
+
+    - email only for an explicit action on a message, so "which customers did we send orders to"
+      does not draft anything
+    - chart unless the question asks for a single number; the chart node itself still skips
+      results that turn out to be scalars
+    """
+    text = " ".join(question.lower().split())
+
+    email = any(pattern.search(text) for pattern in _EMAIL_PATTERNS)
+    scalar = any(pattern.search(text) for pattern in _SCALAR_PATTERNS)
+    visual = any(pattern.search(text) for pattern in _CHART_PATTERNS)
+
+    return {"chart": visual or not scalar, "email": email}
@@ -0,0 +1,270 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+import openai
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableLambda
+from langchain_openai import ChatOpenAI
+
+from src.metrics import add_to_request, inc, observe
+from src.single_flight import single_flight
+
+# --- LLM gateway ---
+# Every LLM call of the graph goes through get_llm(node), which resolves the node's model and
+# wraps the call with a per-model token bucket, single-flight coalescing of identical in-flight
+# prompts, a per-node timeout and jittered exponential backoff on 429s / timeouts / 5xx.
+#
+# Settings can be scoped with a suffix, the most specific one wins:
+#   LLM_MODEL_CHART_GENERATOR=gpt-4o-mini       (per node: model, base URL, timeout)
+#   LLM_BASE_URL_MARKETING_AGENT=http://localhost:11434/v1   (any OpenAI-compatible server)
+#   LLM_RPM_GPT_4O_MINI=5000                    (per model: rate limit)
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+# Calls per minute started per model, bursts of up to LLM_BURST; 0 disables the limiter
+LLM_RPM = float(os.getenv("LLM_RPM", "500"))
+LLM_BURST = int(os.getenv("LLM_BURST", "20"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+# Identical prompts in flight at the same time share one call
+LLM_COALESCE = os.getenv("LLM_COALESCE", "true").lower() == "true"
+
+# Seconds per attempt; SQL generation gets the longest budget, it is on every request's critical path
+NODE_TIMEOUTS = {
+    "sql_analyst": 60,
+    "chart_generator": 30,
+    "marketing_agent": 45,
+    "summarize_history": 30,
+}
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,  # Includes APITimeoutError
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+
+
+def _setting(name: str, scope: str, default=None):
+    """
+    NAME_<SCOPE> if set (scope: a node or model name, upper-cased, non-alphanumerics as "_"), else NAME, else default.
+    """
+    suffix = re.sub(r"[^A-Z0-9]+", "_", scope.upper()).strip("_")
+    return os.getenv(f"{name}_{suffix}") or os.getenv(name) or default
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """
+    Records duration and token usage of every chat-model call, labelled by graph node and model.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._runs = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        metadata = metadata or {}
+        model = metadata.get("ls_model_name") or kwargs.get("invocation_params", {}).get("model", "unknown")
+        self._runs[run_id] = (time.perf_counter(), metadata.get("langgraph_node", "unknown"), model)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started, node, model = self._runs.pop(run_id, (None, "unknown", "unknown"))
+        if started is None:
+            return
+
+        elapsed = time.perf_counter() - started
+        observe("analyst_llm_duration_seconds", elapsed, node=node, model=model)
+        inc("analyst_llm_calls_total", node=node, model=model)
+        add_to_request("llm_ms", elapsed * 1000)
+        add_to_request("llm_calls", 1)
+
+        prompt_tokens, completion_tokens = 0, 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+
+        inc("analyst_llm_tokens_total", prompt_tokens, node=node, model=model, kind="prompt")
+        inc("analyst_llm_tokens_total", completion_tokens, node=node, model=model, kind="completion")
+        add_to_request("prompt_tokens", prompt_tokens)
+        add_to_request("completion_tokens", completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+
+class TokenBucket:
+    """
+    Paces the calls to one model: `rate` per minute, bursts of up to `burst`.
+    Each caller reserves the next slot and sleeps until it comes up. Thread-safe and not tied
+    to an event loop, so one bucket covers every request (and the batch CLI) of the process.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate / 60
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """
+        Takes a slot, returns the seconds to wait before using it.
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, seconds: float):
+        """
+        After a 429: no caller of this model starts a call for the next `seconds`.
+        """
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+_lock = threading.Lock()
+_models = {}  # (model, base_url) -> ChatOpenAI
+_overrides = {}  # node (None: every node) -> chat model, see set_model
+_buckets = {}  # model name -> TokenBucket
+# Identical prompts in flight: (event loop, prompt hash) -> Future of the leader's call
+_inflight = {}
+
+
+def set_model(model, node: str = None):
+    """
+    Replaces the chat model of a node (or of every node), e.g. with a fake model for offline runs.
+    """
+    _overrides[node] = model
+
+
+def get_chat_model(node: str):
+    """
+    The chat model a node's calls go to (LLM_MODEL / LLM_BASE_URL, optionally per node).
+    Built on first use, and without client-side retries: the gateway retries.
+    """
+    model = _overrides.get(node) or _overrides.get(None)
+    if model is not None:
+        return model
+
+    key = (_setting("LLM_MODEL", node, LLM_MODEL), _setting("LLM_BASE_URL", node))
+    with _lock:
+        if key not in _models:
+            _models[key] = ChatOpenAI(
+                model=key[0],
+                base_url=key[1],
+                temperature=0,
+                max_retries=0,
+                callbacks=[LLMMetricsCallback()]
+            )
+        return _models[key]
+
+
+def _model_name(model) -> str:
+    while hasattr(model, "bound"):  # with_config / bind wrappers
+        model = model.bound
+    return getattr(model, "model_name", None) or type(model).__name__
+
+
+def _get_bucket(model_name: str):
+    rate = float(_setting("LLM_RPM", model_name, LLM_RPM))
+    if rate <= 0:
+        return None
+
+    with _lock:
+        if model_name not in _buckets:
+            _buckets[model_name] = TokenBucket(rate, int(_setting("LLM_BURST", model_name, LLM_BURST)))
+        return _buckets[model_name]
+
+
+def _retry_after(ex) -> float:
+    response = getattr(ex, "response", None)
+    try:
+        return float(response.headers.get("retry-after", 0)) if response is not None else 0.0
+    except ValueError:
+        return 0.0
+
+
+async def _call(node: str, model, model_name: str, prompt_value, config):
+    """
+    One logical LLM call: waits for a rate-limit slot, runs the attempt under the node's timeout,
+    and retries retryable errors with full-jitter exponential backoff (at least Retry-After).
+    """
+    bucket = _get_bucket(model_name)
+    timeout = float(_setting("LLM_TIMEOUT", node, NODE_TIMEOUTS.get(node, 60)))
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        if bucket is not None:
+            wait = bucket.reserve()
+            if wait > 0:
+                observe("analyst_llm_throttle_seconds", wait, model=model_name)
+                await asyncio.sleep(wait)
+
+        try:
+            return await asyncio.wait_for(model.ainvoke(prompt_value, config=config), timeout)
+
+        except RETRYABLE_ERRORS as ex:
+            if attempt == LLM_MAX_RETRIES:
+                raise
+
+            delay = max(random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt)), _retry_after(ex))
+            if isinstance(ex, openai.RateLimitError) and bucket is not None:
+                # Everyone calling this model backs off, not just the caller that hit the limit
+                bucket.pause(delay)
+
+            reason = type(ex).__name__
+            inc("analyst_llm_retries_total", node=node, model=model_name, reason=reason)
+            print(f"⏳ LLM call failed ({reason}), retrying in {delay:.1f}s ...")
+            await asyncio.sleep(delay)
+
+
+def _prompt_key(model_name: str, bind: dict, prompt_value) -> str:
+    messages = [(message.type, message.content) for message in prompt_value.to_messages()]
+    raw = json.dumps([model_name, bind, messages], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def _coalesced_call(node: str, model, model_name: str, bind: dict, prompt_value, config):
+    """
+    Runs the call, or awaits the identical one already in flight. Callers that join a call get
+    its result whole (no token streaming, no second metrics sample).
+    """
+    if not LLM_COALESCE:
+        return await _call(node, model, model_name, prompt_value, config)
+
+    key = (id(asyncio.get_running_loop()), _prompt_key(model_name, bind, prompt_value))
+    return await single_flight(
+        _inflight, key,
+        lambda: _call(node, model, model_name, prompt_value, config),
+        on_join=lambda: inc("analyst_llm_coalesced_total", node=node, model=model_name)
+    )
+
+
+def get_llm(node: str, **bind):
+    """
+    The LLM step of a node's chain (`prompt | get_llm("chart_generator") | parser`), going through
+    the gateway. `bind` kwargs are passed to the model, e.g. max_tokens.
+    """
+    async def invoke(prompt_value, config):
+        model = get_chat_model(node)
+        model_name = _model_name(model)
+        if bind:
+            model = model.bind(**bind)
+        return await _coalesced_call(node, model, model_name, bind, prompt_value, config)
+
+    return RunnableLambda(invoke, name=f"llm_{node}")
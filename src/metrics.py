@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Latency histogram buckets (seconds)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+DESCRIPTIONS = {
+    "analyst_request_duration_seconds": ("histogram", "End-to-end latency of API requests"),
+    "analyst_node_duration_seconds": ("histogram", "Wall time of each graph node"),
+    "analyst_llm_duration_seconds": ("histogram", "Wall time of LLM calls"),
+    "analyst_llm_tokens_total": ("counter", "LLM tokens by kind (prompt / completion)"),
+    "analyst_llm_calls_total": ("counter", "LLM calls"),
+    "analyst_llm_retries_total": ("counter", "LLM calls retried by the gateway, by error"),
+    "analyst_llm_coalesced_total": ("counter", "LLM calls answered by an identical call already in flight"),
+    "analyst_llm_throttle_seconds": ("histogram", "Time LLM calls waited for the per-model rate limiter"),
+    "analyst_sql_duration_seconds": ("histogram", "Execution time of generated SQL"),
+    "analyst_sql_rows_total": ("counter", "Rows returned by generated SQL"),
+    "analyst_sql_retries_total": ("counter", "SQL self-healing decisions (retry / give_up)"),
+    "analyst_sql_validation_seconds": ("histogram", "Time spent validating generated SQL (EXPLAIN)"),
+    "analyst_sql_validation_total": ("counter", "Pre-execution SQL validation outcomes (valid / repaired / invalid)"),
+    "analyst_schema_reflection_seconds": ("histogram", "Time spent reflecting the database schema"),
+    "analyst_history_flush_seconds": ("histogram", "Time spent flushing the chat-history queue"),
+    "analyst_rollup_refresh_seconds": ("histogram", "Time spent refreshing each rollup"),
+    "analyst_intents_total": ("counter", "Questions by the follow-up nodes the intent router selected (chart / email / none)"),
+    "analyst_rollup_routes_total": ("counter", "Questions answered from a rollup without generating SQL"),
+}
+
+_lock = threading.Lock()
+_counters = defaultdict(float)  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+
+# Per-request accumulator, set by start_request() and shared with the nodes/threads it spawns
+_request_timings = ContextVar("request_timings", default=None)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def observe(name: str, seconds: float, **labels):
+    with _lock:
+        histogram = _histograms.setdefault(_key(name, labels), [0] * len(BUCKETS) + [0.0, 0])
+        for idx, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[idx] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+
+def start_request():
+    """
+    Starts collecting per-request timings for the current task (and everything it awaits / spawns).
+    """
+    timings = {"started": time.perf_counter(), "nodes_ms": {}, "llm_ms": 0.0, "sql_ms": 0.0,
+               "prompt_tokens": 0, "completion_tokens": 0, "llm_calls": 0, "sql_retries": 0}
+    _request_timings.set(timings)
+    return timings
+
+
+def get_request_timings():
+    """
+    Returns the current request's timings in a JSON-friendly shape (None outside a request).
+    """
+    timings = _request_timings.get()
+    if timings is None:
+        return None
+
+    result = {key: value for key, value in timings.items() if key != "started"}
+    result["total_ms"] = round((time.perf_counter() - timings["started"]) * 1000, 1)
+    result["llm_ms"] = round(result["llm_ms"], 1)
+    result["sql_ms"] = round(result["sql_ms"], 1)
+    return result
+
+
+def add_to_request(field: str, value):
+    timings = _request_timings.get()
+    if timings is not None:
+        with _lock:
+            timings[field] += value
+
+
+@contextmanager
+def timed(name: str, request_field: str = None, **labels):
+    """
+    Observes the wrapped block's wall time in histogram `name` (and optionally adds it,
+    in ms, to the current request's `request_field`).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        observe(name, elapsed, **labels)
+        if request_field:
+            add_to_request(request_field, elapsed * 1000)
+
+
+def instrument_node(name: str, node):
+    """
+    Wraps an async graph node so its wall time is recorded per node and per request.
+    """
+    async def wrapper(state):
+        started = time.perf_counter()
+        try:
+            return await node(state)
+        finally:
+            elapsed = time.perf_counter() - started
+            observe("analyst_node_duration_seconds", elapsed, node=name)
+
+            timings = _request_timings.get()
+            if timings is not None:
+                with _lock:
+                    nodes = timings["nodes_ms"]
+                    nodes[name] = round(nodes.get(name, 0.0) + elapsed * 1000, 1)
+
+    wrapper.__name__ = getattr(node, "__name__", name)
+    wrapper.__doc__ = node.__doc__
+    return wrapper
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def render_prometheus(gauges: dict = None) -> str:
+    """
+    Renders all metrics in the Prometheus text exposition format.
+    `gauges` maps metric name -> value for point-in-time values (pool sizes, cache entries, ...).
+    """
+    lines = []
+
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(value) for key, value in _histograms.items()}
+
+    names = sorted({name for name, _ in counters} | {name for name, _ in histograms})
+    for name in names:
+        kind, description = DESCRIPTIONS.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, count in zip(BUCKETS, histogram):
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram[-1]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-2]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+
+    for name, value in sorted((gauges or {}).items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {float(value)}")
+
+    return "\n".join(lines) + "\n"
@@ -1,27 +1,127 @@
-from langchain_core.messages import HumanMessage
-from langchain_openai import ChatOpenAI
+import asyncio
+
+from langchain_core.messages import AIMessage, RemoveMessage
+from langgraph.constants import TAG_NOSTREAM
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
-from src.db_config import get_database, get_schema_info
+from src import result_cache, rollups, sql_cache
+from src.charts import build_chart_spec
+from src.chat_context import HISTORY_SUMMARY_TOKENS, build_history_context, format_message, latest_question, split_history
+from src.intent import INTENT_ROUTING, classify_intent
+from src.db_config import get_database, get_schema_columns, get_schema_context, get_schema_info, select_tables
+from src.llm_gateway import get_llm
+from src.metrics import inc, timed
+from src.query_result import explain_query, fetch_query_result, to_prompt_text
+from src.sql_guard import (
+    SQL_VALIDATION, SQL_VALIDATION_REPAIRS, SqlValidationError, check_references, describe_error, error_fragment
+)
 from src.state import AgentState
 
-# Initialize the LLM
-llm = ChatOpenAI(model="gpt-4o", temperature=0)
+def _clean_sql(generated_sql: str) -> str:
+    return generated_sql.replace("```sql", "").replace("```", "").strip()
+
+def _prompt_schema(text: str, compact: bool = False) -> str:
+    """
+    Schema context for `text`, followed by the available rollups that cover its tables.
+    """
+    context = get_schema_context(text, compact)
+    rollup_context = rollups.get_rollup_context(select_tables(text) or list(get_schema_columns()))
+    return f"{context}\n\n{rollup_context}" if rollup_context else context
+
+async def _repair_sql(question: str, previous_query: str, error: str, fragment: str = None) -> str:
+    """
+    Asks the LLM to fix a failed query. The prompt is kept small: the failing line,
+    the database's message and a one-line column list of the tables involved.
+    """
+    fragment = fragment or error_fragment(previous_query, error) or "(not located)"
+    # The failed query names the tables it used, keep those in the context too
+    schema_context = await asyncio.to_thread(_prompt_schema, f"{question}\n{previous_query}", True)
+
+    system_prompt = """
+            You are a PostgreSQL expert. The previous query you generated failed with an error.
+
+            Tables:
+            {schema}
+
+            Previous Query: {previous_query}
+            Failing Part: {fragment}
+            Error Message: {error}
+
+            Task:
+            Fix the SQL query to resolve the error. Return ONLY the corrected SQL.
+            """
 
-def clean_data_for_llm(data):
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", system_prompt)
+    ])
+    chain = prompt | get_llm("sql_analyst") | StrOutputParser()
+    return await chain.ainvoke({
+        "schema": schema_context,
+        "previous_query": previous_query,
+        "fragment": fragment,
+        "error": error
+    })
+
+def _validate_sql(db, sql: str):
     """
-    Helper to convert complex Python objects (UUID, Decimal)
-    into a string format that is easier for the LLM to read.
+    Raises if the query would fail: static checks against the cached schema first (no round trip),
+    then EXPLAIN, which plans the query without running it.
     """
-    if isinstance(data, list):
-        # Convert list of tuples/objects to string, replacing specific types
-        clean_str = str(data)
-        clean_str = clean_str.replace("UUID(", "").replace(")", "")
-        clean_str = clean_str.replace("Decimal(", "").replace(")", "")
-        return clean_str
-    return str(data)
+    check_references(sql, {**get_schema_columns(), **rollups.get_rollup_columns()})
+    with timed("analyst_sql_validation_seconds"):
+        explain_query(db, sql)
 
-def sql_analyst_node(state: AgentState):
+async def _validate_and_repair(db, question: str, sql: str):
+    """
+    Validates generated SQL before it is executed and repairs it in place (up to
+    SQL_VALIDATION_REPAIRS times), so most bad queries never cost an execution and a graph retry.
+    Returns (sql, None) if valid, else (last sql, error message).
+    """
+    for attempt in range(SQL_VALIDATION_REPAIRS + 1):
+        try:
+            await asyncio.to_thread(_validate_sql, db, sql)
+            inc("analyst_sql_validation_total", outcome="repaired" if attempt else "valid")
+            return sql, None
+
+        except Exception as ex:
+            error = describe_error(ex)
+            fragment = ex.fragment if isinstance(ex, SqlValidationError) else None
+            print(f"🔍 SQL failed validation: {error}")
+
+            if attempt == SQL_VALIDATION_REPAIRS:
+                inc("analyst_sql_validation_total", outcome="invalid")
+                return sql, error
+
+            repaired = await _repair_sql(question, sql, error, fragment)
+            sql = _clean_sql(repaired)
+            print(f"Repaired SQL: {sql}")
+
+async def intent_router_node(state: AgentState):
+    """
+    Graph entry: decides locally (no LLM call) which of the chart / email nodes this question needs,
+    so the graph can route around the others. Also clears the previous turn's chart and email outputs,
+    which skipped nodes would otherwise leave in the thread's state, and its SQL error and retry count,
+    so a turn that gave up does not send the next question down the repair path with its query.
+    """
+    print("--- INTENT ROUTER NODE ---")
+    intent = classify_intent(latest_question(state["messages"])) if INTENT_ROUTING else None
+
+    if intent is not None:
+        route = "+".join(name for name in ("chart", "email") if intent[name]) or "none"
+        print(f"Intent: {route}")
+        inc("analyst_intents_total", route=route)
+
+    return {
+        "intent" : intent,
+        "sql_query" : None,
+        "error" : None,
+        "retry_count" : 0,
+        "visualization_spec" : None,
+        "email_draft" : None,
+        "needs_approval" : False
+    }
+
+async def sql_analyst_node(state: AgentState):
     """
     1. Analyzes the user's request.
     2. Fetches the DB Schema.
@@ -31,40 +131,40 @@ def sql_analyst_node(state: AgentState):
     """
     print("--- SQL ANALYST NODE ---")
     messages = state['messages']
-    user_question = messages[-1].content
+    user_question = latest_question(messages)
 
-    db = get_database()
-    schema = get_schema_info()
+    # Reflection / engine setup is blocking, keep it off the event loop
+    db = await asyncio.to_thread(get_database)
+    schema = await asyncio.to_thread(get_schema_info)
 
     error = state.get("error")
     retries = state.get("retry_count", 0)
+    _, chat_history, _ = split_history(messages)
+    history_summary = state.get("history_summary")
+    # Earlier turns, verbatim or summarized: the answer may depend on them
+    prior_context = chat_history + ([history_summary] if history_summary else [])
+    cached_sql = None
+    routed = None
 
-    if error:
-        print(f"⚠️ Attempting to fix SQL error (Attempt {retries + 1})...")
-        system_prompt = """
-                You are a PostgreSQL expert. The previous query you generated failed with an error.
+    if not error and not sql_cache.has_history_dependency(user_question, prior_context):
+        # Common phrasings of the hot aggregates are answered from a rollup, no LLM call
+        routed = rollups.route(sql_cache.normalize_question(user_question))
 
-                Database Schema:
-                {schema}
+    if not error and not routed:
+        cached_sql = await asyncio.to_thread(sql_cache.lookup, user_question, schema, prior_context)
 
-                Previous Query: {previous_query}
-                Error Message: {error}
+    if routed:
+        print(f"📦 Answering from rollup {routed[0]}...")
+        generated_sql = routed[1]
 
-                Task:
-                Fix the SQL query to resolve the error. Return ONLY the corrected SQL.
-                """
-        # We use the query from the state that failed
-        previous_query = state.get("sql_query", "")
+    elif cached_sql:
+        print("⚡ Reusing cached SQL query...")
+        generated_sql = cached_sql
 
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", system_prompt)
-        ])
-        chain = prompt | llm | StrOutputParser()
-        generated_sql = chain.invoke({
-            "schema": schema,
-            "previous_query": previous_query,
-            "error": error
-        })
+    elif error:
+        print(f"⚠️ Attempting to fix SQL error (Attempt {retries + 1})...")
+        # We use the query from the state that failed
+        generated_sql = await _repair_sql(user_question, state.get("sql_query", ""), error)
 
     else :
         print("🧠 Generating new SQL query...")
@@ -86,7 +186,8 @@ def sql_analyst_node(state: AgentState):
         4. Cast monetary values to numeric/float if needed for aggregation.
         """
 
-        chat_history_str = "\n".join([f"{msg.type}: {msg.content}" for msg in messages[:-1]])
+        # Recent turns verbatim + a rolling summary of the older ones, bounded however long the thread is
+        chat_history_str = build_history_context(messages, history_summary)
 
         prompt = ChatPromptTemplate.from_messages([
             ("system", template),
@@ -94,50 +195,107 @@ def sql_analyst_node(state: AgentState):
             ("human", "{question}")
         ])
 
-        chain = prompt | llm | StrOutputParser()
-        generated_sql = chain.invoke({"schema": schema, "question": user_question})
+        # Only the tables relevant to the question (and their join paths) go into the prompt.
+        # Recent turns count too, a follow-up ("show them by city") builds on the previous query.
+        schema_context = await asyncio.to_thread(_prompt_schema, f"{user_question}\n{chat_history_str}")
+        chain = prompt | get_llm("sql_analyst") | StrOutputParser()
+        generated_sql = await chain.ainvoke({"schema": schema_context, "question": user_question})
 
-    clean_sql = generated_sql.replace("```sql", "").replace("```", "").strip()
+    clean_sql = _clean_sql(generated_sql)
     print(f"Generated SQL: {clean_sql}")
+
+    if SQL_VALIDATION and not cached_sql and not routed:
+        clean_sql, validation_error = await _validate_and_repair(db, user_question, clean_sql)
+        if validation_error:
+            return {
+                "sql_query": clean_sql,
+                "query_result": None,
+                "cache_hit" : False,
+                "error": validation_error,
+                "retry_count": retries + 1
+            }
+
     try:
-        result = db.run(clean_sql)
+        cache_hit, result = result_cache.get(clean_sql)
+
+        if cache_hit:
+            print("⚡ Serving query result from cache...")
+        else:
+            async def execute():
+                with timed("analyst_sql_duration_seconds", "sql_ms"):
+                    result = await asyncio.to_thread(fetch_query_result, db, clean_sql)
+                inc("analyst_sql_rows_total", result["row_count"])
+                result_cache.put(clean_sql, result)
+                return result
+
+            # Within a batch, identical SQL from different questions runs once
+            result = await result_cache.shared_fetch(clean_sql, execute)
 
-        if "Error:" in str(result) or "exception" in str(result).lower():
-            raise Exception(str(result))
+        print(f"Query Result: {result['row_count']} rows, columns {result['columns']}")
 
-        print(f"Query Result: {result}")
+        if not cached_sql and not routed and not sql_cache.has_history_dependency(user_question, prior_context):
+            try:
+                await asyncio.to_thread(sql_cache.store, user_question, schema, clean_sql)
+            except Exception as ex:
+                print(f"⚠️ Could not cache SQL: {ex}")
+
+        # The answer stays in the conversation so follow-up questions can build on it
+        answer = AIMessage(content=f"SQL: {clean_sql}\nResult: {result['row_count']} rows, columns {', '.join(result['columns'])}")
 
         return {
+            "messages": [answer],
             "sql_query": clean_sql,
             "query_result": result,
+            "cache_hit" : cache_hit,
             "error" : None,
             "retry_count" : 0
         }
 
     except Exception as e:
-        error_msg = str(e)
+        error_msg = describe_error(e)
         print(f"❌ SQL Execution Failed: {error_msg}")
 
+        # A rollup that fails (dropped, being recreated, ...) is not routed to until its next refresh
+        if routed:
+            rollups.mark_unavailable(routed[0], error_msg)
+
+        # A cached query that no longer runs must not be served again
+        if cached_sql:
+            try:
+                await asyncio.to_thread(sql_cache.invalidate, user_question, schema)
+            except Exception as ex:
+                print(f"⚠️ Could not invalidate cached SQL: {ex}")
+
         return {
             "sql_query": clean_sql,
             "query_result": None,
+            "cache_hit" : False,
             "error": error_msg,
             "retry_count": retries + 1
         }
 
-def chart_generator_node(state: AgentState):
+async def chart_generator_node(state: AgentState):
     """
     Analyzes the query result and user question to decide if a chart is needed.
     Generates a Recharts-compatible JSON spec if yes.
     """
     print("--- CHART GENERATOR NODE ---")
     data = state.get("query_result")
-    question = state["messages"][-1].content
+    question = latest_question(state["messages"])
 
-    if not data or "Error" in str(data):
+    if not data or not data["row_count"]:
         print("No valid data to visualize.")
         return {"visualization_spec" : None}
 
+    # Fast path: common result shapes are charted (or skipped) without an LLM call
+    handled, chart_config = build_chart_spec(data)
+    if handled:
+        if chart_config:
+            print(f"Chart Type: {chart_config['type']} (rule-based)")
+        else:
+            print("No chart needed.")
+        return {"visualization_spec" : chart_config}
+
     template = """
     You are a Data Visualization Expert.
     Given the following dataset and user question, decide if a chart is appropriate.
@@ -165,10 +323,10 @@ def chart_generator_node(state: AgentState):
         ("human", "Generate the chart config.")
     ])
 
-    chain = prompt | llm | JsonOutputParser()
+    chain = prompt | get_llm("chart_generator") | JsonOutputParser()
 
     try:
-        chart_config = chain.invoke({"question":question, "data":str(data)[:3000]}) #Truncating to avoid token limit
+        chart_config = await chain.ainvoke({"question":question, "data":to_prompt_text(data, 3000)}) #Truncating to avoid token limit
 
         if chart_config and chart_config.get('type'):
             print(f"Chart Type: {chart_config.get('type')}")
@@ -181,21 +339,21 @@ def chart_generator_node(state: AgentState):
         print(f"Chart generation failed:{ex}")
         return {"visualization_spec" : None}
 
-def marketing_agent_node(state: AgentState):
+async def marketing_agent_node(state: AgentState):
     """
     Checks if the user request implies an action (email,report,etc.).
     If yes, drafts the content.
     """
     print("--- MARKETING AGENT NODE ---")
     raw_data = state.get("query_result")
-    question = state["messages"][-1].content.lower()
+    question = latest_question(state["messages"])
 
-    triggers = ["email","draft","send","write to","contact"]
-    if not any(trigger in question for trigger in triggers):
+    intent = state.get("intent") or classify_intent(question)
+    if not intent["email"]:
         return {"email_draft" : None , "needs_approval":False}
 
-    # Clean data for email context
-    data_str = clean_data_for_llm(raw_data)
+    # Compact, truncated text rendering of the result for the email context
+    data_str = to_prompt_text(raw_data, 3000)
 
     template = """
     You are a CRM Marketing Expert.
@@ -215,10 +373,10 @@ def marketing_agent_node(state: AgentState):
     prompt = ChatPromptTemplate.from_messages([
         ("system", template),
     ])
-    chain = prompt | llm | StrOutputParser()
+    chain = prompt | get_llm("marketing_agent") | StrOutputParser()
 
     try:
-        email_draft = chain.invoke({"question":question, "data":str(data_str)[:3000]})
+        email_draft = await chain.ainvoke({"question":question, "data":data_str})
         print(f"Email Drafted: {email_draft}")
 
         return {
@@ -230,7 +388,7 @@ def marketing_agent_node(state: AgentState):
         print(f"Email draft failed: {ex}")
         return {"email_draft" : None , "needs_approval":False}
 
-def send_mail_node(state: AgentState):
+async def send_mail_node(state: AgentState):
     """
     This is the FINAL action node.
     We interrupt BEFORE this node executes.
@@ -242,5 +400,52 @@ def send_mail_node(state: AgentState):
     print(f"\n🚀 Sending Email ...\n Content : {email_draft[:100]}...\n")
 
     return {
-        "messages" : [HumanMessage(content="✅ Email sent!")]
+        "messages" : [AIMessage(content="✅ Email sent!")]
+    }
+
+async def summarize_history_node(state: AgentState):
+    """
+    Folds the turns that fell out of the context window into the rolling summary.
+    Only the newly folded turns are sent to the LLM, together with the current summary,
+    and they are then removed from the checkpointed messages.
+    Runs alongside the chart / email nodes, off the SQL critical path.
+    """
+    to_fold, _, _ = split_history(state["messages"], answered=True)
+    if not to_fold:
+        return {}
+
+    print(f"--- SUMMARIZE HISTORY NODE ({len(to_fold)} messages) ---")
+    template = """
+    You maintain a running summary of a data analysis conversation.
+    Extend the current summary with the new lines, keeping what later questions may refer to:
+    the metrics, filters, time ranges, entities and SQL logic discussed.
+    Keep it under {max_words} words. Return ONLY the summary text.
+
+    Current summary:
+    {summary}
+
+    New lines:
+    {lines}
+    """
+
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", template)
+    ])
+    chain = prompt | get_llm("summarize_history", max_tokens=HISTORY_SUMMARY_TOKENS) | StrOutputParser()
+
+    try:
+        summary = await chain.ainvoke({
+            "summary": state.get("history_summary") or "(empty)",
+            "lines": "\n".join(format_message(message) for message in to_fold),
+            "max_words": HISTORY_SUMMARY_TOKENS * 3 // 4
+        }, config={"tags": [TAG_NOSTREAM]})  # Internal call, not part of the streamed answer
+
+    except Exception as ex:
+        # Keep the turns; they are folded on a later run
+        print(f"History summary failed: {ex}")
+        return {}
+
+    return {
+        "history_summary": summary.strip(),
+        "messages": [RemoveMessage(id=message.id) for message in to_fold]
     }
\ No newline at end of file
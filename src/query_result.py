@@ -0,0 +1,189 @@
+import datetime
+import decimal
+import os
+import uuid
+from typing import TypedDict, List, Any, Optional
+
+from sqlalchemy import text
+
+from src.sql_guard import enforce_limit, strip_statement
+
+# Budgets for a single generated query: rows kept, approximate bytes kept, server-side runtime
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "1000"))
+QUERY_MAX_BYTES = int(os.getenv("QUERY_MAX_BYTES", str(5 * 1024 * 1024)))
+QUERY_TIMEOUT_MS = int(os.getenv("QUERY_TIMEOUT_MS", "15000"))
+# Run a count(*) over the original query when the result was truncated
+QUERY_COUNT_TRUNCATED = os.getenv("QUERY_COUNT_TRUNCATED", "true").lower() == "true"
+
+FETCH_BATCH_SIZE = 200
+
+
+class QueryResult(TypedDict):
+    """
+    Columnar result of an executed SQL query.
+    Values are already converted to JSON-friendly Python types.
+    """
+
+    columns: List[str]  # Real column names, in SELECT order
+    types: List[str]  # Logical type per column: "number", "datetime", "boolean" or "string"
+    data: List[List[Any]]  # One array of values per column
+    row_count: int  # Rows actually returned (after the row / byte budget)
+    total_rows: Optional[int]  # Rows the query would have produced, None if unknown
+    truncated: bool  # True if rows were dropped to stay within the budget
+
+
+def _to_native(value):
+    """
+    Converts driver types (Decimal, UUID, dates, ...) into JSON-friendly values.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+
+def _logical_type(values) -> str:
+    sample = next((value for value in values if value is not None), None)
+
+    if isinstance(sample, bool):
+        return "boolean"
+    if isinstance(sample, (int, float, decimal.Decimal)):
+        return "number"
+    if isinstance(sample, (datetime.date, datetime.datetime)):
+        return "datetime"
+    return "string"
+
+
+def build_query_result(columns, rows, total_rows: Optional[int] = None, truncated: bool = False) -> QueryResult:
+    """
+    Pivots fetched rows into a QueryResult.
+    """
+    columns = list(columns)
+    data = [list(column) for column in zip(*rows)] if rows else [[] for _ in columns]
+
+    return {
+        "columns": columns,
+        "types": [_logical_type(values) for values in data],
+        "data": [[_to_native(value) for value in values] for values in data],
+        "row_count": len(rows),
+        "total_rows": len(rows) if total_rows is None and not truncated else total_rows,
+        "truncated": truncated,
+    }
+
+
+def _row_size(row) -> int:
+    return sum(len(str(value)) for value in row) + len(row)
+
+
+def _count_rows(conn, sql: str) -> Optional[int]:
+    try:
+        # The closing parenthesis on its own line: a comment on the query's last line can't swallow it
+        return conn.execute(text(f"SELECT count(*) FROM ({sql}\n) AS counted_query")).scalar()
+    except Exception as ex:
+        print(f"⚠️ Could not count rows of truncated query: {ex}")
+        return None
+
+
+def fetch_query_result(db, sql: str, max_rows: int = QUERY_MAX_ROWS, max_bytes: int = QUERY_MAX_BYTES) -> QueryResult:
+    """
+    Executes SQL on the SQLDatabase's engine and returns the rows as columnar data.
+
+    The query is capped with a LIMIT, runs under QUERY_TIMEOUT_MS and is read through a
+    server-side cursor that stops at max_rows / max_bytes, so a runaway "SELECT *" can't
+    exhaust worker memory. Raises the driver error if the statement fails.
+    """
+    sql = strip_statement(sql)
+
+    with db._engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            # SET LOCAL only lasts for this transaction, the pooled connection keeps its defaults
+            conn.execute(text(f"SET LOCAL statement_timeout = {int(QUERY_TIMEOUT_MS)}"))
+
+        cursor = conn.execution_options(stream_results=True).execute(text(enforce_limit(sql, max_rows)))
+
+        if not cursor.returns_rows:
+            return build_query_result([], [])
+
+        columns = cursor.keys()
+        rows, size, truncated = [], 0, False
+
+        while not truncated:
+            batch = cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not batch:
+                break
+
+            for row in batch:
+                size += _row_size(row)
+                if len(rows) >= max_rows or size > max_bytes:
+                    truncated = True
+                    break
+                rows.append(row)
+
+        cursor.close()
+
+        total_rows = None
+        if truncated and QUERY_COUNT_TRUNCATED:
+            total_rows = _count_rows(conn, sql)
+
+        return build_query_result(columns, rows, total_rows=total_rows, truncated=truncated)
+
+
+def explain_query(db, sql: str):
+    """
+    Has the database parse and plan the query without running it (EXPLAIN, no ANALYZE),
+    which catches unknown columns, type mismatches and syntax errors in one cheap round trip.
+    Raises the driver error if the statement would fail.
+    """
+    sql = strip_statement(sql)
+
+    with db._engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text(f"SET LOCAL statement_timeout = {int(QUERY_TIMEOUT_MS)}"))
+            explain = "EXPLAIN"
+        elif conn.dialect.name == "sqlite":
+            explain = "EXPLAIN QUERY PLAN"
+        else:
+            explain = "EXPLAIN"
+
+        conn.execute(text(f"{explain} {sql}")).fetchall()
+
+
+def to_records(result: QueryResult) -> List[dict]:
+    """
+    Row-oriented view ([{column: value}, ...]), e.g. for chart data.
+    """
+    return [dict(zip(result["columns"], row)) for row in zip(*result["data"])]
+
+
+def to_prompt_text(result: QueryResult, max_chars: int = 3000) -> str:
+    """
+    Compact CSV-like rendering for LLM prompts. Stops at whole rows once max_chars is reached
+    and notes how many rows were left out.
+    """
+    if not result or not result["columns"]:
+        return ""
+
+    lines = [",".join(result["columns"])]
+    length = len(lines[0])
+    shown = 0
+
+    for row in zip(*result["data"]):
+        line = ",".join("" if value is None else str(value) for value in row)
+        if length + len(line) + 1 > max_chars:
+            break
+        lines.append(line)
+        length += len(line) + 1
+        shown += 1
+
+    total = result.get("total_rows") or result["row_count"]
+    if shown < total:
+        lines.append(f"... ({total - shown} more rows)")
+
+    return "\n".join(lines)
@@ -0,0 +1,175 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+
+from src.single_flight import single_flight
+
+# Seconds a query result is served from memory before the SQL is executed again (0 disables the cache)
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))
+# Memory budget for cached results (approximate bytes)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Results of queries calling these functions change between runs and are never cached
+VOLATILE_FUNCTIONS = re.compile(r"\b(random|now|clock_timestamp|statement_timestamp|timeofday)\s*\(|\bcurrent_(timestamp|time|date)\b")
+
+# String literals and quoted identifiers, whose contents are kept as they are
+_LITERAL = r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\""
+_LITERAL_OR_COMMENT = re.compile(rf"({_LITERAL})|--[^\n]*|/\*.*?\*/", re.DOTALL)
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # canonical sql -> (result, size, expires_at)
+_total_bytes = 0
+# Queries in flight within a batch (see start_shared_fetches): canonical sql -> Future
+_shared_fetches = ContextVar("shared_fetches", default=None)
+_stats = {
+    "shared_fetches": 0,
+    "hits": 0,
+    "misses": 0,
+    "expired": 0,
+    "evictions": 0,
+    "skipped_too_large": 0,
+    "invalidations": 0,
+}
+
+
+def canonicalize_sql(sql: str) -> str:
+    """
+    Normalizes SQL text so trivially different spellings share a cache entry:
+    comments removed, whitespace collapsed, trailing semicolons dropped and
+    everything outside string literals lowercased.
+    """
+    # In one pass with the literals, so that "--" inside a string is not taken for a comment
+    sql = _LITERAL_OR_COMMENT.sub(lambda match: match.group(1) or " ", sql)
+
+    # Split on string literals / quoted identifiers so their contents keep their case
+    parts = re.split(f"({_LITERAL})", sql)
+    parts = [part if part[:1] in ("'", '"') else re.sub(r"\s+", " ", part.lower()) for part in parts]
+
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def _estimate_size(value) -> int:
+    """
+    Rough deep size of a result (str, rows, columns, dicts of those).
+    """
+    if isinstance(value, (str, bytes)):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_estimate_size(k) + _estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def _drop(key):
+    global _total_bytes
+    _, size, _ = _entries.pop(key)
+    _total_bytes -= size
+
+
+def get(sql: str):
+    """
+    Returns (hit, result) for the SQL. Expired entries are dropped on access.
+    """
+    key = canonicalize_sql(sql)
+
+    with _lock:
+        entry = _entries.get(key)
+
+        if entry is None:
+            _stats["misses"] += 1
+            return False, None
+
+        result, _, expires_at = entry
+        if time.monotonic() >= expires_at:
+            _drop(key)
+            _stats["expired"] += 1
+            _stats["misses"] += 1
+            return False, None
+
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        return True, result
+
+
+def put(sql: str, result):
+    """
+    Caches a result, evicting least-recently-used entries until it fits the byte budget.
+    """
+    global _total_bytes
+
+    key = canonicalize_sql(sql)
+    if RESULT_CACHE_TTL <= 0 or VOLATILE_FUNCTIONS.search(key):
+        return
+
+    size = _estimate_size(result)
+
+    with _lock:
+        if size > RESULT_CACHE_MAX_BYTES:
+            _stats["skipped_too_large"] += 1
+            return
+
+        if key in _entries:
+            _drop(key)
+
+        while _entries and _total_bytes + size > RESULT_CACHE_MAX_BYTES:
+            _drop(next(iter(_entries)))
+            _stats["evictions"] += 1
+
+        _entries[key] = (result, size, time.monotonic() + RESULT_CACHE_TTL)
+        _total_bytes += size
+
+
+def start_shared_fetches():
+    """
+    Starts a scope (the current task and everything it spawns, e.g. one batch) in which
+    identical queries are executed once: concurrent callers of shared_fetch() await the same run.
+    Unlike the TTL cache this also covers queries that are still running, and works with the cache off.
+    """
+    _shared_fetches.set({})
+
+
+async def shared_fetch(sql: str, fetch):
+    """
+    Awaits fetch() to execute the SQL, or reuses the run (in flight or finished) of the same SQL in this scope.
+    """
+    inflight = _shared_fetches.get()
+    if inflight is None:
+        return await fetch()
+
+    def joined():
+        with _lock:
+            _stats["shared_fetches"] += 1
+
+    # Finished runs stay in the scope's dict: the batch reuses them until it ends
+    return await single_flight(inflight, canonicalize_sql(sql), fetch, keep_result=True, on_join=joined)
+
+
+def invalidate_result_cache():
+    """
+    Drops every cached result (call after (re)loading data into the Olist tables).
+    """
+    global _total_bytes
+
+    with _lock:
+        _entries.clear()
+        _total_bytes = 0
+        _stats["invalidations"] += 1
+
+
+def get_cache_stats():
+    """
+    Returns counters and memory usage of the query result cache.
+    """
+    with _lock:
+        stats = dict(_stats)
+        stats["entries"] = len(_entries)
+        stats["bytes"] = _total_bytes
+
+    stats["max_bytes"] = RESULT_CACHE_MAX_BYTES
+    stats["ttl_seconds"] = RESULT_CACHE_TTL
+    return stats
@@ -0,0 +1,444 @@
+import os
+import re
+import threading
+import time
+
+from sqlalchemy import create_engine, inspect, text
+
+from src.metrics import inc, timed
+from src.result_cache import invalidate_result_cache
+
+# --- Rollups ---
+# Materialized views with the hot Olist aggregates (spend per customer, revenue per month,
+# sales per product). They are refreshed in the background, listed in the SQL prompt's schema
+# context, and the most common phrasings of those questions are routed to them without an LLM call.
+# Created by src/script/dbscript.py. On SQLite (local runs, benchmark) they are plain tables rebuilt on refresh.
+
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "true").lower() == "true"
+# Seconds between background refreshes, 0 disables the scheduler
+ROLLUP_REFRESH_INTERVAL = float(os.getenv("ROLLUP_REFRESH_INTERVAL", "3600"))
+# Answer the common phrasings of rollup questions with canned rollup SQL, skipping the LLM
+ROLLUP_ROUTING = os.getenv("ROLLUP_ROUTING", "true").lower() == "true"
+
+# Month bucket of an order, per dialect
+_MONTH = {
+    "postgresql": "date_trunc('month', o.order_purchase_timestamp::timestamp)::date",
+    "sqlite": "substr(o.order_purchase_timestamp, 1, 7) || '-01'",
+}
+
+ROLLUPS = {
+    "mv_customer_spend": {
+        "description": "one row per customer and city; SUM(total_spend) GROUP BY customer_unique_id for per-customer totals",
+        "columns": {"customer_unique_id": "TEXT", "customer_city": "TEXT", "customer_state": "TEXT",
+                    "orders": "INTEGER", "total_spend": "NUMERIC"},
+        "base_tables": {"customers", "orders", "order_payments"},
+        "sql": """
+            SELECT c.customer_unique_id, c.customer_city, c.customer_state,
+                   COUNT(DISTINCT o.order_id) AS orders, SUM(p.payment_value) AS total_spend
+            FROM customers c
+            JOIN orders o ON o.customer_id = c.customer_id
+            JOIN order_payments p ON p.order_id = o.order_id
+            GROUP BY c.customer_unique_id, c.customer_city, c.customer_state
+        """,
+        "unique": ["customer_unique_id", "customer_city", "customer_state"],
+        "indexes": [["total_spend"], ["customer_state", "customer_city"]],
+    },
+    "mv_revenue_by_month": {
+        "description": "one row per purchase month and order status; month is the first day of the month",
+        "columns": {"month": "DATE", "order_status": "TEXT", "orders": "INTEGER", "revenue": "NUMERIC"},
+        "base_tables": {"orders", "order_payments"},
+        "sql": """
+            SELECT {month} AS month, o.order_status,
+                   COUNT(DISTINCT o.order_id) AS orders, SUM(p.payment_value) AS revenue
+            FROM orders o
+            JOIN order_payments p ON p.order_id = o.order_id
+            GROUP BY {month}, o.order_status
+        """,
+        "unique": ["month", "order_status"],
+        "indexes": [],
+    },
+    "mv_product_sales": {
+        "description": "one row per product; revenue is the sum of item prices",
+        "columns": {"product_id": "TEXT", "product_category_name": "TEXT", "items_sold": "INTEGER",
+                    "orders": "INTEGER", "revenue": "NUMERIC", "freight": "NUMERIC"},
+        "base_tables": {"order_items", "products"},
+        "sql": """
+            SELECT oi.product_id, pr.product_category_name,
+                   COUNT(*) AS items_sold, COUNT(DISTINCT oi.order_id) AS orders,
+                   SUM(oi.price) AS revenue, SUM(oi.freight_value) AS freight
+            FROM order_items oi
+            JOIN products pr ON pr.product_id = oi.product_id
+            GROUP BY oi.product_id, pr.product_category_name
+        """,
+        "unique": ["product_id"],
+        "indexes": [["product_category_name", "revenue"]],
+    },
+}
+
+# Common phrasings (after sql_cache.normalize_question) answered straight from a rollup:
+# (pattern, rollup, SQL, default for "top N"). Anything with extra filters, time ranges, ...
+# does not match and goes to the LLM.
+ROUTES = [
+    (re.compile(r"^(?:find |get |who are )?(?:top (?P<n>\d+) )?(?:customers? by (?:total )?spend(?:ing)?|biggest spenders)$"),
+     "mv_customer_spend",
+     "SELECT customer_unique_id, SUM(total_spend) AS total_spend FROM mv_customer_spend "
+     "GROUP BY customer_unique_id ORDER BY total_spend DESC LIMIT {n}", 10),
+    (re.compile(r"^(?:total )?(?:spend|revenue|sales) (?:by|per) (?:customer )?city$"),
+     "mv_customer_spend",
+     "SELECT customer_city, customer_state, SUM(total_spend) AS total_spend FROM mv_customer_spend "
+     "GROUP BY customer_city, customer_state ORDER BY total_spend DESC", None),
+    (re.compile(r"^(?:total )?(?:spend|revenue|sales) (?:by|per) (?:customer )?state$"),
+     "mv_customer_spend",
+     "SELECT customer_state, SUM(total_spend) AS total_spend FROM mv_customer_spend "
+     "GROUP BY customer_state ORDER BY total_spend DESC", None),
+    (re.compile(r"^(?:monthly (?:revenue|sales)|(?:total )?(?:revenue|sales) (?:by|per) month)$"),
+     "mv_revenue_by_month",
+     "SELECT month, SUM(revenue) AS revenue FROM mv_revenue_by_month GROUP BY month ORDER BY month", None),
+    (re.compile(r"^(?:revenue|sales) (?:by|per) (?:product )?categor(?:y|ies)$"),
+     "mv_product_sales",
+     "SELECT product_category_name, SUM(revenue) AS revenue FROM mv_product_sales "
+     "GROUP BY product_category_name ORDER BY revenue DESC", None),
+    (re.compile(r"^(?:find |get )?top (?:(?P<n>\d+) )?products? (?:by|per|in each|for each) categor(?:y|ies)$"),
+     "mv_product_sales",
+     "SELECT product_category_name, product_id, revenue FROM ("
+     "SELECT product_category_name, product_id, revenue, "
+     "ROW_NUMBER() OVER (PARTITION BY product_category_name ORDER BY revenue DESC) AS category_rank "
+     "FROM mv_product_sales) ranked WHERE category_rank <= {n} ORDER BY product_category_name, category_rank", 3),
+]
+
+# Last refresh of each rollup, by whichever worker did it (Unix time, so it reads the same on every dialect)
+REFRESH_LOG = "app_rollup_refreshes"
+# Session advisory lock held while refreshing: one worker refreshes at a time, the others skip the cycle
+_REFRESH_LOCK_ID = 48151623
+
+# "... and draft an email to them" does not change the data that is needed
+_ACTION_SUFFIX = re.compile(r"\s+(?:and|then)\s+(?:draft|send|write|email|generate|create|make|chart|plot)\b.*$")
+
+_engine = None
+_lock = threading.Lock()
+_status = {}  # rollup -> {"available", "refreshed_at", "refresh_seconds", "error"}
+_refresher = None
+_stop_event = threading.Event()
+
+
+def _get_engine():
+    """
+    Rollups are written on the primary (DATABASE_URL), not through the read-only analytics engine.
+    """
+    global _engine
+
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                db_uri = os.getenv("DATABASE_URL")
+                if not db_uri:
+                    raise ValueError("DATABASE_URL not found in environment variables.")
+                _engine = create_engine(db_uri, pool_pre_ping=True, pool_size=1, max_overflow=0)
+
+    return _engine
+
+
+def _definition(name: str, dialect: str) -> str:
+    return ROLLUPS[name]["sql"].format(month=_MONTH.get(dialect, _MONTH["postgresql"]))
+
+
+def _exists(conn, name: str) -> bool:
+    if conn.dialect.name == "postgresql":
+        query = "SELECT 1 FROM pg_matviews WHERE matviewname = :name"
+    else:
+        query = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+    return conn.execute(text(query), {"name": name}).first() is not None
+
+
+def _create_refresh_log(conn):
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {REFRESH_LOG}(
+            rollup TEXT PRIMARY KEY,
+            refreshed_at DOUBLE PRECISION NOT NULL,
+            refresh_seconds DOUBLE PRECISION
+        )
+    """))
+
+
+def _log_refresh(conn, name: str, refreshed_at: float, seconds: float):
+    conn.execute(text(f"""
+        INSERT INTO {REFRESH_LOG} (rollup, refreshed_at, refresh_seconds) VALUES (:name, :refreshed_at, :seconds)
+        ON CONFLICT (rollup) DO UPDATE SET refreshed_at = excluded.refreshed_at, refresh_seconds = excluded.refresh_seconds
+    """), {"name": name, "refreshed_at": refreshed_at, "seconds": seconds})
+
+
+def _read_refresh_log(conn) -> dict:
+    """
+    {rollup: (refreshed_at, refresh_seconds)} of the last refresh of each rollup, by any worker.
+    """
+    if not inspect(conn).has_table(REFRESH_LOG):
+        return {}
+    rows = conn.execute(text(f"SELECT rollup, refreshed_at, refresh_seconds FROM {REFRESH_LOG}"))
+    return {name: (refreshed_at, seconds) for name, refreshed_at, seconds in rows}
+
+
+def _update_status(statuses: dict) -> bool:
+    """
+    Records rollup statuses. True if a rollup was refreshed since this worker last saw it:
+    results cached from its old contents are stale then.
+    """
+    with _lock:
+        refreshed = any(status["refreshed_at"] is not None and status["refreshed_at"] != _status.get(name, {}).get("refreshed_at")
+                        for name, status in statuses.items())
+        _status.update(statuses)
+    return refreshed
+
+
+def _load_status(conn):
+    statuses = {}
+    log = _read_refresh_log(conn)
+    for name in ROLLUPS:
+        if _exists(conn, name):
+            refreshed_at, seconds = log.get(name, (None, None))
+            statuses[name] = {"available": True, "refreshed_at": refreshed_at, "refresh_seconds": seconds, "error": None}
+        else:
+            statuses[name] = {"available": False, "refreshed_at": None, "refresh_seconds": None,
+                              "error": "not created, run src/script/dbscript.py"}
+
+    if _update_status(statuses):
+        invalidate_result_cache()
+
+
+def load_rollup_status():
+    """
+    Marks the rollups that already exist available (with the last refresh recorded by any worker),
+    so they are advertised and routed to from startup instead of after this worker's first refresh.
+    """
+    with _get_engine().connect() as conn:
+        _load_status(conn)
+
+
+def create_rollups():
+    """
+    Creates the missing rollups (with their indexes) and marks them available.
+    """
+    engine = _get_engine()
+
+    with engine.begin() as conn:
+        dialect = conn.dialect.name
+        _create_refresh_log(conn)
+        for name, rollup in ROLLUPS.items():
+            if _exists(conn, name):
+                continue
+
+            print(f"Creating rollup {name}...")
+            if dialect == "postgresql":
+                conn.execute(text(f"CREATE MATERIALIZED VIEW {name} AS {_definition(name, dialect)} WITH DATA"))
+            else:
+                conn.execute(text(f"CREATE TABLE {name} AS {_definition(name, dialect)}"))
+
+            # The unique index is what REFRESH ... CONCURRENTLY needs
+            conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{name}_key ON {name} ({', '.join(rollup['unique'])})"))
+            for columns in rollup["indexes"]:
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{name}_{'_'.join(columns)} ON {name} ({', '.join(columns)})"))
+
+            # Created WITH DATA: as fresh as a refresh
+            _log_refresh(conn, name, time.time(), 0.0)
+
+        _load_status(conn)
+
+
+def drop_rollups():
+    """
+    Drops the rollups and their refresh records, e.g. before the base tables they depend on are recreated.
+    """
+    with _get_engine().begin() as conn:
+        kind = "MATERIALIZED VIEW" if conn.dialect.name == "postgresql" else "TABLE"
+        for name in ROLLUPS:
+            conn.execute(text(f"DROP {kind} IF EXISTS {name}"))
+        if inspect(conn).has_table(REFRESH_LOG):
+            conn.execute(text(f"DELETE FROM {REFRESH_LOG}"))
+
+    with _lock:
+        _status.clear()
+
+
+def _refresh(conn, name: str, force: bool, log: dict) -> dict:
+    """
+    Refreshes one rollup in its own transaction and returns its status. Unless forced, a rollup
+    refreshed (by any worker) less than ROLLUP_REFRESH_INTERVAL ago is left as it is.
+    """
+    started = time.monotonic()
+    try:
+        with conn.begin():
+            if not _exists(conn, name):
+                raise LookupError("not created, run src/script/dbscript.py")
+
+            refreshed_at, seconds = log.get(name, (None, None))
+            if not force and refreshed_at is not None and time.time() - refreshed_at < ROLLUP_REFRESH_INTERVAL:
+                return {"available": True, "refreshed_at": refreshed_at, "refresh_seconds": seconds, "error": None}
+
+            with timed("analyst_rollup_refresh_seconds", rollup=name):
+                if conn.dialect.name == "postgresql":
+                    conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name}"))
+                else:
+                    conn.execute(text(f"DELETE FROM {name}"))
+                    conn.execute(text(f"INSERT INTO {name} {_definition(name, conn.dialect.name)}"))
+
+            refreshed_at, seconds = time.time(), time.monotonic() - started
+            _log_refresh(conn, name, refreshed_at, seconds)
+
+        return {"available": True, "refreshed_at": refreshed_at, "refresh_seconds": seconds, "error": None}
+
+    except Exception as ex:
+        print(f"⚠️ Rollup {name} unavailable: {ex}")
+        return {"available": False, "refreshed_at": None, "refresh_seconds": None, "error": str(ex)}
+
+
+def refresh_rollups(force: bool = False):
+    """
+    Refreshes the existing rollups. PostgreSQL refreshes CONCURRENTLY, so readers are never blocked.
+    Workers share the job: the one holding the advisory lock refreshes, the others only reload the status,
+    and rollups refreshed less than ROLLUP_REFRESH_INTERVAL ago are skipped.
+    force=True (admin refresh, e.g. after loading new data) waits for the lock and refreshes every rollup.
+    Missing or failing rollups are marked unavailable and are neither advertised nor routed to.
+    The query result cache is dropped whenever a rollup has new contents, here or from another worker.
+    """
+    engine = _get_engine()
+
+    with engine.connect() as conn:
+        locking = conn.dialect.name == "postgresql"
+        if locking:
+            if force:
+                conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": _REFRESH_LOCK_ID})
+            elif not conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": _REFRESH_LOCK_ID}).scalar():
+                # Another worker is refreshing: pick up what it last recorded
+                _load_status(conn)
+                conn.rollback()
+                return
+            conn.commit()
+
+        try:
+            with conn.begin():
+                _create_refresh_log(conn)
+                log = _read_refresh_log(conn)
+
+            refreshed = False
+            for name in ROLLUPS:
+                refreshed = _update_status({name: _refresh(conn, name, force, log)}) or refreshed
+
+            # Cached query results may have been read from the old contents
+            if refreshed:
+                invalidate_result_cache()
+
+        finally:
+            if locking:
+                conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": _REFRESH_LOCK_ID})
+                conn.commit()
+
+
+def _refresher_loop():
+    try:
+        load_rollup_status()
+    except Exception as ex:
+        print(f"⚠️ Rollup status unavailable: {ex}")
+
+    while not _stop_event.is_set():
+        try:
+            refresh_rollups()
+        except Exception as ex:
+            print(f"⚠️ Rollup refresh failed: {ex}")
+        _stop_event.wait(ROLLUP_REFRESH_INTERVAL)
+
+
+def start_rollup_refresher():
+    """
+    Starts the background refresh thread: marks the existing rollups available, then refreshes the stale ones
+    right away and every ROLLUP_REFRESH_INTERVAL seconds.
+    """
+    global _refresher
+
+    if not ROLLUPS_ENABLED or ROLLUP_REFRESH_INTERVAL <= 0 or _refresher is not None:
+        return
+
+    _stop_event.clear()
+    _refresher = threading.Thread(target=_refresher_loop, name="rollup-refresher", daemon=True)
+    _refresher.start()
+
+
+def stop_rollup_refresher():
+    global _refresher, _engine
+
+    _stop_event.set()
+    if _refresher is not None:
+        _refresher.join(timeout=5)
+        _refresher = None
+
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+
+
+def available_rollups() -> list:
+    if not ROLLUPS_ENABLED:
+        return []
+    with _lock:
+        return [name for name in ROLLUPS if _status.get(name, {}).get("available")]
+
+
+def mark_unavailable(name: str, error: str):
+    """
+    Stops using a rollup that failed at query time, until the next successful refresh.
+    """
+    with _lock:
+        _status[name] = {**_status.get(name, {}), "available": False, "error": error}
+
+
+def get_rollup_columns() -> dict:
+    """
+    {rollup: [column names]} of the available rollups, for SQL validation.
+    """
+    return {name: list(ROLLUPS[name]["columns"]) for name in available_rollups()}
+
+
+def get_rollup_context(tables: list) -> str:
+    """
+    Prompt text advertising the available rollups that cover the given base tables.
+    """
+    names = [name for name in available_rollups() if ROLLUPS[name]["base_tables"] & set(tables)]
+    if not names:
+        return ""
+
+    lines = ["Pre-aggregated rollups (prefer them over joining the base tables when they answer the question):"]
+    for name in names:
+        rollup = ROLLUPS[name]
+        columns = ", ".join(f"{column} {kind}" for column, kind in rollup["columns"].items())
+        lines.append(f"{name}({columns}) -- {rollup['description']}")
+    return "\n".join(lines)
+
+
+def route(question_key: str):
+    """
+    Canned rollup SQL for a normalized question in one of the common phrasings, else None.
+    Returns (rollup, sql).
+    """
+    if not ROLLUP_ROUTING:
+        return None
+
+    question_key = _ACTION_SUFFIX.sub("", question_key)
+    available = available_rollups()
+
+    for pattern, name, sql, default_n in ROUTES:
+        match = pattern.match(question_key)
+        if match and name in available:
+            inc("analyst_rollup_routes_total", rollup=name)
+            return name, sql.format(n=int(match.groupdict().get("n") or default_n or 0))
+
+    return None
+
+
+def get_rollup_stats():
+    with _lock:
+        status = {name: dict(_status.get(name, {"available": False})) for name in ROLLUPS}
+    return {"enabled": ROLLUPS_ENABLED, "routing": ROLLUP_ROUTING, "refresh_interval": ROLLUP_REFRESH_INTERVAL, "rollups": status}
+
+
+if __name__ == "__main__":
+    create_rollups()
+    refresh_rollups()
+    print(get_rollup_stats())
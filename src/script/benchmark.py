@@ -0,0 +1,338 @@
+"""
+Offline benchmark for the analyst service.
+
+Drives the compiled graph (--target graph) or the FastAPI endpoints in-process (--target api)
+with a deterministic fake LLM (or a recorded-response replay) against a synthetic Olist dataset,
+and reports p50/p95/p99 latency and requests/second per endpoint and per graph node.
+
+    python -m src.script.benchmark --target api --requests 200 --concurrency 16 --llm-latency 0.5
+
+No network access or OpenAI key is needed. By default the dataset is a fresh SQLite file; pass
+--database-url (and --load-fixture to (re)create the synthetic tables there) to use PostgreSQL.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+QUESTIONS = [
+    "Find the top 5 customers by spend",
+    "Show revenue by month",
+    "Which product categories bring the most revenue?",
+    "How many orders were delivered?",
+    "Total spend per customer city",
+    "Find the top 5 customers by spend and draft a thank you email",
+]
+
+
+def percentile(samples, pct):
+    """
+    Nearest-rank percentile of a list of numbers.
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(samples_ms, wall_seconds):
+    return {
+        "count": len(samples_ms),
+        "rps": round(len(samples_ms) / wall_seconds, 2) if wall_seconds else 0.0,
+        "p50_ms": round(percentile(samples_ms, 50), 1),
+        "p95_ms": round(percentile(samples_ms, 95), 1),
+        "p99_ms": round(percentile(samples_ms, 99), 1),
+        "max_ms": round(max(samples_ms), 1) if samples_ms else 0.0,
+    }
+
+
+class InMemoryHistory:
+    """
+    Chat-history store for runs without PostgreSQL (the real store needs psycopg2).
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self.messages = defaultdict(list)
+
+    async def aensure_session(self, thread_id, title="New Analysis"):
+        self.sessions.setdefault(thread_id, title)
+
+    async def asave_message(self, thread_id, role, content, metadata=None):
+        self.messages[thread_id].append({"role": role, "content": content, **(metadata or {})})
+
+    async def aget_sessions(self, limit=50, page_cursor=None):
+        items = [{"thread_id": key, "title": title} for key, title in list(self.sessions.items())[-limit:]]
+        return {"items": items, "next_cursor": None}
+
+    async def aget_session_history(self, thread_id, limit=100, page_cursor=None, include_metadata=True):
+        return {"items": self.messages[thread_id][:limit], "next_cursor": None}
+
+
+class InMemoryApprovals:
+    """
+    Pending-action store for runs without PostgreSQL, same semantics as src/approvals.py minus expiry.
+    """
+
+    def __init__(self):
+        self.actions = {}
+
+    def track_pending_action(self, thread_id, checkpoint_id=None, payload=None):
+        action_id = None
+        for key, action in self.actions.items():
+            if action["thread_id"] != thread_id:
+                continue
+            if action["checkpoint_id"] == checkpoint_id:
+                action_id = key
+            elif action["status"] in ("pending", "failed"):
+                action["status"] = "superseded"
+
+        if checkpoint_id and action_id is None:
+            action_id = f"action_{len(self.actions)}"
+            self.actions[action_id] = {"thread_id": thread_id, "checkpoint_id": checkpoint_id, "status": "pending", "key": None}
+        return action_id
+
+    def find_thread_action(self, thread_id):
+        matches = [key for key, action in self.actions.items() if action["thread_id"] == thread_id]
+        return matches[-1] if matches else None
+
+    def claim_actions(self, action_ids, approved, idempotency_key=None):
+        outcomes = {}
+        for action_id in action_ids:
+            action = self.actions.get(action_id)
+            if action is None:
+                outcomes[action_id] = {"thread_id": None, "checkpoint_id": None, "status": None, "outcome": "not_found"}
+                continue
+
+            if action["status"] in ("pending", "failed"):
+                action.update(status="approving" if approved else "rejected", key=idempotency_key)
+                outcome = "claimed"
+            else:
+                outcome = "replayed" if idempotency_key and action["key"] == idempotency_key else "conflict"
+            outcomes[action_id] = {"thread_id": action["thread_id"], "checkpoint_id": action["checkpoint_id"],
+                                   "status": action["status"], "outcome": outcome}
+        return outcomes
+
+    def finish_action(self, action_id, status, error=None):
+        if self.actions[action_id]["status"] == "approving":
+            self.actions[action_id]["status"] = status
+
+
+def configure_environment(args):
+    """
+    Must run before any src.* import: those modules read their settings at import time.
+    """
+    if not args.database_url:
+        args.database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='analyst_bench_'), 'olist.db')}"
+        args.load_fixture = True
+
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["CHECKPOINT_BACKEND"] = args.checkpoint
+    os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    # The fake model has no rate limit to respect
+    os.environ.setdefault("LLM_RPM", "0")
+
+    if not args.warm_caches:
+        # Every request takes the full path (LLM + SQL) unless cache effects are being measured
+        os.environ["SQL_CACHE_ENABLED"] = "false"
+        os.environ["RESULT_CACHE_TTL"] = "0"
+        os.environ["LLM_COALESCE"] = "false"
+
+    os.environ["ROLLUPS_ENABLED"] = "true" if args.rollups else "false"
+
+
+def build_model(args):
+    from src.script.fake_llm import FakeAnalystModel, ReplayChatModel
+
+    if args.replay:
+        return ReplayChatModel.from_file(args.replay, latency=args.llm_latency, seed=args.seed)
+    return FakeAnalystModel(latency=args.llm_latency, seed=args.seed)
+
+
+async def run_workload(total, concurrency, make_call):
+    """
+    Runs make_call(i) for i in range(total) with at most `concurrency` in flight.
+    Returns (wall seconds, list of (endpoint, ms, node timings)).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def worker(idx):
+        async with semaphore:
+            samples.extend(await make_call(idx))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(idx) for idx in range(total)))
+    return time.perf_counter() - started, samples
+
+
+async def bench_graph(args):
+    from langchain_core.messages import HumanMessage
+    from src.graph import get_app
+    from src.metrics import start_request, get_request_timings
+
+    app = await get_app()
+
+    async def call(idx):
+        # Each call runs in its own task, so start_request() gets its own accumulator
+        start_request()
+        config = {"configurable": {"thread_id": f"bench_graph_{idx}"}}
+        question = QUESTIONS[idx % len(QUESTIONS)]
+
+        started = time.perf_counter()
+        await app.ainvoke({"messages": [HumanMessage(content=question)]}, config=config)
+        elapsed = (time.perf_counter() - started) * 1000
+
+        return [("graph", elapsed, get_request_timings()["nodes_ms"])]
+
+    return await run_workload(args.requests, args.concurrency, call)
+
+
+async def bench_api(args):
+    import httpx
+    import main
+
+    if not args.database_url.startswith("postgresql"):
+        history = InMemoryHistory()
+        for name in ("aensure_session", "asave_message", "aget_sessions", "aget_session_history"):
+            setattr(main, name, getattr(history, name))
+
+        from src import approvals
+        store = InMemoryApprovals()
+        for name in ("track_pending_action", "find_thread_action", "claim_actions", "finish_action"):
+            setattr(approvals, name, getattr(store, name))
+
+    transport = httpx.ASGITransport(app=main.server)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+        async def timed_request(method, url, **kwargs):
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            response.raise_for_status()
+            return response, (time.perf_counter() - started) * 1000
+
+        async def call(idx):
+            thread_id = f"bench_api_{idx}"
+            question = QUESTIONS[idx % len(QUESTIONS)]
+            samples = []
+
+            if idx % 2 == 0:
+                response, elapsed = await timed_request("POST", "/chat", json={"message": question, "thread_id": thread_id})
+                body = response.json()
+                samples.append(("/chat", elapsed, (body.get("timings") or {}).get("nodes_ms", {})))
+            else:
+                response, elapsed = await timed_request("POST", "/chat/stream", json={"message": question, "thread_id": thread_id})
+                done = [line for line in response.text.splitlines() if line.startswith("data:")][-1]
+                body = json.loads(done[len("data:"):])
+                samples.append(("/chat/stream", elapsed, (body.get("timings") or {}).get("nodes_ms", {})))
+
+            if body.get("status") == "paused":
+                _, elapsed = await timed_request("POST", "/approve", json={"thread_id": thread_id, "approved": True})
+                samples.append(("/approve", elapsed, {}))
+
+            _, elapsed = await timed_request("GET", f"/history/{thread_id}")
+            samples.append(("/history/{thread_id}", elapsed, {}))
+            _, elapsed = await timed_request("GET", "/history", params={"limit": 20})
+            samples.append(("/history", elapsed, {}))
+            return samples
+
+        return await run_workload(args.requests, args.concurrency, call)
+
+
+def report(args, wall_seconds, samples):
+    endpoints, nodes = defaultdict(list), defaultdict(list)
+    for endpoint, elapsed, node_timings in samples:
+        endpoints[endpoint].append(elapsed)
+        for node, node_ms in (node_timings or {}).items():
+            nodes[node].append(node_ms)
+
+    result = {
+        "target": args.target,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "llm_latency": args.llm_latency,
+        "wall_seconds": round(wall_seconds, 3),
+        "endpoints": {name: summarize(values, wall_seconds) for name, values in sorted(endpoints.items())},
+        "nodes": {name: summarize(values, wall_seconds) for name, values in sorted(nodes.items())},
+    }
+
+    print(f"\n📊 {args.target} benchmark: {args.requests} requests, concurrency {args.concurrency}, "
+          f"LLM latency {args.llm_latency}s, wall {wall_seconds:.2f}s\n")
+    header = f"{'':28} {'count':>7} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    for section in ("endpoints", "nodes"):
+        print(section.upper())
+        print(header)
+        for name, stats in result[section].items():
+            print(f"{name:28} {stats['count']:>7} {stats['rps']:>8} {stats['p50_ms']:>9} "
+                  f"{stats['p95_ms']:>9} {stats['p99_ms']:>9} {stats['max_ms']:>9}")
+        print()
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(result, file, indent=2)
+        print(f"Results written to {args.json}")
+
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline latency / throughput benchmark for the analyst graph and API.")
+    parser.add_argument("--target", choices=["graph", "api"], default="api")
+    parser.add_argument("--requests", type=int, default=100, help="Number of workload iterations")
+    parser.add_argument("--concurrency", type=int, default=8, help="Iterations in flight at once")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated mean seconds per LLM call")
+    parser.add_argument("--replay", help="JSONL file recorded with RecordingChatModel to replay instead of canned answers")
+    parser.add_argument("--database-url", help="Olist database (default: fresh SQLite file)")
+    parser.add_argument("--load-fixture", action="store_true", help="(Re)create the synthetic Olist tables at --database-url. DROPS existing tables")
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--checkpoint", choices=["memory", "postgres"], default="memory")
+    parser.add_argument("--warm-caches", action="store_true", help="Keep the SQL / result caches enabled")
+    parser.add_argument("--rollups", action="store_true", help="Create the rollups and route matching questions to them")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="Show the nodes' console output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_environment(args)
+
+    from src.script.olist_fixture import load_fixture
+
+    if args.load_fixture:
+        from src.rollups import drop_rollups
+
+        # The rollups depend on the tables the fixture recreates
+        drop_rollups()
+        print(f"🗄️  Loading synthetic Olist data into {args.database_url} ...")
+        load_fixture(args.database_url, customers_count=args.customers, orders_count=args.orders, seed=args.seed)
+
+    if args.rollups:
+        from src.rollups import create_rollups
+        create_rollups()
+
+    from src import llm_gateway
+
+    llm_gateway.set_model(build_model(args).with_config(callbacks=[llm_gateway.LLMMetricsCallback()]))
+
+    bench = bench_graph if args.target == "graph" else bench_api
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    print("🚀 Running benchmark ...")
+    with output:
+        wall_seconds, samples = asyncio.run(bench(args))
+
+    return report(args, wall_seconds, samples)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -1,10 +1,8 @@
 import os
 import psycopg2
-from dotenv import load_dotenv
 
-from src.db_config import get_db_connection
-
-load_dotenv()
+from src.db_config import get_db_connection, release_db_connection
+from src.rollups import create_rollups
 
 
 def init_history_db():
@@ -36,6 +34,59 @@ def init_history_db():
             );
         """)
 
+        # Keyset pagination indexes for /history and /history/{thread_id}
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_app_sessions_created ON app_sessions(created_at DESC, thread_id DESC);
+        """)
+
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_app_messages_thread_created ON app_messages(thread_id, created_at, id);
+        """)
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS app_sql_cache(
+                schema_hash TEXT NOT NULL, -- Fingerprint of the schema the SQL was generated against
+                question_key TEXT NOT NULL, -- Normalized question
+                question TEXT,
+                sql_query TEXT NOT NULL,
+                hits INTEGER DEFAULT 0,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                last_used_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (schema_hash, question_key)
+            );
+        """)
+
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_app_sql_cache_lru ON app_sql_cache(schema_hash, last_used_at);
+        """)
+
+        # Approval queue: one row per run paused before send_email (see src/approvals.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS app_pending_actions(
+                action_id TEXT PRIMARY KEY,
+                thread_id TEXT NOT NULL,
+                action TEXT NOT NULL, -- 'send_email'
+                checkpoint_id TEXT, -- Checkpoint the run paused at, the one an approval resumes
+                payload JSONB, -- Question, SQL, email draft
+                status TEXT NOT NULL DEFAULT 'pending', -- pending / approving / sent / failed / rejected / expired / superseded
+                idempotency_key TEXT, -- Key of the request that decided it
+                error TEXT,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP WITH TIME ZONE,
+                decided_at TIMESTAMP WITH TIME ZONE,
+                completed_at TIMESTAMP WITH TIME ZONE,
+                UNIQUE (thread_id, checkpoint_id)
+            );
+        """)
+
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_app_pending_actions_status_created ON app_pending_actions(status, created_at, action_id);
+        """)
+
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_app_pending_actions_thread ON app_pending_actions(thread_id, created_at DESC);
+        """)
+
         conn.commit()
         print("Tables created successfully.")
 
@@ -44,7 +95,18 @@ def init_history_db():
         conn.rollback()
     finally:
         cursor.close()
-        conn.close()
+        release_db_connection(conn)
+
+def init_rollups():
+    """
+    Creates the materialized views with the pre-aggregated Olist metrics (see src/rollups.py)
+    """
+    try:
+        create_rollups()
+        print("Rollups created successfully.")
+    except Exception as e:
+        print(f"Error creating rollups : {e}")
 
 if __name__ == "__main__":
-    init_history_db()
\ No newline at end of file
+    init_history_db()
+    init_rollups()
\ No newline at end of file
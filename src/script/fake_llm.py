@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import json
+import random
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# Canned SQL for the benchmark questions, picked by keyword. Portable across SQLite and PostgreSQL.
+CANNED_SQL = [
+    ("month", """
+        SELECT substr(o.order_purchase_timestamp, 1, 7) AS month, SUM(p.payment_value) AS revenue
+        FROM orders o JOIN order_payments p ON p.order_id = o.order_id
+        GROUP BY month ORDER BY month
+    """),
+    ("categor", """
+        SELECT pr.product_category_name AS category, SUM(oi.price) AS revenue
+        FROM order_items oi JOIN products pr ON pr.product_id = oi.product_id
+        GROUP BY pr.product_category_name ORDER BY revenue DESC LIMIT 10
+    """),
+    ("how many", """
+        SELECT COUNT(*) AS delivered_orders FROM orders WHERE order_status = 'delivered'
+    """),
+    ("city", """
+        SELECT c.customer_city, c.customer_state, SUM(p.payment_value) AS total_spend
+        FROM customers c JOIN orders o ON o.customer_id = c.customer_id
+        JOIN order_payments p ON p.order_id = o.order_id
+        GROUP BY c.customer_city, c.customer_state ORDER BY total_spend DESC
+    """),
+    ("customer", """
+        SELECT c.customer_unique_id, SUM(p.payment_value) AS total_spend
+        FROM customers c JOIN orders o ON o.customer_id = c.customer_id
+        JOIN order_payments p ON p.order_id = o.order_id
+        GROUP BY c.customer_unique_id ORDER BY total_spend DESC LIMIT 5
+    """),
+]
+
+FALLBACK_SQL = "SELECT order_status, COUNT(*) AS orders FROM orders GROUP BY order_status"
+
+EMAIL_DRAFT = """Subject: Thank you for being one of our best customers
+
+Hi [Customer Name],
+
+Thank you for your continued trust in our store. As a token of appreciation, here is 10% off your next order.
+
+Best regards,
+The Olist Team"""
+
+
+def _prompt_text(messages: List[BaseMessage]) -> str:
+    return "\n".join(f"{message.type}: {message.content}" for message in messages)
+
+
+def _usage(prompt: str, completion: str) -> dict:
+    # ~4 characters per token, close enough for relative comparisons
+    input_tokens, output_tokens = len(prompt) // 4, len(completion) // 4
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+
+class FakeAnalystModel(BaseChatModel):
+    """
+    Deterministic stand-in for the analyst LLM. Recognizes the SQL / repair / chart / email prompts
+    and answers them from canned responses, after a simulated (seeded, jittered) latency.
+    """
+
+    latency: float = 0.0  # Mean simulated latency per call (seconds)
+    jitter: float = 0.2  # +/- fraction of latency
+    seed: int = 7
+
+    _rng: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-analyst"
+
+    def _delay(self) -> float:
+        if self._rng is None:
+            self._rng = random.Random(self.seed)
+        if not self.latency:
+            return 0.0
+        return max(0.0, self.latency * (1 + self._rng.uniform(-self.jitter, self.jitter)))
+
+    def respond(self, messages: List[BaseMessage]) -> str:
+        prompt = _prompt_text(messages)
+        question = messages[-1].content.lower() if messages[-1].type == "human" else ""
+
+        if "previous query you generated failed" in prompt:
+            return FALLBACK_SQL
+        if "Data Visualization Expert" in prompt:
+            return json.dumps({})
+        if "CRM Marketing Expert" in prompt:
+            return EMAIL_DRAFT
+        if "running summary" in prompt:
+            return "The user explored customer spend and revenue in the Olist data."
+
+        for keyword, sql in CANNED_SQL:
+            if keyword in question:
+                return " ".join(sql.split())
+        return FALLBACK_SQL
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        content = self.respond(messages)
+        message = AIMessage(content=content, usage_metadata=_usage(_prompt_text(messages), content))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self._delay())
+        return self._result(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self._delay())
+        return self._result(messages)
+
+
+def prompt_key(messages: List[BaseMessage]) -> str:
+    return hashlib.sha256(_prompt_text(messages).encode("utf-8")).hexdigest()
+
+
+class ReplayChatModel(FakeAnalystModel):
+    """
+    Replays responses recorded from a real model (see RecordingChatModel), keyed by a hash of the
+    full prompt, with the recorded latency. Unknown prompts fall back to the canned responses.
+    """
+
+    recording: dict = {}  # prompt key -> {"response", "latency"}
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs):
+        recording = {}
+        with open(path) as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    recording[entry["key"]] = entry
+        return cls(recording=recording, **kwargs)
+
+    def _lookup(self, messages):
+        return self.recording.get(prompt_key(messages))
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        entry = self._lookup(messages)
+        if entry is None:
+            return super()._result(messages)
+        message = AIMessage(content=entry["response"], usage_metadata=_usage(_prompt_text(messages), entry["response"]))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        entry = self._lookup(messages)
+        time.sleep(entry["latency"] if entry else self._delay())
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        entry = self._lookup(messages)
+        await asyncio.sleep(entry["latency"] if entry else self._delay())
+        return self._result(messages)
+
+
+class RecordingChatModel(BaseChatModel):
+    """
+    Wraps a real chat model and appends every (prompt key, response, latency) to a JSONL file
+    that ReplayChatModel can play back offline.
+    """
+
+    model: BaseChatModel
+    path: str
+
+    @property
+    def _llm_type(self) -> str:
+        return "recording"
+
+    def _record(self, messages, result: ChatResult, latency: float):
+        with open(self.path, "a") as file:
+            entry = {"key": prompt_key(messages), "response": result.generations[0].message.content, "latency": round(latency, 4)}
+            file.write(json.dumps(entry) + "\n")
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        started = time.perf_counter()
+        result = self.model._generate(messages, stop=stop, **kwargs)
+        self._record(messages, result, time.perf_counter() - started)
+        return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        started = time.perf_counter()
+        result = await self.model._agenerate(messages, stop=stop, **kwargs)
+        self._record(messages, result, time.perf_counter() - started)
+        return result
@@ -0,0 +1,95 @@
+"""
+Import-time profile of the service's modules.
+
+Imports each module in a fresh interpreter with `python -X importtime` and reports its total
+import time, the slowest packages it pulls in and the slowest modules by self time.
+
+    python -m src.script.import_profile                       # main (what a worker imports) and the LLM stack
+    python -m src.script.import_profile main src.graph --top 15 --json imports.json
+
+`main` should stay fast: the LLM stack (src.graph and what it imports) is loaded by the
+warm-up task in the FastAPI lifespan, see /ready for the startup phases of a running worker.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+DEFAULT_MODULES = ["main", "src.graph"]
+
+# import time:       self [us] |    cumulative | imported package
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def profile_module(module):
+    """
+    Returns the importtime entries of `module` as (depth, name, self_ms, cumulative_ms), in import order.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env={**os.environ, "PYTHONPATH": os.getcwd()},
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr[-2000:]}")
+
+    entries = []
+    for line in completed.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append(((len(indent) - 1) // 2, name, int(self_us) / 1000, int(cumulative_us) / 1000))
+    return entries
+
+
+def summarize(module, entries, top):
+    total = next((cumulative for depth, name, _, cumulative in entries if depth == 0 and name == module), 0.0)
+
+    # Time per top-level package (openai, langchain_core, ...), by self time so nothing is counted twice
+    packages = defaultdict(float)
+    for _, name, self_ms, _ in entries:
+        packages[name.split(".")[0]] += self_ms
+
+    slowest = sorted(entries, key=lambda entry: entry[2], reverse=True)[:top]
+    return {
+        "module": module,
+        "total_ms": round(total, 1),
+        "modules_imported": len(entries),
+        "packages": [{"package": name, "ms": round(ms, 1)} for name, ms in sorted(packages.items(), key=lambda item: -item[1])[:top]],
+        "slowest_modules": [{"module": name, "self_ms": round(self_ms, 1)} for _, name, self_ms, _ in slowest],
+    }
+
+
+def report(results):
+    for result in results:
+        print(f"\n📦 import {result['module']}: {result['total_ms']} ms, {result['modules_imported']} modules\n")
+        print(f"{'package':40} {'ms':>9}    {'module (self time)':50} {'ms':>9}")
+        for package, module in zip(result["packages"], result["slowest_modules"]):
+            print(f"{package['package']:40} {package['ms']:>9}    {module['module']:50} {module['self_ms']:>9}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time profile of the analyst service")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES, help="Modules to import (default: main src.graph)")
+    parser.add_argument("--top", type=int, default=10, help="Packages / modules listed per module")
+    parser.add_argument("--json", help="Also write the results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = [summarize(module, profile_module(module), args.top) for module in args.modules]
+    report(results)
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"\nResults written to {args.json}")
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import random
+
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, Float, Text
+
+# Olist-shaped tables (the columns the analyst prompts and benchmark queries rely on).
+# Timestamps are stored as ISO text so the same fixture works on SQLite and PostgreSQL.
+metadata = MetaData()
+
+customers = Table(
+    "customers", metadata,
+    Column("customer_id", Text, primary_key=True),
+    Column("customer_unique_id", Text),
+    Column("customer_zip_code_prefix", Text),
+    Column("customer_city", Text),
+    Column("customer_state", Text),
+)
+
+products = Table(
+    "products", metadata,
+    Column("product_id", Text, primary_key=True),
+    Column("product_category_name", Text),
+    Column("product_weight_g", Float),
+)
+
+orders = Table(
+    "orders", metadata,
+    Column("order_id", Text, primary_key=True),
+    Column("customer_id", Text),
+    Column("order_status", Text),
+    Column("order_purchase_timestamp", Text),
+    Column("order_delivered_customer_date", Text),
+)
+
+order_items = Table(
+    "order_items", metadata,
+    Column("order_id", Text),
+    Column("order_item_id", Integer),
+    Column("product_id", Text),
+    Column("seller_id", Text),
+    Column("price", Float),
+    Column("freight_value", Float),
+)
+
+order_payments = Table(
+    "order_payments", metadata,
+    Column("order_id", Text),
+    Column("payment_sequential", Integer),
+    Column("payment_type", Text),
+    Column("payment_installments", Integer),
+    Column("payment_value", Float),
+)
+
+CITIES = [("sao paulo", "SP"), ("rio de janeiro", "RJ"), ("belo horizonte", "MG"), ("curitiba", "PR"), ("porto alegre", "RS")]
+CATEGORIES = ["beleza_saude", "informatica_acessorios", "moveis_decoracao", "esporte_lazer", "utilidades_domesticas", "brinquedos"]
+PAYMENT_TYPES = ["credit_card", "boleto", "voucher", "debit_card"]
+STATUSES = ["delivered"] * 8 + ["shipped", "canceled"]
+
+
+def load_fixture(db_uri: str, customers_count: int = 500, orders_count: int = 2000, seed: int = 42):
+    """
+    (Re)creates the five Olist tables at db_uri and fills them with deterministic synthetic data.
+    """
+    rng = random.Random(seed)
+    engine = create_engine(db_uri)
+
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+
+    customer_rows = []
+    for idx in range(customers_count):
+        city, state = rng.choice(CITIES)
+        customer_rows.append({
+            "customer_id": f"cust_{idx:06d}",
+            "customer_unique_id": f"uniq_{idx:06d}",
+            "customer_zip_code_prefix": f"{rng.randint(10000, 99999)}",
+            "customer_city": city,
+            "customer_state": state,
+        })
+
+    product_rows = [
+        {"product_id": f"prod_{idx:05d}", "product_category_name": rng.choice(CATEGORIES), "product_weight_g": rng.randint(100, 5000)}
+        for idx in range(max(50, customers_count // 5))
+    ]
+
+    order_rows, item_rows, payment_rows = [], [], []
+    for idx in range(orders_count):
+        order_id = f"order_{idx:07d}"
+        month, day = rng.randint(1, 12), rng.randint(1, 28)
+        year = rng.choice([2017, 2018]) if month <= 8 else 2017
+        purchased = f"{year}-{month:02d}-{day:02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00"
+
+        order_rows.append({
+            "order_id": order_id,
+            "customer_id": rng.choice(customer_rows)["customer_id"],
+            "order_status": rng.choice(STATUSES),
+            "order_purchase_timestamp": purchased,
+            "order_delivered_customer_date": purchased,
+        })
+
+        total = 0.0
+        for item_idx in range(1, rng.randint(1, 3) + 1):
+            price = round(rng.uniform(10, 500), 2)
+            freight = round(rng.uniform(5, 60), 2)
+            total += price + freight
+            item_rows.append({
+                "order_id": order_id,
+                "order_item_id": item_idx,
+                "product_id": rng.choice(product_rows)["product_id"],
+                "seller_id": f"seller_{rng.randint(1, 50):03d}",
+                "price": price,
+                "freight_value": freight,
+            })
+
+        payment_rows.append({
+            "order_id": order_id,
+            "payment_sequential": 1,
+            "payment_type": rng.choice(PAYMENT_TYPES),
+            "payment_installments": rng.randint(1, 10),
+            "payment_value": round(total, 2),
+        })
+
+    with engine.begin() as conn:
+        conn.execute(customers.insert(), customer_rows)
+        conn.execute(products.insert(), product_rows)
+        conn.execute(orders.insert(), order_rows)
+        conn.execute(order_items.insert(), item_rows)
+        conn.execute(order_payments.insert(), payment_rows)
+
+    engine.dispose()
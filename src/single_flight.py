@@ -0,0 +1,44 @@
+import asyncio
+
+# Result of a call whose leader was cancelled: the callers that joined it make the call themselves
+_LEADER_CANCELLED = object()
+
+
+async def single_flight(inflight: dict, key, call, keep_result: bool = False, on_join=None):
+    """
+    Awaits call(), or the call already in flight under the same key in `inflight` (key -> Future).
+    Callers that join a call get its result, or its error.
+
+    - keep_result: the finished call stays in `inflight`, so later callers reuse its result too
+      (the owner of the dict decides how long it lives); otherwise the key is free once the call ends
+    - on_join: called every time a caller joins a call instead of making it, e.g. to count it
+    """
+    while key in inflight:
+        if on_join is not None:
+            on_join()
+        result = await asyncio.shield(inflight[key])
+        if result is not _LEADER_CANCELLED:
+            return result
+        # The leader's own request went away (client disconnect, batch cancelled): the first caller
+        # to wake up makes the call, the others join it
+
+    future = asyncio.get_running_loop().create_future()
+    inflight[key] = future
+    try:
+        result = await call()
+    except asyncio.CancelledError:
+        # Not future.cancel(): that would cancel the unrelated callers awaiting this call
+        inflight.pop(key, None)
+        future.set_result(_LEADER_CANCELLED)
+        raise
+    except Exception as ex:
+        # Waiting callers get the error, later ones make the call again
+        inflight.pop(key, None)
+        future.set_exception(ex)
+        future.exception()  # Nobody may be waiting, don't log it as never retrieved
+        raise
+
+    if not keep_result:
+        inflight.pop(key, None)
+    future.set_result(result)
+    return result
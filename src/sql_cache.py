@@ -0,0 +1,276 @@
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from src.db_config import get_db_connection, release_db_connection
+
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "true").lower() == "true"
+# Max number of cached questions (per schema) kept in memory and in app_sql_cache
+SQL_CACHE_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "1000"))
+# Cosine similarity (0-1) above which a differently-worded question reuses cached SQL.
+# 0 disables the similarity lookup, only exact / normalized matches are served.
+SQL_CACHE_SIMILARITY = float(os.getenv("SQL_CACHE_SIMILARITY", "0"))
+
+# Words that make a question depend on earlier turns ("show *them* by city")
+FOLLOW_UP_MARKERS = {
+    "it", "its", "them", "they", "those", "these", "him", "her",
+    "previous", "above", "same", "again", "instead", "filter", "drill",
+}
+
+# Filler that does not change the meaning of a question
+FILLER_WORDS = {"please", "can", "could", "you", "me", "show", "give", "tell", "list", "the", "a", "an"}
+
+# How a question is asked rather than what it asks for. A similar question is only served cached SQL
+# if all its other words are the same: "top customers in sp" and "top customers in rj" never match
+QUESTION_WORDS = {
+    "what", "which", "who", "how", "is", "are", "was", "were", "do", "does", "did",
+    "i", "we", "our", "my", "find", "get", "display", "see", "want", "need", "would", "like", "know", "there",
+}
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # (schema_hash, question_key) -> {"question", "sql", "vector"}
+_loaded_schemas = set()
+_stats = {
+    "hits_exact": 0,
+    "hits_normalized": 0,
+    "hits_similar": 0,
+    "misses": 0,
+    "bypassed": 0,
+    "stores": 0,
+    "evictions": 0,
+    "errors": 0,
+}
+
+
+def schema_fingerprint(schema: str) -> str:
+    """
+    Hashes the schema DDL. Sample-row comments are stripped so that
+    re-reflection with different sample rows keeps the same fingerprint.
+    """
+    ddl = re.sub(r"/\*.*?\*/", "", schema, flags=re.DOTALL)
+    ddl = re.sub(r"\s+", " ", ddl).strip()
+    return hashlib.sha256(ddl.encode("utf-8")).hexdigest()
+
+
+def normalize_question(question: str) -> str:
+    """
+    Lowercases, strips punctuation and filler words: "Show me the TOP 5 customers!" -> "top 5 customers".
+    """
+    tokens = re.findall(r"[a-z0-9_]+", question.lower())
+    return " ".join(token for token in tokens if token not in FILLER_WORDS)
+
+
+def has_history_dependency(question: str, history: list) -> bool:
+    """
+    True if the answer may depend on earlier turns (prior messages or follow-up wording).
+    Such questions are never served from the cache.
+    """
+    if history:
+        return True
+    return any(token in FOLLOW_UP_MARKERS for token in re.findall(r"[a-z]+", question.lower()))
+
+
+def _vectorize(question_key: str) -> Counter:
+    tokens = question_key.split()
+    bigrams = [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    return Counter(tokens + bigrams)
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    dot = sum(count * b[term] for term, count in a.items())
+    norm = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values()))
+    return dot / norm if norm else 0.0
+
+
+def _numbers(question_key: str) -> list:
+    # "top 5" and "top 10" must never share SQL, whatever the similarity says
+    return re.findall(r"\d+", question_key)
+
+
+def _content_words(question_key: str) -> frozenset:
+    # Entities ("sp" / "rj", "boleto" / "voucher") must never differ either
+    return frozenset(question_key.split()) - QUESTION_WORDS
+
+
+def _remember(key, question, sql):
+    _entries[key] = {"question": question, "sql": sql, "vector": _vectorize(key[1]), "content": _content_words(key[1])}
+    _entries.move_to_end(key)
+
+    while len(_entries) > SQL_CACHE_MAX_ENTRIES:
+        _entries.popitem(last=False)
+        _stats["evictions"] += 1
+
+
+def _load_schema_entries(schema_hash: str):
+    """
+    Warms the in-memory LRU from app_sql_cache the first time a schema is seen.
+    """
+    if schema_hash in _loaded_schemas:
+        return
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT question_key, question, sql_query FROM app_sql_cache "
+            "WHERE schema_hash = %s ORDER BY last_used_at ASC LIMIT %s",
+            (schema_hash, SQL_CACHE_MAX_ENTRIES)
+        )
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+    with _lock:
+        for question_key, question, sql in rows:
+            _remember((schema_hash, question_key), question, sql)
+        _loaded_schemas.add(schema_hash)
+
+
+def _touch(schema_hash: str, question_key: str):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "UPDATE app_sql_cache SET hits = hits + 1, last_used_at = CURRENT_TIMESTAMP "
+            "WHERE schema_hash = %s AND question_key = %s",
+            (schema_hash, question_key)
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+
+def lookup(question: str, schema: str, history: list = None):
+    """
+    Returns cached SQL for the question under the given schema, or None.
+    Tries the normalized key first, then (if enabled) the closest similar question that asks for
+    the same things (same numbers and words, see QUESTION_WORDS) in different wording.
+    Questions that depend on chat history always miss.
+    """
+    if not SQL_CACHE_ENABLED:
+        return None
+
+    if has_history_dependency(question, history):
+        with _lock:
+            _stats["bypassed"] += 1
+        return None
+
+    schema_hash = schema_fingerprint(schema)
+    question_key = normalize_question(question)
+
+    try:
+        _load_schema_entries(schema_hash)
+    except Exception as ex:
+        print(f"⚠️ SQL cache unavailable: {ex}")
+        with _lock:
+            _stats["errors"] += 1
+
+    with _lock:
+        match_key, kind = None, None
+
+        entry = _entries.get((schema_hash, question_key))
+        if entry:
+            match_key = (schema_hash, question_key)
+            kind = "hits_exact" if entry["question"].strip() == question.strip() else "hits_normalized"
+
+        elif SQL_CACHE_SIMILARITY > 0:
+            vector, numbers, best = _vectorize(question_key), _numbers(question_key), SQL_CACHE_SIMILARITY
+            content = _content_words(question_key)
+            for key, candidate in _entries.items():
+                if key[0] != schema_hash or _numbers(key[1]) != numbers or candidate["content"] != content:
+                    continue
+                score = _cosine(vector, candidate["vector"])
+                if score >= best:
+                    match_key, kind, best = key, "hits_similar", score
+
+        if match_key is None:
+            _stats["misses"] += 1
+            return None
+
+        _entries.move_to_end(match_key)
+        _stats[kind] += 1
+        sql = _entries[match_key]["sql"]
+
+    try:
+        _touch(*match_key)
+    except Exception as ex:
+        print(f"⚠️ SQL cache touch failed: {ex}")
+
+    return sql
+
+
+def store(question: str, schema: str, sql: str):
+    """
+    Caches SQL that executed successfully for the question, evicting least-recently-used entries.
+    """
+    if not SQL_CACHE_ENABLED:
+        return
+
+    schema_hash = schema_fingerprint(schema)
+    question_key = normalize_question(question)
+
+    with _lock:
+        _remember((schema_hash, question_key), question, sql)
+        _stats["stores"] += 1
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "INSERT INTO app_sql_cache (schema_hash, question_key, question, sql_query) VALUES (%s, %s, %s, %s) "
+            "ON CONFLICT (schema_hash, question_key) DO UPDATE "
+            "SET question = EXCLUDED.question, sql_query = EXCLUDED.sql_query, last_used_at = CURRENT_TIMESTAMP",
+            (schema_hash, question_key, question, sql)
+        )
+        # Keep the table bounded the same way as the in-memory LRU
+        cursor.execute(
+            "DELETE FROM app_sql_cache WHERE schema_hash = %s AND question_key IN ("
+            "SELECT question_key FROM app_sql_cache WHERE schema_hash = %s "
+            "ORDER BY last_used_at DESC OFFSET %s)",
+            (schema_hash, schema_hash, SQL_CACHE_MAX_ENTRIES)
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+
+def invalidate(question: str, schema: str):
+    """
+    Drops the cached SQL for a question (e.g. when the cached query failed to execute).
+    """
+    schema_hash = schema_fingerprint(schema)
+    question_key = normalize_question(question)
+
+    with _lock:
+        _entries.pop((schema_hash, question_key), None)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "DELETE FROM app_sql_cache WHERE schema_hash = %s AND question_key = %s",
+            (schema_hash, question_key)
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+        release_db_connection(conn)
+
+
+def get_cache_stats():
+    """
+    Returns hit/miss counters of the NL-to-SQL cache.
+    """
+    with _lock:
+        stats = dict(_stats)
+        stats["entries"] = len(_entries)
+
+    hits = stats["hits_exact"] + stats["hits_normalized"] + stats["hits_similar"]
+    stats["hit_rate"] = hits / (hits + stats["misses"]) if hits + stats["misses"] else 0.0
+    return stats
@@ -0,0 +1,255 @@
+import os
+import re
+
+# Check generated SQL against the schema (and EXPLAIN it) before running it
+SQL_VALIDATION = os.getenv("SQL_VALIDATION", "true").lower() == "true"
+# In-place repair attempts for a query that fails validation, before falling back to a full graph retry
+SQL_VALIDATION_REPAIRS = int(os.getenv("SQL_VALIDATION_REPAIRS", "1"))
+
+# Trailing top-level "LIMIT n|ALL [OFFSET m]". A LIMIT inside a subquery is followed by ")" and never matches.
+_TRAILING_LIMIT = re.compile(r"\blimit\s+(\d+|all)(\s+offset\s+\d+(\s+rows?)?)?\s*$", re.IGNORECASE)
+_TRAILING_FETCH = re.compile(r"\bfetch\s+(first|next)\s+\d*\s*rows?\s+only\s*$", re.IGNORECASE)
+_READ_QUERY = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+# Clauses that come after LIMIT: a trailing "OFFSET m" without one, "FOR UPDATE / SHARE [OF t] [NOWAIT]"
+_TRAILING_OFFSET = re.compile(r"\s+offset\s+\d+(\s+rows?)?\s*$", re.IGNORECASE)
+_TRAILING_LOCK = re.compile(r"(\s+for\s+(update|share|no\s+key\s+update|key\s+share)\b[\w\s.,]*)+$", re.IGNORECASE)
+
+# Tokens of a SQL statement: comments and string literals are recognized (and skipped) so that
+# words inside them are never taken for identifiers
+_TOKEN = re.compile(
+    r"(?P<comment>--[^\n]*|/\*.*?\*/)"
+    r"|(?P<string>'(?:[^']|'')*')"
+    r"|(?P<quoted>\"(?:[^\"]|\"\")+\")"
+    r"|(?P<word>[A-Za-z_][A-Za-z0-9_$]*)"
+    r"|(?P<number>\d+(?:\.\d*)?)"
+    r"|(?P<symbol>::|[^\sA-Za-z0-9_])",
+    re.DOTALL,
+)
+
+
+def strip_statement(sql: str) -> str:
+    """
+    Removes surrounding whitespace and comments and trailing semicolons ("... LIMIT 10; -- top ten"),
+    so that the statement can be recognized, clauses appended to it and it can be wrapped in a subquery.
+    """
+    start, end = None, 0
+    for match in _TOKEN.finditer(sql):
+        if match.lastgroup != "comment" and match.group() != ";":
+            start = match.start() if start is None else start
+            end = match.end()
+    return sql[start or 0:end]
+
+
+def enforce_limit(sql: str, max_rows: int) -> str:
+    """
+    Makes sure a SELECT never asks the server for more than max_rows + 1 rows.
+    The extra row lets the caller tell "exactly max_rows" from "truncated".
+
+    - no LIMIT          -> "LIMIT max_rows + 1" is added, before any OFFSET / FOR UPDATE clause
+    - LIMIT n > max_rows -> n is capped to max_rows + 1
+    - LIMIT n <= max_rows is left untouched
+    Non-SELECT statements and FETCH FIRST clauses are returned unchanged.
+    """
+    sql = strip_statement(sql)
+    cap = max_rows + 1
+
+    lock = _TRAILING_LOCK.search(sql)
+    head, tail = (sql[:lock.start()], sql[lock.start():]) if lock else (sql, "")
+
+    if not _READ_QUERY.match(sql) or _TRAILING_FETCH.search(head):
+        return sql
+
+    match = _TRAILING_LIMIT.search(head)
+    if not match:
+        offset = _TRAILING_OFFSET.search(head)
+        split = offset.start() if offset else len(head)
+        return f"{head[:split]}\nLIMIT {cap}{head[split:]}{tail}"
+
+    limit = match.group(1)
+    if limit.lower() != "all" and int(limit) <= max_rows:
+        return sql
+
+    return f"{head[:match.start(1)]}{cap}{head[match.end(1):]}{tail}"
+
+
+# "FROM" also appears inside these functions: EXTRACT(YEAR FROM ...), SUBSTRING(x FROM 1), ...
+_FROM_FUNCTIONS = {"extract", "substring", "trim", "overlay", "position"}
+
+# Words that can follow a table reference but are not its alias
+_CLAUSE_WORDS = {
+    "where", "group", "order", "having", "limit", "offset", "fetch", "union", "intersect", "except",
+    "join", "inner", "left", "right", "full", "outer", "cross", "natural", "lateral", "on", "using",
+    "window", "for", "as", "and", "or", "not", "select", "from", "returning", "tablesample",
+}
+
+
+class SqlValidationError(ValueError):
+    """
+    A generated query that is known to fail, with the line of the query that causes it.
+    """
+
+    def __init__(self, message: str, fragment: str = None):
+        super().__init__(message)
+        self.fragment = fragment
+
+
+def _tokenize(sql: str):
+    tokens = []
+    for match in _TOKEN.finditer(sql):
+        kind = match.lastgroup
+        if kind == "comment":
+            continue
+        value = match.group()
+        if kind == "quoted":
+            value, kind = value[1:-1].replace('""', '"'), "word"
+        elif kind == "word":
+            value = value.lower()
+        tokens.append((kind, value, match.start()))
+    return tokens
+
+
+def _line_at(sql: str, position: int) -> str:
+    start = sql.rfind("\n", 0, position) + 1
+    end = sql.find("\n", position)
+    return sql[start:end if end != -1 else len(sql)].strip()
+
+
+def _is_operator_from(previous, functions) -> bool:
+    """
+    FROM that does not start a table reference: EXTRACT(YEAR FROM ...), ... IS [NOT] DISTINCT FROM ...
+    """
+    return bool(functions and functions[-1] in _FROM_FUNCTIONS) or previous == ("word", "distinct")
+
+
+def _defined_names(tokens) -> set:
+    """
+    Names the query defines itself: CTEs ("name AS (", "name (col, ...) AS (") and derived tables (") AS name").
+    """
+    defined = set()
+    for idx, (kind, value, _) in enumerate(tokens[:-1]):
+        if kind != "word":
+            continue
+        following = tokens[idx + 1]
+        if following[1] == "as":
+            defined.add(value)
+        elif following[1] == "(":
+            # A column list: only names and commas up to ")", then AS [NOT] MATERIALIZED (
+            end = idx + 2
+            while end < len(tokens) and (tokens[end][0] == "word" or tokens[end][1] == ","):
+                end += 1
+            rest = [token[1] for token in tokens[end:end + 5]]
+            for body in ([")", "as", "("], [")", "as", "materialized", "("], [")", "as", "not", "materialized", "("]):
+                if rest[:len(body)] == body:
+                    defined.add(value)
+    return defined
+
+
+def check_references(sql: str, schema: dict):
+    """
+    Checks a query against the known schema ({table: set of column names}) without running it:
+    a single read-only statement, known tables (or CTEs) after FROM / JOIN, and known columns
+    for qualified references (alias.column). Unqualified columns are left to EXPLAIN.
+    Raises SqlValidationError on the first problem.
+    """
+    sql = strip_statement(sql)
+    tokens = _tokenize(sql)
+    words = [value for kind, value, _ in tokens if kind == "word"]
+
+    if not words or words[0] not in ("select", "with"):
+        raise SqlValidationError("Only SELECT queries are allowed", _line_at(sql, 0))
+
+    symbols = [value for kind, value, _ in tokens if kind == "symbol"]
+    if ";" in symbols:
+        raise SqlValidationError("Only a single SQL statement is allowed")
+    if symbols.count("(") != symbols.count(")"):
+        raise SqlValidationError("Unbalanced parentheses")
+
+    defined = _defined_names(tokens)
+    tables = {name.lower(): {column.lower() for column in columns} for name, columns in schema.items()}
+
+    aliases = {}  # alias / table name -> set of tables it may stand for
+    functions = []  # stack of the function (or None) each open parenthesis belongs to
+    references = set()  # positions of the FROM / JOIN keywords that start a table reference
+    previous = None
+
+    for idx, (kind, value, position) in enumerate(tokens):
+        if kind == "symbol" and value == "(":
+            functions.append(previous[1] if previous and previous[0] == "word" else None)
+        elif kind == "symbol" and value == ")":
+            if functions:
+                functions.pop()
+
+        elif kind == "word" and value in ("from", "join") and not (value == "from" and _is_operator_from(previous, functions)):
+            references.add(idx)
+            reference = tokens[idx + 1:idx + 4]
+            if not reference or reference[0][0] != "word":
+                previous = (kind, value)
+                continue
+
+            # schema.table -> table
+            name, rest = reference[0][1], reference[1:]
+            if len(rest) >= 2 and rest[0][1] == "." and rest[1][0] == "word":
+                name, rest = rest[1][1], tokens[idx + 4:idx + 6]
+
+            # LATERAL (...) and table functions: json_each(...), unnest(...), generate_series(...)
+            if name == "lateral" or (rest and rest[0][1] == "("):
+                previous = (kind, value)
+                continue
+
+            if name not in tables and name not in defined:
+                raise SqlValidationError(f'Unknown table "{name}"', _line_at(sql, reference[0][2]))
+
+            alias = name
+            if rest and rest[0][1] == "as":
+                rest = rest[1:]
+            if rest and rest[0][0] == "word" and rest[0][1] not in _CLAUSE_WORDS:
+                alias = rest[0][1]
+
+            if name in tables:
+                aliases.setdefault(alias, set()).add(name)
+                aliases.setdefault(name, set()).add(name)
+
+        previous = (kind, value)
+
+    for idx in range(len(tokens) - 2):
+        (kind, qualifier, _), (_, dot, _), (column_kind, column, position) = tokens[idx:idx + 3]
+        if kind != "word" or dot != "." or column_kind != "word" or qualifier not in aliases:
+            continue
+        if idx - 1 in references or (idx > 0 and tokens[idx - 1][1] == "."):
+            continue  # schema-qualified table name, not a column
+        if not any(column in tables[table] for table in aliases[qualifier]):
+            table = "/".join(sorted(aliases[qualifier]))
+            raise SqlValidationError(f'Column "{column}" does not exist in table "{table}"', _line_at(sql, position))
+
+
+# Where database errors point at the problem: PostgreSQL "LINE n:", or the name it complains about
+_ERROR_LINE = re.compile(r"^LINE (\d+):", re.MULTILINE)
+_ERROR_NAME = re.compile(r'(?:column|relation|table|function|no such column:|no such table:)\s+"?([\w.]+)"?', re.IGNORECASE)
+
+
+def describe_error(error) -> str:
+    """
+    The database's own message, without SQLAlchemy's echo of the statement and its help link.
+    """
+    orig = getattr(error, "orig", None)
+    message = str(orig if orig is not None else error)
+    return re.split(r"\n\[SQL:|\n\(Background on this error", message)[0].strip()
+
+
+def error_fragment(sql: str, error: str):
+    """
+    The line of the query a database error refers to, or None if it can't be told.
+    """
+    match = _ERROR_LINE.search(error)
+    lines = strip_statement(sql).splitlines()
+    if match and 0 < int(match.group(1)) <= len(lines):
+        return lines[int(match.group(1)) - 1].strip()
+
+    match = _ERROR_NAME.search(error)
+    if match:
+        name = match.group(1).split(".")[-1].lower()
+        for line in lines:
+            if re.search(rf"\b{re.escape(name)}\b", line, re.IGNORECASE):
+                return line.strip()
+
+    return None
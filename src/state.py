@@ -1,5 +1,8 @@
-from typing import TypedDict, List, Optional, Any, Dict
+from typing import Annotated, TypedDict, List, Optional, Dict
 from langchain_core.messages import BaseMessage
+from langgraph.graph.message import add_messages
+
+from src.query_result import QueryResult
 
 class AgentState(TypedDict):
     """
@@ -7,12 +10,18 @@ class AgentState(TypedDict):
     Each agent (node) can read from and write to this state.
     """
 
-    # The conversation history (User inputs + AI responses)
-    messages: List[BaseMessage]
+    # The conversation history (User inputs + AI responses). Appended to across turns;
+    # turns older than the context window are removed once folded into history_summary.
+    messages: Annotated[List[BaseMessage], add_messages]
+    history_summary: Optional[str]  # Rolling summary of the turns no longer kept verbatim
+
+    # Follow-up nodes this turn needs ({"chart": bool, "email": bool}), None runs them all
+    intent: Optional[Dict[str, bool]]
 
     # 1. SQL Agent Outputs
     sql_query: Optional[str]  # The generated SQL
-    query_result: Optional[Any]  # The raw data returned from the DB (List of dicts or string)
+    query_result: Optional[QueryResult]  # Columnar rows returned from the DB (column names, types, values)
+    cache_hit: bool  # True if query_result was served from the result cache
 
     error: Optional[str]  # Stores the DB error message if any
     retry_count: int  # Tracks how many times we've tried to fix it
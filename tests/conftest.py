@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+# The modules under test read their settings from the environment when they are imported:
+# point them at nothing real before any of them is
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("CHECKPOINT_BACKEND", "memory")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def olist_db(tmp_path_factory):
+    """
+    URL of a SQLite database with the synthetic Olist tables of the benchmark fixture.
+    """
+    from src.script.olist_fixture import load_fixture
+
+    db_uri = f"sqlite:///{tmp_path_factory.mktemp('olist') / 'olist.db'}"
+    load_fixture(db_uri, customers_count=50, orders_count=200)
+    return db_uri
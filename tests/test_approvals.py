@@ -0,0 +1,240 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from src import approvals, db_config
+from src.approvals import claim_actions, decide_actions, finish_action, list_actions, track_pending_action
+
+# The queue's SQL is PostgreSQL-only: these tests need a scratch database (its app_pending_actions is emptied)
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+@pytest.mark.parametrize("status, is_expired, is_stale, key, approved, idempotency_key, expected", [
+    ("pending", False, False, None, True, "k1", ("claimed", "approving")),
+    ("pending", False, False, None, False, None, ("claimed", "rejected")),
+    ("failed", False, False, "k1", True, "k2", ("claimed", "approving")),  # A failed send can be approved again
+    ("pending", True, False, None, True, "k1", ("expired", "expired")),
+    ("failed", True, False, "k1", True, "k1", ("expired", "expired")),
+    ("approving", False, True, "k1", True, "k2", ("claimed", "approving")),  # The claiming worker never reported back
+    ("approving", False, False, "k1", True, "k1", ("replayed", "approving")),
+    ("sent", False, False, "k1", True, "k1", ("replayed", "sent")),
+    ("sent", False, False, "k1", True, "k2", ("conflict", "sent")),
+    ("sent", False, False, "k1", True, None, ("conflict", "sent")),
+    ("approving", False, False, "k1", False, "k2", ("conflict", "approving")),
+    ("rejected", False, False, None, True, None, ("conflict", "rejected")),
+    ("expired", False, False, None, True, "k1", ("conflict", "expired")),
+    ("superseded", False, False, None, True, "k1", ("conflict", "superseded")),
+])
+def test_transition(status, is_expired, is_stale, key, approved, idempotency_key, expected):
+    assert approvals._transition(status, is_expired, is_stale, key, approved, idempotency_key) == expected
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    if not TEST_DATABASE_URL:
+        pytest.skip("set TEST_DATABASE_URL to a scratch PostgreSQL database")
+
+    from src.script.dbscript import init_history_db
+
+    monkeypatch.setenv("DATABASE_URL", TEST_DATABASE_URL)
+    db_config.close_db_pool()
+    init_history_db()
+
+    conn = db_config.get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("TRUNCATE app_pending_actions")
+        conn.commit()
+    finally:
+        db_config.release_db_connection(conn)
+
+    yield
+    db_config.close_db_pool()
+
+
+def _execute(sql, params=()):
+    conn = db_config.get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall() if cursor.description else None
+        conn.commit()
+        return rows
+    finally:
+        db_config.release_db_connection(conn)
+
+
+def _status(action_id):
+    return _execute("SELECT status FROM app_pending_actions WHERE action_id = %s", (action_id,))[0][0]
+
+
+def _claim(action_id, approved=True, idempotency_key=None):
+    return claim_actions([action_id], approved, idempotency_key)[action_id]
+
+
+def test_tracking_is_idempotent_per_checkpoint(queue):
+    first = track_pending_action("t1", "cp1", {"question": "top customers"})
+
+    assert track_pending_action("t1", "cp1", {"question": "top customers"}) == first
+    assert [item["action_id"] for item in list_actions()["items"]] == [first]
+    assert list_actions()["items"][0]["question"] == "top customers"
+
+
+def test_a_newer_checkpoint_supersedes_the_pending_action(queue):
+    old = track_pending_action("t1", "cp1")
+    new = track_pending_action("t1", "cp2")
+
+    assert _status(old) == "superseded"
+    assert _claim(old)["outcome"] == "conflict"
+    assert [item["action_id"] for item in list_actions()["items"]] == [new]
+
+    # A run that did not pause retires the thread's pending action too
+    assert track_pending_action("t1") is None
+    assert _status(new) == "superseded"
+
+
+def test_double_approve(queue):
+    action_id = track_pending_action("t1", "cp1")
+
+    first = _claim(action_id, idempotency_key="k1")
+    assert (first["outcome"], first["status"], first["checkpoint_id"]) == ("claimed", "approving", "cp1")
+
+    # The same request retried, another request, a request without a key
+    assert _claim(action_id, idempotency_key="k1")["outcome"] == "replayed"
+    assert _claim(action_id, idempotency_key="k2")["outcome"] == "conflict"
+    assert _claim(action_id)["outcome"] == "conflict"
+    assert _status(action_id) == "approving"
+
+
+def test_reject(queue):
+    action_id = track_pending_action("t1", "cp1")
+
+    assert _claim(action_id, approved=False)["status"] == "rejected"
+    assert _claim(action_id)["outcome"] == "conflict"
+    assert _status(action_id) == "rejected"
+
+
+def test_expired_actions_cannot_be_approved(queue, monkeypatch):
+    monkeypatch.setattr(approvals, "APPROVAL_TTL", 0)
+    action_id = track_pending_action("t1", "cp1")
+
+    assert _claim(action_id)["outcome"] == "expired"
+    assert _status(action_id) == "expired"
+    assert _claim(action_id)["outcome"] == "conflict"
+
+
+def test_expire_actions(queue):
+    stale, fresh = track_pending_action("t1", "cp1"), track_pending_action("t2", "cp1")
+    _execute("UPDATE app_pending_actions SET created_at = created_at - INTERVAL '2 hours' WHERE action_id = %s", (stale,))
+
+    assert approvals.expire_actions(older_than=3600) == 1
+    assert (_status(stale), _status(fresh)) == ("expired", "pending")
+    assert approvals.expire_actions([fresh]) == 1
+
+
+def test_unknown_actions_are_not_found(queue):
+    assert claim_actions(["missing"], True)["missing"]["outcome"] == "not_found"
+
+
+def test_stale_approving_claim_can_be_claimed_again(queue):
+    action_id = track_pending_action("t1", "cp1")
+    _claim(action_id, idempotency_key="k1")
+
+    assert _claim(action_id, idempotency_key="k2")["outcome"] == "conflict"
+
+    _execute("UPDATE app_pending_actions SET decided_at = decided_at - %s * INTERVAL '1 second' WHERE action_id = %s",
+             (approvals.APPROVAL_CLAIM_TIMEOUT + 1, action_id))
+    assert _claim(action_id, idempotency_key="k2")["outcome"] == "claimed"
+
+
+def test_failed_send_can_be_approved_again(queue):
+    action_id = track_pending_action("t1", "cp1")
+    _claim(action_id, idempotency_key="k1")
+    finish_action(action_id, "failed", "SMTP unavailable")
+
+    assert _claim(action_id, idempotency_key="k2")["outcome"] == "claimed"
+
+
+class PausedThreads:
+    """
+    Stands in for the compiled graph: each thread is paused before send_email at its checkpoint.
+    """
+
+    def __init__(self, checkpoints, error=None):
+        self.checkpoints = checkpoints
+        self.error = error
+        self.resumed = []
+
+    async def aget_state(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        return SimpleNamespace(next=("send_email",), values={},
+                               config={"configurable": {"thread_id": thread_id, "checkpoint_id": self.checkpoints[thread_id]}})
+
+    async def astream(self, _, config):
+        self.resumed.append(config["configurable"]["thread_id"])
+        if self.error:
+            raise self.error
+        yield {"send_email": {}}
+
+
+@pytest.fixture
+def app(monkeypatch):
+    app = PausedThreads({"t1": "cp1", "t2": "cp1"})
+
+    async def get_app():
+        return app
+
+    monkeypatch.setattr(approvals, "get_app", get_app)
+    return app
+
+
+def _decide(action_ids, approved=True, idempotency_key=None):
+    return asyncio.run(decide_actions(action_ids, approved, idempotency_key))
+
+
+def test_approve_resumes_the_thread_once(queue, app):
+    action_id = track_pending_action("t1", "cp1")
+
+    [result] = _decide([action_id], idempotency_key="k1")
+    assert (result["status"], result["outcome"]) == ("sent", "claimed")
+
+    [replayed] = _decide([action_id], idempotency_key="k1")
+    [conflict] = _decide([action_id], idempotency_key="k2")
+    assert (replayed["status"], replayed["outcome"]) == ("sent", "replayed")
+    assert conflict["outcome"] == "conflict"
+    assert app.resumed == ["t1"]
+
+
+def test_approve_after_the_thread_moved_on(queue, app):
+    action_id = track_pending_action("t1", "cp1")
+    app.checkpoints["t1"] = "cp2"  # A newer question was asked, the run paused again elsewhere
+
+    [result] = _decide([action_id])
+
+    assert result["status"] == "superseded"
+    assert result["error"]
+    assert _status(action_id) == "superseded"
+    assert app.resumed == []
+
+
+def test_failed_resume_is_recorded(queue, app):
+    action_id = track_pending_action("t1", "cp1")
+    app.error = RuntimeError("SMTP unavailable")
+
+    [result] = _decide([action_id])
+
+    assert (result["status"], result["error"]) == ("failed", "SMTP unavailable")
+    assert _status(action_id) == "failed"
+
+
+def test_bulk_decision(queue, app):
+    first, second = track_pending_action("t1", "cp1"), track_pending_action("t2", "cp1")
+
+    results = _decide([first, second, first, "missing"], approved=False)
+
+    assert [(result["action_id"], result["status"], result["outcome"]) for result in results] == [
+        (first, "rejected", "claimed"), (second, "rejected", "claimed"), ("missing", None, "not_found"),
+    ]
+    assert app.resumed == []
@@ -0,0 +1,80 @@
+import datetime
+
+from src import charts
+from src.charts import build_chart_spec
+from src.query_result import build_query_result
+
+
+def _result(columns, rows):
+    return build_query_result(columns, rows)
+
+
+def test_no_chart_for_empty_results():
+    assert build_chart_spec(None) == (True, None)
+    assert build_chart_spec(_result(["revenue"], [])) == (True, None)
+
+
+def test_no_chart_for_a_single_row():
+    assert build_chart_spec(_result(["orders"], [(200,)])) == (True, None)
+    assert build_chart_spec(_result(["customer_state", "revenue"], [("SP", 1520.5)])) == (True, None)
+
+
+def test_date_column_makes_a_line_chart_in_time_order():
+    rows = [("2018-03-01", 30.0), ("2018-01-01", 10.0), ("2018-02-01", 20.0)]
+
+    handled, spec = build_chart_spec(_result(["month", "revenue"], rows))
+
+    assert handled
+    assert (spec["type"], spec["xKey"], spec["title"]) == ("line", "month", "Revenue by Month")
+    assert [record["month"] for record in spec["data"]] == ["2018-01-01", "2018-02-01", "2018-03-01"]
+    assert spec["series"] == [{"dataKey": "revenue", "color": charts.SERIES_COLORS[0]}]
+
+
+def test_date_values_and_year_months_make_a_line_chart():
+    dates = [(datetime.date(2018, 1, 1), 3), (datetime.date(2018, 2, 1), 5)]
+    months = [("2018-01", 3), ("2018-02", 5)]
+
+    assert build_chart_spec(_result(["day", "orders"], dates))[1]["type"] == "line"
+    assert build_chart_spec(_result(["month", "orders"], months))[1]["type"] == "line"
+
+
+def test_category_column_makes_a_bar_chart():
+    rows = [("SP", 1520.5, 12), ("RJ", 980.0, 7), ("MG", 410.25, 3)]
+
+    handled, spec = build_chart_spec(_result(["customer_state", "revenue", "orders"], rows))
+
+    assert handled
+    assert (spec["type"], spec["xKey"], spec["title"]) == ("bar", "customer_state", "Revenue, Orders by Customer State")
+    assert [series["dataKey"] for series in spec["series"]] == ["revenue", "orders"]
+    assert spec["data"][0] == {"customer_state": "SP", "revenue": 1520.5, "orders": 12}
+
+
+def test_numeric_id_columns_are_categories():
+    handled, spec = build_chart_spec(_result(["seller_id", "revenue"], [(1, 10.0), (2, 20.0)]))
+
+    assert handled
+    assert (spec["type"], spec["xKey"]) == ("bar", "seller_id")
+
+
+def test_too_many_categories_are_left_to_the_llm(monkeypatch):
+    monkeypatch.setattr(charts, "CHART_MAX_CATEGORIES", 3)
+    rows = [(f"city {idx}", float(idx)) for idx in range(4)]
+
+    assert build_chart_spec(_result(["customer_city", "revenue"], rows)) == (False, None)
+    assert build_chart_spec(_result(["customer_city", "revenue"], rows[:3]))[0]
+
+
+def test_ambiguous_shapes_are_left_to_the_llm():
+    # Two dimensions
+    assert build_chart_spec(_result(
+        ["customer_state", "customer_city", "revenue"], [("SP", "sao paulo", 10.0), ("RJ", "rio de janeiro", 5.0)]
+    )) == (False, None)
+    assert build_chart_spec(_result(
+        ["month", "order_status", "orders"], [("2018-01-01", "delivered", 10), ("2018-01-01", "canceled", 1)]
+    )) == (False, None)
+    # Nothing to plot
+    assert build_chart_spec(_result(
+        ["customer_id", "customer_city"], [("c1", "sao paulo"), ("c2", "curitiba")]
+    )) == (False, None)
+    # Numbers only
+    assert build_chart_spec(_result(["price", "freight_value"], [(10.0, 1.5), (20.0, 2.5)])) == (False, None)
@@ -0,0 +1,112 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from src import chat_context
+from src.chat_context import build_history_context, latest_question, split_history
+
+
+def _conversation(turns, current=None):
+    """
+    `turns` answered question / answer pairs, then the unanswered `current` question if given.
+    """
+    messages = []
+    for idx in range(1, turns + 1):
+        messages += [HumanMessage(content=f"question {idx}"), AIMessage(content=f"answer {idx}")]
+    if current:
+        messages.append(HumanMessage(content=current))
+    return messages
+
+
+def _contents(messages):
+    return [message.content for message in messages]
+
+
+@pytest.fixture(autouse=True)
+def window(monkeypatch):
+    monkeypatch.setattr(chat_context, "HISTORY_WINDOW_TURNS", 3)
+    monkeypatch.setattr(chat_context, "HISTORY_WINDOW_TOKENS", 1500)
+
+
+def test_empty_history():
+    assert split_history([]) == ([], [], [])
+    assert split_history([], answered=True) == ([], [], [])
+    assert build_history_context([], None) == ""
+    assert latest_question([]) == ""
+
+
+def test_split_while_answering():
+    to_fold, window, current = split_history(_conversation(5, current="question 6"))
+
+    assert _contents(current) == ["question 6"]
+    assert _contents(window) == ["question 3", "answer 3", "question 4", "answer 4", "question 5", "answer 5"]
+    assert _contents(to_fold) == ["question 1", "answer 1", "question 2", "answer 2"]
+
+
+def test_split_after_answering():
+    messages = _conversation(5)
+
+    to_fold, window, current = split_history(messages, answered=True)
+    assert current == []
+    assert _contents(window) == ["question 3", "answer 3", "question 4", "answer 4", "question 5", "answer 5"]
+    assert _contents(to_fold) == ["question 1", "answer 1", "question 2", "answer 2"]
+
+    # Unanswered, the same messages keep the last turn out of the window
+    to_fold, window, current = split_history(messages)
+    assert _contents(current) == ["question 5", "answer 5"]
+    assert _contents(window) == ["question 2", "answer 2", "question 3", "answer 3", "question 4", "answer 4"]
+    assert _contents(to_fold) == ["question 1", "answer 1"]
+
+
+def test_short_history_is_not_folded():
+    to_fold, window, current = split_history(_conversation(2, current="question 3"))
+
+    assert to_fold == []
+    assert _contents(window) == ["question 1", "answer 1", "question 2", "answer 2"]
+
+
+def test_token_budget_folds_the_oldest_turns_first(monkeypatch):
+    messages = _conversation(3, current="question 4")
+    messages[1] = AIMessage(content="a long table " * 200)  # answer 1, ~650 tokens
+    monkeypatch.setattr(chat_context, "HISTORY_WINDOW_TOKENS", 100)
+
+    to_fold, window, _ = split_history(messages)
+
+    assert _contents(window) == ["question 2", "answer 2", "question 3", "answer 3"]
+    assert _contents(to_fold)[0] == "question 1"
+
+
+def test_turn_larger_than_the_budget_is_folded(monkeypatch):
+    messages = _conversation(1, current="question 2")
+    messages[1] = AIMessage(content="a long table " * 200)
+    monkeypatch.setattr(chat_context, "HISTORY_WINDOW_TOKENS", 100)
+
+    to_fold, window, current = split_history(messages)
+
+    assert window == []
+    assert len(to_fold) == 2
+    assert _contents(current) == ["question 2"]
+
+
+def test_window_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(chat_context, "HISTORY_WINDOW_TURNS", 0)
+
+    to_fold, window, _ = split_history(_conversation(2, current="question 3"))
+
+    assert window == []
+    assert len(to_fold) == 4
+
+
+def test_history_context_is_the_summary_and_the_window():
+    context = build_history_context(_conversation(5, current="question 6"), "Asked about revenue by state")
+
+    assert context.splitlines() == [
+        "Summary of the earlier conversation: Asked about revenue by state",
+        "human: question 3", "ai: answer 3",
+        "human: question 4", "ai: answer 4",
+        "human: question 5", "ai: answer 5",
+    ]
+
+
+def test_latest_question():
+    assert latest_question(_conversation(2, current="question 3")) == "question 3"
+    assert latest_question(_conversation(2)) == "question 2"
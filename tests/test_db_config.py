@@ -0,0 +1,80 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from src import db_config
+from src.db_config import get_schema_context, select_tables
+
+
+@pytest.fixture
+def analytics_db(monkeypatch):
+    """
+    Points the analytics engine at a database given by URL, with a fresh schema snapshot.
+    """
+    def use(db_uri):
+        monkeypatch.setenv("ANALYTICS_DATABASE_URL", db_uri)
+        db_config.invalidate_schema_cache(reset_engine=True)
+
+    yield use
+    db_config.invalidate_schema_cache(reset_engine=True)
+
+
+def test_question_naming_two_tables_pulls_in_the_joining_table(olist_db, analytics_db):
+    analytics_db(olist_db)
+
+    # customers -> orders -> order_payments
+    assert sorted(select_tables("revenue by customer city")) == ["customers", "order_payments", "orders"]
+    # customers -> orders -> order_items -> products
+    assert sorted(select_tables("Which product categories do customers in SP buy?")) == [
+        "customers", "order_items", "orders", "products",
+    ]
+
+
+def test_best_matching_table_comes_first(olist_db, analytics_db):
+    analytics_db(olist_db)
+
+    assert select_tables("payment types by product category")[0] == "order_payments"
+    assert select_tables("SELECT * FROM products p WHERE p.weight > 10")[0] == "products"
+
+
+def test_unrelated_text_selects_nothing(olist_db, analytics_db):
+    analytics_db(olist_db)
+
+    assert select_tables("hello there") == []
+    assert get_schema_context("hello there") == db_config.get_schema_info()
+
+
+def test_schema_context_lists_the_join_conditions(olist_db, analytics_db):
+    analytics_db(olist_db)
+
+    context = get_schema_context("revenue by customer city", compact=True)
+
+    assert context.splitlines()[:3] == [
+        "customers(customer_id TEXT, customer_unique_id TEXT, customer_zip_code_prefix TEXT, customer_city TEXT, customer_state TEXT)",
+        "order_payments(order_id TEXT, payment_sequential INTEGER, payment_type TEXT, payment_installments INTEGER, payment_value FLOAT)",
+        "orders(order_id TEXT, customer_id TEXT, order_status TEXT, order_purchase_timestamp TEXT, order_delivered_customer_date TEXT)",
+    ]
+    assert context.splitlines()[3] == (
+        "Join on: order_payments.order_id = orders.order_id; orders.customer_id = customers.customer_id"
+    )
+
+
+def test_declared_foreign_keys_are_join_edges(tmp_path, analytics_db):
+    # Keys named so that only the declared foreign keys can join the tables
+    db_uri = f"sqlite:///{tmp_path / 'keys.db'}"
+    engine = create_engine(db_uri)
+    with engine.begin() as conn:
+        for statement in [
+            "CREATE TABLE customers (customer_id TEXT PRIMARY KEY, customer_city TEXT)",
+            "CREATE TABLE orders (order_id TEXT PRIMARY KEY, buyer TEXT REFERENCES customers (customer_id), order_status TEXT)",
+            "CREATE TABLE order_payments (payment_order TEXT REFERENCES orders (order_id), payment_value REAL)",
+            "CREATE TABLE products (product_id TEXT PRIMARY KEY, product_category_name TEXT)",
+            "CREATE TABLE order_items (order_id TEXT, product_id TEXT, price REAL)",
+        ]:
+            conn.execute(text(statement))
+    engine.dispose()
+    analytics_db(db_uri)
+
+    assert sorted(select_tables("revenue by customer city")) == ["customers", "order_payments", "orders"]
+    assert "Join on: order_payments.payment_order = orders.order_id; orders.buyer = customers.customer_id" in (
+        get_schema_context("revenue by customer city", compact=True)
+    )
@@ -0,0 +1,62 @@
+import psycopg2
+import pytest
+
+from src import db_history
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """
+    Captures the batches the history writer sends to the database; a message whose content is
+    "bad" fails the way a payload the driver can't adapt does.
+    """
+    written = []
+
+    def write_batch(sessions, messages):
+        if any(message[2] == "bad" for message in messages):
+            raise TypeError("can't adapt type 'object'")
+        written.append((sessions, messages))
+
+    monkeypatch.setattr(db_history, "HISTORY_WRITE_BEHIND", False)  # Flush on every write, no thread
+    monkeypatch.setattr(db_history, "_write_batch", write_batch)
+    monkeypatch.setattr(db_history, "_writer_stats", {"flushes": 0, "rows_written": 0, "rows_dropped": 0, "flush_errors": 0})
+    db_history._dirty_threads.clear()
+    return written
+
+
+def test_flushed_threads_are_no_longer_dirty(writes):
+    db_history.ensure_session("t1", "Revenue")
+    db_history.save_message("t1", "user", "Show revenue by month")
+
+    assert not db_history._dirty_threads
+    assert [len(sessions) + len(messages) for sessions, messages in writes] == [1, 1]
+
+
+def test_rows_that_fail_to_write_are_dropped_and_release_their_thread(writes):
+    db_history.ensure_session("t1", "Revenue")
+    db_history.save_message("t1", "user", "bad")
+
+    stats = db_history.get_writer_stats()
+    assert stats["rows_dropped"] == 1
+    assert stats["flush_errors"] == 1
+    assert stats["queued"] == 0
+    # Otherwise every later read of t1 would flush first, forever
+    assert not db_history._dirty_threads
+
+
+def test_connection_errors_keep_the_batch_queued(writes, monkeypatch):
+    def unavailable(sessions, messages):
+        raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    monkeypatch.setattr(db_history, "_write_batch", unavailable)
+    with pytest.raises(psycopg2.OperationalError):
+        db_history.save_message("t1", "user", "Show revenue by month")
+
+    assert db_history.get_writer_stats()["queued"] == 1
+    assert db_history._dirty_threads["t1"] == 1
+
+    monkeypatch.setattr(db_history, "_write_batch", lambda sessions, messages: writes.append((sessions, messages)))
+    db_history.flush_history()
+
+    assert db_history.get_writer_stats()["queued"] == 0
+    assert not db_history._dirty_threads
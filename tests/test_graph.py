@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.memory import MemorySaver
+
+from src import db_config, llm_gateway, result_cache, sql_cache
+from src.graph import MAX_RETRIES, workflow
+from src.script.fake_llm import CANNED_SQL, FakeAnalystModel
+
+BROKEN_SQL = "SELECT o.order_id FROM missing_orders o"
+
+
+class FailingModel(FakeAnalystModel):
+    """
+    Canned analyst model that answers every prompt with broken SQL while failing is set.
+    """
+
+    failing: bool = True
+    prompts: list = []
+
+    def respond(self, messages):
+        prompt = "\n".join(message.content for message in messages)
+        self.prompts.append(prompt)
+        return BROKEN_SQL if self.failing else super().respond(messages)
+
+
+@pytest.fixture
+def model(olist_db, monkeypatch):
+    monkeypatch.setenv("ANALYTICS_DATABASE_URL", olist_db)
+    db_config.invalidate_schema_cache(reset_engine=True)
+    monkeypatch.setattr(sql_cache, "SQL_CACHE_ENABLED", False)
+    result_cache.invalidate_result_cache()
+
+    model = FailingModel(prompts=[])
+    llm_gateway.set_model(model)
+    yield model
+
+    llm_gateway._overrides.clear()
+    db_config.invalidate_schema_cache(reset_engine=True)
+
+
+def test_a_failed_turn_does_not_leak_into_the_next_one(model):
+    app = workflow.compile(checkpointer=MemorySaver(), interrupt_before=["send_email"])
+    config = {"configurable": {"thread_id": "t1"}}
+
+    async def ask(question):
+        async for _ in app.astream({"messages": [HumanMessage(content=question)]}, config=config):
+            pass
+        return (await app.aget_state(config)).values
+
+    failed = asyncio.run(ask("How many orders were delivered?"))
+    assert failed["error"] and failed["retry_count"] == MAX_RETRIES
+
+    model.failing = False
+    del model.prompts[:]
+    answered = asyncio.run(ask("How many orders were shipped?"))
+
+    # A fresh query for the new question, not a repair of the one the last turn gave up on
+    assert not any("previous query you generated failed" in prompt for prompt in model.prompts)
+    assert answered["sql_query"] == " ".join(dict(CANNED_SQL)["how many"].split())
+    assert answered["error"] is None and answered["retry_count"] == 0
@@ -0,0 +1,73 @@
+import pytest
+
+from src.intent import classify_intent
+
+
+@pytest.mark.parametrize("question", [
+    "Draft an email to the top 5 customers by spend",
+    "Find the top 10 customers and send them a discount coupon",
+    "Email the customers from Rio who haven't ordered in 6 months",
+    "e-mail our biggest spenders",
+    "Please contact the customers with late deliveries",
+    "Write a thank-you note to customers with 5 orders or more",
+    "Get the customers with canceled orders and then reach out to them",
+    "Compose a newsletter for customers in Sao Paulo",
+    "Prepare a promotional campaign for customers in SP",
+    "Which customers spent the most? Send them an offer.",
+    "List inactive customers and notify them",
+])
+def test_email_intent(question):
+    assert classify_intent(question)["email"]
+
+
+@pytest.mark.parametrize("question", [
+    # The false positive that motivated the router: "send" without a message to send
+    "Which customers did we send orders to?",
+    "How many orders did we send to Sao Paulo last month?",
+    "Orders sent per state in 2018",
+    "Show customers whose email is missing",
+    "What is the average discount per order?",
+    "What share of offers were redeemed?",
+    "List the top sellers by revenue",
+    "How many messages were delivered?",
+    "List customers to contact in SP",
+    "Which customers should we reach out to?",
+])
+def test_no_email_intent(question):
+    assert not classify_intent(question)["email"]
+
+
+@pytest.mark.parametrize("question", [
+    "Show revenue by month",
+    "Plot the number of orders over time",
+    "Top 5 product categories",
+    "Monthly sales in 2018",
+    "Compare credit card and boleto payments",
+    "How many orders per state?",
+    "What is the trend of the average freight value?",
+    "List all customers in Curitiba",
+])
+def test_chart_intent(question):
+    assert classify_intent(question)["chart"]
+
+
+@pytest.mark.parametrize("question", [
+    "How many orders were delivered?",
+    "How much revenue did we make in 2018?",
+    "What is the average order value?",
+    "what's the total freight paid",
+    "Total revenue in 2018",
+    "Count the customers in SP",
+    "Are there orders without payments?",
+])
+def test_no_chart_intent(question):
+    assert not classify_intent(question)["chart"]
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("Draft an email to the top 5 customers by spend", {"chart": True, "email": True}),
+    ("How many customers did we email last week?", {"chart": False, "email": False}),
+    ("  HOW   MANY orders were canceled?  ", {"chart": False, "email": False}),
+])
+def test_classify_intent(question, expected):
+    assert classify_intent(question) == expected
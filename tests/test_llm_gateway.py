@@ -0,0 +1,49 @@
+import asyncio
+
+from langchain_core.prompt_values import StringPromptValue
+
+from src import llm_gateway
+
+
+class SlowModel:
+    """
+    Stands in for a chat model: answers every call after `latency` seconds and counts the calls.
+    """
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.calls = 0
+
+    async def ainvoke(self, prompt_value, config=None):
+        self.calls += 1
+        call = self.calls
+        await asyncio.sleep(self.latency)
+        return f"answer {call}"
+
+
+def _call(model, text="top 5 customers"):
+    return llm_gateway._coalesced_call("sql_analyst", model, "fake-model", {}, StringPromptValue(text=text), None)
+
+
+def test_identical_prompts_in_flight_share_one_call():
+    model = SlowModel()
+
+    async def scenario():
+        return await asyncio.gather(_call(model), _call(model), _call(model, "revenue by month"))
+
+    first, second, other = asyncio.run(scenario())
+
+    assert first == second
+    assert other != first
+    assert model.calls == 2
+
+
+def test_calls_are_not_shared_when_coalescing_is_off(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_COALESCE", False)
+    model = SlowModel()
+
+    async def scenario():
+        return await asyncio.gather(_call(model), _call(model))
+
+    assert asyncio.run(scenario()) == ["answer 1", "answer 2"]
+    assert not llm_gateway._inflight
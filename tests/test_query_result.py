@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+
+from src import query_result
+from src.query_result import fetch_query_result
+
+
+@pytest.fixture(scope="module")
+def db(olist_db):
+    # fetch_query_result only uses the SQLDatabase's engine
+    engine = create_engine(olist_db)
+    yield SimpleNamespace(_engine=engine)
+    engine.dispose()
+
+
+def test_result_within_the_row_cap_is_complete(db):
+    result = fetch_query_result(db, "SELECT order_id, order_status FROM orders ORDER BY order_id LIMIT 5", max_rows=10)
+
+    assert result["columns"] == ["order_id", "order_status"]
+    assert result["row_count"] == 5
+    assert len(result["data"][0]) == 5
+    assert result["total_rows"] == 5
+    assert not result["truncated"]
+
+
+def test_result_of_exactly_max_rows_is_not_truncated(db):
+    result = fetch_query_result(db, "SELECT order_id FROM orders LIMIT 10", max_rows=10)
+
+    assert result["row_count"] == 10
+    assert not result["truncated"]
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM orders",
+    "SELECT * FROM orders LIMIT 1000",
+    "SELECT * FROM orders; -- every order",
+])
+def test_rows_beyond_the_cap_are_dropped_and_counted(db, sql):
+    result = fetch_query_result(db, sql, max_rows=10)
+
+    assert result["row_count"] == 10
+    assert result["truncated"]
+    assert result["total_rows"] == 200
+
+
+def test_row_cap_goes_before_a_trailing_offset(db):
+    # SQLite only accepts OFFSET after a LIMIT
+    result = fetch_query_result(db, "SELECT order_id FROM orders ORDER BY order_id OFFSET 195", max_rows=10)
+
+    assert result["row_count"] == 5
+    assert not result["truncated"]
+
+
+def test_byte_budget_truncates_before_the_row_cap(db):
+    full = fetch_query_result(db, "SELECT * FROM orders", max_rows=1000)
+    result = fetch_query_result(db, "SELECT * FROM orders", max_rows=1000, max_bytes=2000)
+
+    assert not full["truncated"] and full["row_count"] == 200
+    assert 0 < result["row_count"] < 200
+    assert result["truncated"]
+    assert result["total_rows"] == 200
+
+
+def test_truncated_rows_are_not_counted_when_disabled(db, monkeypatch):
+    monkeypatch.setattr(query_result, "QUERY_COUNT_TRUNCATED", False)
+
+    result = fetch_query_result(db, "SELECT * FROM orders", max_rows=10)
+
+    assert result["truncated"]
+    assert result["total_rows"] is None
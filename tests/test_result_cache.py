@@ -0,0 +1,159 @@
+import asyncio
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+
+from src import result_cache
+from src.result_cache import canonicalize_sql
+
+
+def _query(runs):
+    """
+    Stands in for the execution of one SQL query, appending to `runs` each time it runs.
+    """
+    async def run():
+        runs.append(None)
+        await asyncio.sleep(0.05)
+        return f"rows {len(runs)}"
+
+    return run
+
+
+def test_shared_fetch_runs_identical_queries_once():
+    runs = []
+
+    async def scenario():
+        result_cache.start_shared_fetches()
+        shared = await asyncio.gather(
+            result_cache.shared_fetch("SELECT * FROM orders", _query(runs)),
+            result_cache.shared_fetch("select *  from orders;", _query(runs)),
+        )
+        # Finished runs are reused for the rest of the batch
+        return shared + [await result_cache.shared_fetch("SELECT * FROM orders", _query(runs))]
+
+    assert asyncio.run(scenario()) == ["rows 1", "rows 1", "rows 1"]
+    assert len(runs) == 1
+
+
+def test_shared_fetch_outside_a_batch_always_runs():
+    runs = []
+
+    async def scenario():
+        await asyncio.gather(*(result_cache.shared_fetch("SELECT 1", _query(runs)) for _ in range(2)))
+
+    asyncio.run(scenario())
+    assert len(runs) == 2
+
+
+@pytest.mark.parametrize("first, second", [
+    ("SELECT * FROM orders", "select *\n  from   orders ;"),
+    ("SELECT * FROM orders -- all of them", "/* every order */ SELECT * FROM orders"),
+    ("SELECT COUNT(*) FROM Orders WHERE order_status = 'delivered'", "select count(*) from orders where order_status = 'delivered';"),
+])
+def test_equivalent_spellings_share_a_key(first, second):
+    assert canonicalize_sql(first) == canonicalize_sql(second)
+
+
+@pytest.mark.parametrize("first, second", [
+    # Literals and quoted identifiers keep their case and spacing
+    ("SELECT * FROM customers WHERE customer_city = 'Sao Paulo'", "SELECT * FROM customers WHERE customer_city = 'sao paulo'"),
+    ("SELECT * FROM customers WHERE customer_city = 'sao  paulo'", "SELECT * FROM customers WHERE customer_city = 'sao paulo'"),
+    ('SELECT "Total" FROM revenue', 'SELECT "total" FROM revenue'),
+    # Comment markers inside literals are text
+    ("SELECT * FROM orders WHERE order_id = '--1'", "SELECT * FROM orders WHERE order_id = '--2'"),
+    ("SELECT * FROM orders WHERE order_id = '/*1*/'", "SELECT * FROM orders WHERE order_id = '/*2*/'"),
+])
+def test_different_queries_have_different_keys(first, second):
+    assert canonicalize_sql(first) != canonicalize_sql(second)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """
+    An empty result cache whose clock only moves when the test says so.
+    """
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(result_cache, "_entries", OrderedDict())
+    monkeypatch.setattr(result_cache, "_total_bytes", 0)
+    monkeypatch.setattr(result_cache, "_stats", dict.fromkeys(result_cache._stats, 0))
+    monkeypatch.setattr(result_cache, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_TTL", 300.0)
+    return clock
+
+
+def _rows(count):
+    return {"columns": ["order_id"], "data": [[f"order {idx:04d}" for idx in range(count)]]}
+
+
+def test_hit_on_an_equivalent_query(cache):
+    result_cache.put("SELECT * FROM orders", _rows(3))
+
+    assert result_cache.get("select * from orders;") == (True, _rows(3))
+    assert result_cache.get("SELECT * FROM customers") == (False, None)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM orders ORDER BY random() LIMIT 5",
+    "SELECT * FROM orders WHERE order_purchase_timestamp > NOW () - INTERVAL '7 days'",
+    "SELECT COUNT(*) FROM orders WHERE order_purchase_timestamp::date = CURRENT_DATE",
+])
+def test_volatile_queries_are_not_cached(cache, sql):
+    result_cache.put(sql, _rows(3))
+
+    assert result_cache.get(sql) == (False, None)
+
+
+def test_entries_expire_after_the_ttl(cache):
+    result_cache.put("SELECT * FROM orders", _rows(3))
+
+    cache.now += 299
+    assert result_cache.get("SELECT * FROM orders")[0]
+
+    cache.now += 1
+    assert result_cache.get("SELECT * FROM orders") == (False, None)
+    stats = result_cache.get_cache_stats()
+    assert (stats["expired"], stats["entries"], stats["bytes"]) == (1, 0, 0)
+
+
+def test_cache_disabled_with_a_zero_ttl(cache, monkeypatch):
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_TTL", 0)
+    result_cache.put("SELECT * FROM orders", _rows(3))
+
+    assert result_cache.get("SELECT * FROM orders") == (False, None)
+
+
+def test_least_recently_used_entries_are_evicted_to_fit_the_byte_budget(cache, monkeypatch):
+    size = result_cache._estimate_size(_rows(10))
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_MAX_BYTES", size * 2)
+
+    result_cache.put("SELECT 1", _rows(10))
+    result_cache.put("SELECT 2", _rows(10))
+    result_cache.get("SELECT 1")  # SELECT 2 is now the least recently used
+    result_cache.put("SELECT 3", _rows(10))
+
+    assert result_cache.get("SELECT 1")[0]
+    assert not result_cache.get("SELECT 2")[0]
+    assert result_cache.get("SELECT 3")[0]
+    stats = result_cache.get_cache_stats()
+    assert (stats["evictions"], stats["entries"], stats["bytes"]) == (1, 2, size * 2)
+
+
+def test_results_larger_than_the_budget_are_not_cached(cache, monkeypatch):
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_MAX_BYTES", result_cache._estimate_size(_rows(10)))
+    result_cache.put("SELECT 1", _rows(10))
+
+    result_cache.put("SELECT 2", _rows(1000))
+
+    assert result_cache.get("SELECT 1")[0]
+    assert not result_cache.get("SELECT 2")[0]
+    assert result_cache.get_cache_stats()["skipped_too_large"] == 1
+
+
+def test_invalidate_drops_everything(cache):
+    result_cache.put("SELECT 1", _rows(3))
+
+    result_cache.invalidate_result_cache()
+
+    assert result_cache.get("SELECT 1") == (False, None)
+    assert result_cache.get_cache_stats()["bytes"] == 0
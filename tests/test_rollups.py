@@ -0,0 +1,75 @@
+import pytest
+
+from src import result_cache, rollups
+from src.script.olist_fixture import load_fixture
+
+
+@pytest.fixture
+def rollup_db(tmp_path, monkeypatch):
+    db_uri = f"sqlite:///{tmp_path / 'rollups.db'}"
+    load_fixture(db_uri, customers_count=20, orders_count=50)
+    monkeypatch.setenv("DATABASE_URL", db_uri)
+    monkeypatch.setattr(rollups, "ROLLUP_REFRESH_INTERVAL", 3600.0)
+    monkeypatch.setattr(rollups, "_engine", None)
+    rollups._status.clear()
+    yield db_uri
+    rollups.stop_rollup_refresher()
+    rollups._status.clear()
+
+
+def _refreshed_at():
+    return {name: status["refreshed_at"] for name, status in rollups.get_rollup_stats()["rollups"].items()}
+
+
+def test_existing_rollups_are_available_before_any_refresh(rollup_db):
+    rollups.create_rollups()
+    rollups._status.clear()  # A worker that starts after the rollups were created
+
+    rollups.load_rollup_status()
+
+    assert rollups.available_rollups() == list(rollups.ROLLUPS)
+    assert all(_refreshed_at().values())
+
+
+def test_missing_rollups_stay_unavailable(rollup_db):
+    rollups.load_rollup_status()
+
+    assert rollups.available_rollups() == []
+    assert rollups.route("revenue by month") is None
+
+
+def test_recently_refreshed_rollups_are_not_refreshed_again(rollup_db):
+    rollups.create_rollups()
+    created = _refreshed_at()
+
+    rollups.refresh_rollups()
+    assert _refreshed_at() == created
+
+    rollups.refresh_rollups(force=True)
+    assert all(_refreshed_at()[name] > created[name] for name in rollups.ROLLUPS)
+
+
+def test_stale_rollups_are_refreshed(rollup_db, monkeypatch):
+    rollups.create_rollups()
+    created = _refreshed_at()
+    monkeypatch.setattr(rollups, "ROLLUP_REFRESH_INTERVAL", 0.0)
+
+    rollups.refresh_rollups()
+
+    assert all(_refreshed_at()[name] > created[name] for name in rollups.ROLLUPS)
+    assert rollups.available_rollups() == list(rollups.ROLLUPS)
+
+
+def test_refresh_drops_results_cached_from_the_old_contents(rollup_db, monkeypatch):
+    rollups.create_rollups()
+    sql = rollups.route("revenue by month")[1]
+    result_cache.put(sql, {"data": "before the refresh"})
+    assert result_cache.get(sql)[0]
+
+    rollups.refresh_rollups()  # Nothing is due yet: the cached result stays
+    assert result_cache.get(sql)[0]
+
+    monkeypatch.setattr(rollups, "ROLLUP_REFRESH_INTERVAL", 0.0)
+    rollups.refresh_rollups()
+
+    assert result_cache.get(sql) == (False, None)
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from src.single_flight import single_flight
+
+
+class SlowCall:
+    """
+    Stands in for a slow call (a query, an LLM request): takes `latency` seconds and counts the calls.
+    """
+
+    def __init__(self, latency=0.05, error=None):
+        self.latency = latency
+        self.error = error
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        call = self.calls
+        await asyncio.sleep(self.latency)
+        if self.error:
+            raise self.error
+        return f"result {call}"
+
+
+def test_identical_calls_in_flight_share_one_call():
+    call, inflight, joins = SlowCall(), {}, []
+
+    async def scenario():
+        return await asyncio.gather(
+            single_flight(inflight, "a", call, on_join=lambda: joins.append("a")),
+            single_flight(inflight, "a", call, on_join=lambda: joins.append("a")),
+            single_flight(inflight, "b", call),
+        )
+
+    assert asyncio.run(scenario()) == ["result 1", "result 1", "result 2"]
+    assert call.calls == 2
+    assert joins == ["a"]
+    assert not inflight
+
+
+def test_kept_results_are_reused_after_the_call():
+    call, inflight = SlowCall(latency=0), {}
+
+    async def scenario():
+        first = await single_flight(inflight, "a", call, keep_result=True)
+        return first, await single_flight(inflight, "a", call, keep_result=True)
+
+    assert asyncio.run(scenario()) == ("result 1", "result 1")
+    assert call.calls == 1
+
+
+def test_cancelled_leader_does_not_cancel_joined_callers():
+    call, inflight = SlowCall(), {}
+
+    async def scenario():
+        leader = asyncio.create_task(single_flight(inflight, "a", call))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(single_flight(inflight, "a", call)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+
+        leader.cancel()
+        results = await asyncio.gather(*followers)
+        return leader, results
+
+    leader, results = asyncio.run(scenario())
+
+    assert leader.cancelled()
+    # The first follower to wake up makes the call again, the other one joins it
+    assert results == ["result 2", "result 2"]
+    assert call.calls == 2
+    assert not inflight
+
+
+def test_joined_callers_get_the_error_and_later_callers_call_again():
+    call, inflight = SlowCall(error=RuntimeError("connection reset")), {}
+
+    async def scenario():
+        return await asyncio.gather(*(single_flight(inflight, "a", call, keep_result=True) for _ in range(2)),
+                                    return_exceptions=True)
+
+    assert [str(result) for result in asyncio.run(scenario())] == ["connection reset", "connection reset"]
+    assert call.calls == 1
+    assert not inflight
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(single_flight(inflight, "a", call, keep_result=True))
+    assert call.calls == 2
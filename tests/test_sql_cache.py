@@ -0,0 +1,104 @@
+from collections import OrderedDict
+
+import pytest
+
+from src import sql_cache
+from src.sql_cache import has_history_dependency, lookup, normalize_question, schema_fingerprint
+
+SCHEMA = "CREATE TABLE orders (order_id TEXT, customer_id TEXT, order_status TEXT)"
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """
+    An empty in-memory cache with the similarity lookup on, without app_sql_cache behind it.
+    Returns a function that caches SQL for a question.
+    """
+    schema_hash = schema_fingerprint(SCHEMA)
+    monkeypatch.setattr(sql_cache, "_entries", OrderedDict())
+    monkeypatch.setattr(sql_cache, "_loaded_schemas", {schema_hash})
+    monkeypatch.setattr(sql_cache, "_touch", lambda schema_hash, question_key: None)
+    monkeypatch.setattr(sql_cache, "SQL_CACHE_ENABLED", True)
+    monkeypatch.setattr(sql_cache, "SQL_CACHE_SIMILARITY", 0.8)
+
+    def put(question, sql):
+        sql_cache._remember((schema_hash, normalize_question(question)), question, sql)
+
+    return put
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("Show me the TOP 5 customers!", "top 5 customers"),
+    ("  can you list   the orders, please? ", "orders"),
+    ("Revenue by customer_state", "revenue by customer_state"),
+])
+def test_normalize_question(question, expected):
+    assert normalize_question(question) == expected
+
+
+def test_schema_fingerprint_ignores_sample_rows():
+    with_rows = SCHEMA + "\n/*\n3 rows from orders table:\no1 c1 delivered\n*/"
+    other_rows = SCHEMA + "\n/*\n3 rows from orders table:\no9 c9 shipped\n*/"
+
+    assert schema_fingerprint(with_rows) == schema_fingerprint(other_rows) == schema_fingerprint(SCHEMA)
+    assert schema_fingerprint(SCHEMA + " CREATE TABLE products (product_id TEXT)") != schema_fingerprint(SCHEMA)
+
+
+def test_normalized_match(cache):
+    cache("Top 5 customers by total spend", "SELECT 5")
+
+    assert lookup("Top 5 customers by total spend", SCHEMA) == "SELECT 5"
+    assert lookup("show me the top 5 customers by total spend!", SCHEMA) == "SELECT 5"
+    assert lookup("Top 5 customers by total spend", SCHEMA + " CREATE TABLE x (y TEXT)") is None
+
+
+@pytest.mark.parametrize("cached, question", [
+    ("Top customers by total spend", "What are the top customers by total spend?"),
+    ("Which customers have the highest total spend?", "Do you know which customers have the highest total spend?"),
+    ("Total number of delivered orders per month for customers in SP in 2018",
+     "What is the total number of delivered orders per month for customers in SP in 2018?"),
+])
+def test_paraphrases_above_the_threshold_match(cache, cached, question):
+    cache(cached, "SELECT cached")
+
+    assert lookup(question, SCHEMA) == "SELECT cached"
+
+
+@pytest.mark.parametrize("cached, question", [
+    # Numbers
+    ("Top 5 customers by total spend", "Top 10 customers by total spend"),
+    ("Top 5 customers by total spend", "Top five customers by total spend"),
+    ("Top 5 customers in 10 cities", "Top 10 customers in 5 cities"),
+    ("Orders per month in 2017", "Orders per month in 2018"),
+    # Entities
+    ("Total number of delivered orders per month for customers in SP in 2018",
+     "Total number of delivered orders per month for customers in RJ in 2018"),
+    ("Revenue of customers in Sao Paulo", "Revenue of customers in Curitiba"),
+    ("Monthly revenue for credit card payments", "Monthly revenue for boleto payments"),
+    ("Number of delivered orders per state", "Number of canceled orders per state"),
+    # Extra words
+    ("Which customers spent the most", "Which customers spent the most money on furniture"),
+])
+def test_questions_asking_for_something_else_do_not_match(cache, cached, question):
+    cache(cached, "SELECT cached")
+
+    assert lookup(question, SCHEMA) is None
+
+
+def test_paraphrase_below_the_threshold_does_not_match(cache, monkeypatch):
+    cache("Top customers by total spend", "SELECT cached")
+
+    monkeypatch.setattr(sql_cache, "SQL_CACHE_SIMILARITY", 0.95)
+    assert lookup("What are the top customers by total spend?", SCHEMA) is None
+
+    monkeypatch.setattr(sql_cache, "SQL_CACHE_SIMILARITY", 0)
+    assert lookup("What are the top customers by total spend?", SCHEMA) is None
+
+
+def test_follow_up_questions_bypass_the_cache(cache):
+    cache("Revenue by city", "SELECT cached")
+
+    assert lookup("Show them by city", SCHEMA) is None
+    assert lookup("Revenue by city", SCHEMA, history=["Top 5 customers"]) is None
+    assert has_history_dependency("Filter those to SP", [])
+    assert not has_history_dependency("Revenue by city", [])
@@ -0,0 +1,118 @@
+import pytest
+
+from src.sql_guard import SqlValidationError, check_references, enforce_limit, strip_statement
+
+SCHEMA = {
+    "customers": {"customer_id", "customer_unique_id", "customer_city", "customer_state"},
+    "orders": {"order_id", "customer_id", "order_status", "order_purchase_timestamp"},
+    "order_payments": {"order_id", "payment_type", "payment_value"},
+}
+
+
+@pytest.mark.parametrize("sql, expected", [
+    # No LIMIT: capped at max_rows + 1, so truncation can be detected
+    ("SELECT * FROM orders", "SELECT * FROM orders\nLIMIT 501"),
+    ("WITH paid AS (SELECT * FROM order_payments) SELECT * FROM paid", "WITH paid AS (SELECT * FROM order_payments) SELECT * FROM paid\nLIMIT 501"),
+    # A LIMIT inside a subquery does not bound the outer query
+    ("SELECT * FROM (SELECT * FROM orders LIMIT 10) recent", "SELECT * FROM (SELECT * FROM orders LIMIT 10) recent\nLIMIT 501"),
+    # LIMIT within the cap is kept
+    ("SELECT * FROM orders LIMIT 10", "SELECT * FROM orders LIMIT 10"),
+    ("SELECT * FROM orders LIMIT 500", "SELECT * FROM orders LIMIT 500"),
+    # LIMIT above the cap, or ALL, is lowered to the cap
+    ("SELECT * FROM orders LIMIT 1000", "SELECT * FROM orders LIMIT 501"),
+    ("select * from orders limit 2000", "select * from orders limit 501"),
+    ("SELECT * FROM orders LIMIT ALL", "SELECT * FROM orders LIMIT 501"),
+    # OFFSET is kept
+    ("SELECT * FROM orders LIMIT 10 OFFSET 20", "SELECT * FROM orders LIMIT 10 OFFSET 20"),
+    ("SELECT * FROM orders LIMIT 1000 OFFSET 20", "SELECT * FROM orders LIMIT 501 OFFSET 20"),
+    ("SELECT * FROM orders LIMIT ALL OFFSET 5 ROWS", "SELECT * FROM orders LIMIT 501 OFFSET 5 ROWS"),
+    # FETCH FIRST is left to the database
+    ("SELECT * FROM orders FETCH FIRST 10 ROWS ONLY", "SELECT * FROM orders FETCH FIRST 10 ROWS ONLY"),
+    # The LIMIT goes before a trailing OFFSET or locking clause
+    ("SELECT * FROM orders OFFSET 5", "SELECT * FROM orders\nLIMIT 501 OFFSET 5"),
+    ("SELECT * FROM orders FOR UPDATE", "SELECT * FROM orders\nLIMIT 501 FOR UPDATE"),
+    ("SELECT * FROM orders OFFSET 5 ROWS FOR SHARE OF orders NOWAIT", "SELECT * FROM orders\nLIMIT 501 OFFSET 5 ROWS FOR SHARE OF orders NOWAIT"),
+    ("SELECT * FROM orders LIMIT 10 FOR UPDATE", "SELECT * FROM orders LIMIT 10 FOR UPDATE"),
+    ("SELECT * FROM orders LIMIT 1000 OFFSET 5 FOR UPDATE SKIP LOCKED", "SELECT * FROM orders LIMIT 501 OFFSET 5 FOR UPDATE SKIP LOCKED"),
+    ("SELECT SUBSTRING(customer_city FROM 1 FOR 3) FROM customers", "SELECT SUBSTRING(customer_city FROM 1 FOR 3) FROM customers\nLIMIT 501"),
+    # Trailing semicolons and comments don't hide the LIMIT
+    ("SELECT * FROM orders LIMIT 10;", "SELECT * FROM orders LIMIT 10"),
+    ("SELECT * FROM orders LIMIT 10 -- top ten", "SELECT * FROM orders LIMIT 10"),
+    ("SELECT * FROM orders LIMIT 1000; /* all of them */\n-- really", "SELECT * FROM orders LIMIT 501"),
+    ("-- recent orders\nSELECT * FROM orders -- no limit", "SELECT * FROM orders\nLIMIT 501"),
+    # Non-SELECT statements are not touched (check_references rejects them)
+    ("DELETE FROM orders", "DELETE FROM orders"),
+    ("EXPLAIN SELECT * FROM orders", "EXPLAIN SELECT * FROM orders"),
+])
+def test_enforce_limit(sql, expected):
+    assert enforce_limit(sql, 500) == expected
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("  SELECT 1;  ", "SELECT 1"),
+    ("SELECT 1; -- done", "SELECT 1"),
+    ("/* report */ SELECT 1 /* end */", "SELECT 1"),
+    # Comment markers and semicolons inside literals are text
+    ("SELECT '-- not a comment;' AS note", "SELECT '-- not a comment;' AS note"),
+    ("SELECT 1 AS \"a;b\"", "SELECT 1 AS \"a;b\""),
+    ("-- nothing", ""),
+])
+def test_strip_statement(sql, expected):
+    assert strip_statement(sql) == expected
+
+
+@pytest.mark.parametrize("sql", [
+    # Aliases, with and without AS
+    "SELECT c.customer_city, o.order_id FROM customers c JOIN orders AS o ON o.customer_id = c.customer_id",
+    "SELECT orders.order_id FROM orders WHERE orders.order_status = 'delivered'",
+    "SELECT o.order_id FROM public.orders o",
+    # CTEs and subqueries define their own names
+    """WITH spend AS (
+        SELECT o.customer_id, SUM(p.payment_value) AS total
+        FROM orders o JOIN order_payments p ON p.order_id = o.order_id
+        GROUP BY o.customer_id
+    )
+    SELECT s.customer_id, s.total FROM spend s ORDER BY s.total DESC""",
+    "SELECT recent.order_id FROM (SELECT o.order_id FROM orders o ORDER BY o.order_purchase_timestamp DESC) AS recent",
+    "SELECT c.customer_id FROM customers c WHERE c.customer_id IN (SELECT o.customer_id FROM orders o)",
+    # FROM that is not a table reference
+    "SELECT EXTRACT(YEAR FROM o.order_purchase_timestamp) AS year, COUNT(*) FROM orders o GROUP BY 1",
+    "SELECT SUBSTRING(c.customer_city FROM 1 FOR 3) FROM customers c",
+    "SELECT o.order_id FROM orders o JOIN customers c ON c.customer_id = o.customer_id WHERE o.order_status IS DISTINCT FROM c.customer_state",
+    "SELECT o.order_id FROM orders o, customers c WHERE o.customer_id IS NOT DISTINCT FROM c.customer_id",
+    # Quoted identifiers
+    'SELECT "o"."order_id" FROM "orders" "o"',
+    # Keywords inside literals and comments are not references
+    "SELECT o.order_id FROM orders o WHERE o.order_status = 'shipped from warehouse, join x.y'",
+    "SELECT o.order_id FROM orders o -- FROM audit_log a WHERE a.secret",
+    "SELECT o.order_id FROM orders o;",
+    # CTE with a column list, table functions
+    "WITH m(month, total) AS (SELECT 1, 2) SELECT * FROM m",
+    "WITH m (month, total) AS MATERIALIZED (SELECT 1, 2) SELECT m.month FROM m",
+    "SELECT * FROM json_each('{}') j",
+    "SELECT o.order_id, s.n FROM orders o JOIN generate_series(1, 3) AS s(n) ON s.n = 1",
+])
+def test_check_references_accepts_valid_queries(sql):
+    check_references(sql, SCHEMA)
+
+
+@pytest.mark.parametrize("sql, message, fragment", [
+    ("SELECT *\nFROM order o", 'Unknown table "order"', "FROM order o"),
+    ("SELECT c.order_status\nFROM customers c", 'Column "order_status" does not exist in table "customers"', "SELECT c.order_status"),
+    # Quoted identifiers are case-sensitive
+    ('SELECT "c"."Customer_City" FROM customers c', 'Column "Customer_City" does not exist in table "customers"', None),
+    ("SELECT o.order_id FROM orders o JOIN payments p ON p.order_id = o.order_id", 'Unknown table "payments"', None),
+    ("SELECT o.order_id FROM orders o WHERE o.order_status IS DISTINCT FROM o.status", 'Column "status" does not exist in table "orders"', None),
+    ("SELECT EXTRACT(YEAR FROM o.purchased_at) FROM orders o", 'Column "purchased_at" does not exist in table "orders"', None),
+    ("DELETE FROM orders", "Only SELECT queries are allowed", None),
+    ("SELECT 1; DROP TABLE orders", "Only a single SQL statement is allowed", None),
+    ("SELECT COUNT(* FROM orders", "Unbalanced parentheses", None),
+    ("SELECT COUNT(x) AS total FROM total", 'Unknown table "total"', None),
+])
+def test_check_references_rejects_invalid_queries(sql, message, fragment):
+    with pytest.raises(SqlValidationError) as error:
+        check_references(sql, SCHEMA)
+
+    assert str(error.value) == message
+    if fragment is not None:
+        assert error.value.fragment == fragment